@@ -6,11 +6,49 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import os
+import re
 import sys
 
 from elbepack.shellhelper import CommandError, command_out_stderr, command_out
 
 
+# characters, which are not allowed in XML 1.0
+xml_invalid_chars = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+def xml_escape_chars(text):
+    """ replaces the characters of text, which can not be sent in a
+        soap message, e.g. the escape sequences of colour output, by
+        their python escape sequence.
+    """
+    return xml_invalid_chars.sub(lambda m: u'\\x%02x' % ord(m.group()),
+                                 text)
+
+
+def read_log_tail(fname, offset, busy, maxsize=64 * 1024):
+    """ returns the offset to continue from and the log data of fname
+        written since offset. At most maxsize bytes are read. While the
+        log is written (busy is set), the data is cut after the last
+        complete line, unless a single line fills the whole chunk.
+    """
+    try:
+        with open(fname, 'rb') as lf:
+            lf.seek(offset)
+            data = lf.read(maxsize)
+    except IOError:
+        return offset, u''
+
+    if busy:
+        end = data.rfind(b'\n') + 1
+        if end > 0:
+            data = data[:end]
+        elif len(data) < maxsize:
+            data = b''
+
+    return offset + len(data), xml_escape_chars(data.decode('utf-8',
+                                                            'replace'))
+
+
 class LogBase(object):
     def __init__(self, fp):
         self.fp = fp
@@ -45,10 +83,14 @@ class LogBase(object):
                     "---------------------------------------")
         self.printo()
 
-    def do(self, cmd, allow_fail=False, stdin=None, env_add=None):
+    def do(self, cmd, allow_fail=False, stdin=None, env_add=None,
+           log_stdin=True):
 
         if stdin is None:
             self.printo("running cmd +%s+" % cmd)
+        elif not log_stdin:
+            self.printo("running cmd +%s with STDIN (%d bytes)+" %
+                        (cmd, len(stdin)))
         else:
             self.printo("running cmd +%s with STDIN %s+" % (cmd, stdin))
 
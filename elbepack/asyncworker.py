@@ -5,13 +5,12 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-from threading import Thread
-from Queue import Queue
-from os import path, getcwd, chdir
-from contextlib import contextmanager
+from threading import Thread, Condition
+from os import path
 from urllib import quote
 import traceback
 
+from elbepack.config import cfg
 from elbepack.db import get_versioned_filename
 from elbepack.dump import dump_fullpkgs
 from elbepack.updatepkg import gen_update_pkg
@@ -527,37 +526,92 @@ class CheckoutVersionJob(AsyncWorkerJob):
             db.reset_busy(self.project.builddir, "build_failed")
 
 
-@contextmanager
-def savecwd():
-    oldcwd = getcwd()
-    try:
-        yield
-    finally:
-        chdir(oldcwd)
+class ProjectJobQueue(object):
+
+    """ Hands out the jobs in the order they were queued, but never
+        two jobs of the same project builddir at the same time. A job
+        of a busy project is skipped, until the job running for that
+        project is done.
+    """
+
+    def __init__(self):
+        self.cond = Condition()
+        self.pending = []
+        self.active = set()
+        self.stopped = False
+
+    def put(self, job):
+        with self.cond:
+            self.pending.append(job)
+            self.cond.notify_all()
+
+    def _next(self):
+        for i, job in enumerate(self.pending):
+            builddir = job.project.builddir
+            if builddir not in self.active:
+                del self.pending[i]
+                self.active.add(builddir)
+                return job
+        return None
+
+    def get(self):
+        """ returns the next runnable job, or None when the queue is
+            stopped and all pending jobs have been handed out.
+        """
+        with self.cond:
+            while True:
+                job = self._next()
+                if job is not None:
+                    return job
+                if self.stopped and not self.pending:
+                    return None
+                self.cond.wait()
+
+    def task_done(self, job):
+        with self.cond:
+            self.active.discard(job.project.builddir)
+            self.cond.notify_all()
 
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+
+class AsyncWorker(object):
+
+    """ Runs the queued jobs in a pool of worker threads. Jobs of the
+        same project are executed one after the other, jobs of
+        different projects run in parallel.
+    """
 
-class AsyncWorker(Thread):
-    def __init__(self, db):
-        Thread.__init__(self, name="AsyncWorker")
+    def __init__(self, db, workers=None):
         self.db = db
-        self.queue = Queue()
-        self.start()
+        self.queue = ProjectJobQueue()
+
+        if workers is None:
+            workers = int(cfg['asyncworkers'])
+
+        self.threads = []
+        for i in range(max(workers, 1)):
+            t = Thread(target=self.run, name="AsyncWorker-%d" % i)
+            t.start()
+            self.threads.append(t)
 
     def stop(self):
-        self.queue.put(None)
-        self.queue.join()
-        self.join()
+        self.queue.stop()
+        for t in self.threads:
+            t.join()
 
     def enqueue(self, job):
         job.enqueue(self.queue, self.db)
 
     def run(self):
-        loop = True
-        while loop:
+        while True:
             job = self.queue.get()
-            if job is not None:
-                with savecwd():
-                    job.execute(self.db)
-            else:
-                loop = False
-            self.queue.task_done()
+            if job is None:
+                break
+            try:
+                job.execute(self.db)
+            finally:
+                self.queue.task_done(job)
@@ -0,0 +1,102 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# Copyright (c) 2018 Linutronix GmbH
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import time
+import json
+import resource
+
+from contextlib import contextmanager
+
+
+def _read_write_bytes():
+    # /proc/self/io also accounts the I/O of all reaped children,
+    # so the commands spawned via log.do() are included.
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("write_bytes:"):
+                    return int(line.split(":")[1])
+    except (IOError, OSError, ValueError):
+        pass
+    return 0
+
+
+class _Sample(object):
+    def __init__(self):
+        self.wall = time.time()
+        self.self_ru = resource.getrusage(resource.RUSAGE_SELF)
+        self.child_ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.write_bytes = _read_write_bytes()
+
+
+class BuildProfile(object):
+
+    """ Records wall time, cpu time, peak rss and written bytes for
+        each stage of a build, and counters of the whole build. They
+        are written into a json file, so profiles of different builds
+        can be compared.
+    """
+
+    def __init__(self, log=None):
+        self.log = log
+        self.stages = []
+        self.counters = {}
+        self.started = time.time()
+
+    def set_counter(self, name, value):
+        self.counters[name] = value
+        if self.log:
+            self.log.printo("%s: %s" % (name, value))
+
+    @contextmanager
+    def stage(self, name):
+        start = _Sample()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self._add_stage(name, start, _Sample(), failed)
+
+    def _add_stage(self, name, start, end, failed):
+        s = {
+            'name': name,
+            'failed': failed,
+            'wall_time': end.wall - start.wall,
+            'cpu_user': end.self_ru.ru_utime - start.self_ru.ru_utime,
+            'cpu_sys': end.self_ru.ru_stime - start.self_ru.ru_stime,
+            'children_cpu_user':
+                end.child_ru.ru_utime - start.child_ru.ru_utime,
+            'children_cpu_sys':
+                end.child_ru.ru_stime - start.child_ru.ru_stime,
+            # ru_maxrss is a high-water mark in KiB, it can not be
+            # attributed to a single stage. Record the mark reached at
+            # the end of the stage instead.
+            'peak_rss_kb': end.self_ru.ru_maxrss,
+            'children_peak_rss_kb': end.child_ru.ru_maxrss,
+            'bytes_written': end.write_bytes - start.write_bytes}
+
+        self.stages.append(s)
+
+        if self.log:
+            self.log.printo("stage %s took %.2fs (cpu %.2fs, children cpu "
+                            "%.2fs, %d bytes written)" % (
+                                name, s['wall_time'],
+                                s['cpu_user'] + s['cpu_sys'],
+                                s['children_cpu_user'] +
+                                s['children_cpu_sys'],
+                                s['bytes_written']))
+
+    def write(self, fname):
+        d = {'started': self.started,
+             'wall_time': time.time() - self.started,
+             'stages': self.stages,
+             'counters': self.counters}
+
+        tmpname = fname + ".tmp"
+        with open(tmpname, "w") as f:
+            json.dump(d, f, indent=4, sort_keys=True)
+        os.rename(tmpname, fname)
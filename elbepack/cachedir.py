@@ -0,0 +1,218 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# Copyright (c) 2018 Linutronix GmbH
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import fcntl
+import shutil
+import hashlib
+import threading
+
+from contextlib import contextmanager
+
+from elbepack.filesystem import size_to_int
+from elbepack.shellhelper import system, CommandError
+
+cache_root = '/var/cache/elbe'
+
+
+def cache_key(*args):
+    """ builds a stable key from the given values, lists are sorted
+        so that the order of e.g. package lists does not matter.
+    """
+    m = hashlib.sha256()
+    for a in args:
+        if isinstance(a, (list, tuple, set)):
+            a = ",".join(sorted(str(x) for x in a))
+        m.update(("%s\0" % a).encode('utf-8'))
+    return m.hexdigest()
+
+
+def tree_size(path):
+    if not os.path.isdir(path) or os.path.islink(path):
+        return os.lstat(path).st_size
+
+    size = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                size += os.lstat(os.path.join(root, f)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def copy_tree(src, dst):
+    # reflink the files if the filesystem supports it, and fall back
+    # to a plain copy otherwise. Hardlinks are not used, because the
+    # copies are modified in place (e.g. /etc/hosts is appended to).
+    system('mkdir -p "%s"' % dst)
+    system('cp -a --reflink=auto "%s"/. "%s"' % (src, dst))
+
+
+def link_tree(src, dst):
+    # hardlink the files, for trees that are only read, e.g. archived.
+    # Fall back to copy_tree, if src and dst are on different
+    # filesystems.
+    try:
+        system('mkdir -p "%s"' % dst)
+        system('cp -al "%s"/. "%s"' % (src, dst))
+    except CommandError:
+        system('rm -rf "%s"' % dst)
+        copy_tree(src, dst)
+
+
+class CacheDir(object):
+
+    """ A directory below /var/cache/elbe holding cache entries.
+        Each entry is a file or directory named by its key. The size
+        of every entry is recorded in <key>.size, the mtime of that
+        file is the time of the last use. The sum of all sizes is kept
+        in .total. When it exceeds maxsize, the least recently used
+        entries are removed.
+    """
+
+    def __init__(self, name, maxsize, root=cache_root):
+        self.path = os.path.join(root, name)
+        if isinstance(maxsize, str):
+            maxsize = size_to_int(maxsize)
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0
+
+    def fname(self, key):
+        return os.path.join(self.path, key)
+
+    def _stamp(self, key):
+        return os.path.join(self.path, key + ".size")
+
+    @contextmanager
+    def lock(self):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        with open(os.path.join(self.path, ".lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def lookup(self, key):
+        """ returns the path of the entry for key or None. A hit marks
+            the entry as recently used.
+        """
+        stamp = self._stamp(key)
+        if not self.enabled or not os.path.exists(stamp):
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(stamp, None)
+        except OSError:
+            pass
+
+        self.hits += 1
+        return self.fname(key)
+
+    def store(self, key, populate):
+        """ populate(path) is called to create the entry at path. The
+            entry is moved into place atomically, so a concurrent lookup
+            never sees a half written entry.
+        """
+        if not self.enabled:
+            return None
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        tmp = self.fname("%s.tmp.%d.%d" % (key, os.getpid(),
+                                           threading.current_thread().ident))
+        try:
+            populate(tmp)
+            size = tree_size(tmp)
+
+            with self.lock():
+                if os.path.exists(self._stamp(key)):
+                    return self.fname(key)
+
+                # the running total avoids reading all stamps on every
+                # store, they are only read, when entries are evicted
+                total = self._read_total() + size
+
+                self._remove(key)
+                os.rename(tmp, self.fname(key))
+                with open(self._stamp(key), "w") as f:
+                    f.write("%d\n" % size)
+
+                if total > self.maxsize:
+                    self._evict()
+                else:
+                    self._write_total(total)
+        finally:
+            self._rmpath(tmp)
+
+        return self.fname(key)
+
+    def _entries(self):
+        entries = []
+        for f in os.listdir(self.path):
+            if not f.endswith(".size"):
+                continue
+            stamp = os.path.join(self.path, f)
+            try:
+                with open(stamp, "r") as fp:
+                    size = int(fp.read().strip() or 0)
+                entries.append((os.stat(stamp).st_mtime, f[:-5], size))
+            except (IOError, OSError, ValueError):
+                continue
+        return entries
+
+    def _read_total(self):
+        try:
+            with open(os.path.join(self.path, ".total"), "r") as f:
+                return int(f.read().strip())
+        except (IOError, OSError, ValueError):
+            # no total yet, e.g. a cache of an older elbe
+            total = sum(e[2] for e in self._entries())
+            self._write_total(total)
+            return total
+
+    def _write_total(self, total):
+        with open(os.path.join(self.path, ".total"), "w") as f:
+            f.write("%d\n" % total)
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum(e[2] for e in entries)
+
+        for _, key, size in entries:
+            if total <= self.maxsize:
+                break
+            self._remove(key)
+            total -= size
+
+        self._write_total(total)
+
+    def evict(self):
+        if not os.path.isdir(self.path):
+            return
+        with self.lock():
+            self._evict()
+
+    @staticmethod
+    def _rmpath(path):
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, True)
+        elif os.path.lexists(path):
+            os.unlink(path)
+
+    def _remove(self, key):
+        stamp = self._stamp(key)
+        if os.path.exists(stamp):
+            os.unlink(stamp)
+        self._rmpath(self.fname(key))
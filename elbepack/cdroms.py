@@ -9,7 +9,6 @@
 import os
 from shutil import copyfile
 
-from apt.package import FetchError
 from elbepack.rpcaptcache import get_rpcaptcache
 from elbepack.repomanager import CdromSrcRepo
 from elbepack.repomanager import CdromBinRepo
@@ -51,7 +50,6 @@ def mk_source_cdrom(
 
     cache = get_rpcaptcache(rfs, "aptcache.log", arch)
     cache.update()
-    pkglist = cache.get_installed_pkgs()
 
     forbiddenPackages = []
     if xml is not None and xml.has('target/pkg-list'):
@@ -63,26 +61,22 @@ def mk_source_cdrom(
             except KeyError:
                 pass
 
-    for pkg in pkglist:
-        # Do not include forbidden packages in src cdrom
-        if pkg.name in forbiddenPackages:
-            continue
-        try:
-            dsc = cache.download_source(pkg.name, '/var/cache/elbe/sources')
+    # Many binary packages are built from the same source package, so
+    # fetch and include each source package only once.
+    # Do not include forbidden packages in src cdrom
+    srcpkgs = [s for s, _ in cache.get_installed_srcpkgs(forbiddenPackages)]
+
+    dscs = cache.download_sources(srcpkgs, '/var/cache/elbe/sources')
+
+    for name, version in srcpkgs:
+        dsc, err = dscs[(name, version)]
+        if dsc is not None:
             repo.includedsc(dsc, force=True)
-        except ValueError:
-            log.printo(
-                "No sources for Package " +
-                pkg.name +
-                "-" +
-                pkg.installed_version)
-        except FetchError:
-            log.printo(
-                "Source for Package " +
-                pkg.name +
-                "-" +
-                pkg.installed_version +
-                " could not be downloaded")
+        elif err is None:
+            log.printo("No sources for Package " + name + "-" + version)
+        else:
+            log.printo("Source for Package " + name + "-" + version +
+                       " could not be downloaded: " + err)
 
     # elbe fetch_initvm_pkgs has downloaded all sources to
     # /var/cache/elbe/sources
@@ -151,60 +145,36 @@ def mk_binary_cdrom(
 
     if xml is not None:
         cache = get_rpcaptcache(rfs, "aptcache.log", arch)
+        pkgs = []
         for p in xml.node("debootstrappkgs"):
             pkg = XMLPackage(p, arch)
-            try:
-                deb = cache.download_binary(pkg.name,
-                                            '/var/cache/elbe/binaries/main',
-                                            pkg.installed_version)
-                target_repo.includedeb(deb, 'main')
-            except ValueError:
-                log.printo(
-                    "No Package " +
-                    pkg.name +
-                    "-" +
-                    pkg.installed_version)
-            except FetchError:
-                log.printo(
-                    "Package " +
-                    pkg.name +
-                    "-" +
-                    pkg.installed_version +
-                    " could not be downloaded")
-            except TypeError:
-                log.printo(
-                    "Package " +
-                    pkg.name +
-                    "-" +
-                    pkg.installed_version +
-                    " missing name or version")
+            pkgs.append((pkg.name, pkg.installed_version))
+
+        fetched = cache.download_binaries(pkgs,
+                                          '/var/cache/elbe/binaries/main')
+        debs = []
+        for key in pkgs:
+            deb, err = fetched[key]
+            if deb is None:
+                log.printo(err)
+            else:
+                debs.append(deb)
+
+        target_repo.includedebs(debs, 'main')
 
     cache = get_rpcaptcache(rfs, "aptcache.log", arch)
     pkglist = cache.get_installed_pkgs()
-    for pkg in pkglist:
-        try:
-            deb = cache.download_binary(pkg.name,
-                                        '/var/cache/elbe/binaries/added',
-                                        pkg.installed_version)
-            target_repo.includedeb(deb, 'added', pkg.name, True)
-        except KeyError as ke:
-            log.printo(str(ke))
-        except ValueError:
-            log.printo("No Package " + pkg.name + "-" + pkg.installed_version)
-        except FetchError:
-            log.printo("Package " +
-                       pkg.name +
-                       "-" +
-                       str(pkg.installed_version) +
-                       " could not be downloaded")
-        except TypeError:
-            log.printo(
-                "Package " +
-                pkg.name +
-                "-" +
-                pkg.installed_version +
-                " missing name or version")
-
+    pkgs = [(p.name, p.installed_version) for p in pkglist]
+    fetched = cache.download_binaries(pkgs, '/var/cache/elbe/binaries/added')
+    debs = []
+    for key in pkgs:
+        deb, err = fetched[key]
+        if deb is None:
+            log.printo(err)
+        else:
+            debs.append(deb)
+
+    target_repo.includedebs(debs, 'added', force=True)
     target_repo.finalize()
 
     # Mark the binary repo with the necessary Files
@@ -22,6 +22,11 @@ def run_command(argv):
                        help="Skip xml schema validation")
     oparser.add_option("--buildtype", dest="buildtype",
                        help="Override the buildtype")
+    oparser.add_option("--reproducible", action="store_true",
+                       dest="reproducible", default=False,
+                       help="Create a sysroot.tar.xz, which does not "
+                            "depend on the number of cpus and the "
+                            "directory order")
 
     (opt, args) = oparser.parse_args(argv)
 
@@ -38,4 +43,4 @@ def run_command(argv):
         print("xml validation failed. Bailing out")
         sys.exit(20)
 
-    project.build_sysroot()
+    project.build_sysroot(reproducible=opt.reproducible)
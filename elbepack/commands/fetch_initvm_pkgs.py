@@ -16,6 +16,7 @@ from elbepack.elbexml import ElbeXML, ValidationError
 from elbepack.repomanager import CdromInitRepo, CdromSrcRepo
 from elbepack.asciidoclog import StdoutLog
 from elbepack.dump import get_initvm_pkglist
+from elbepack.rpcaptcache import fetch_binaries
 from elbepack.aptprogress import ElbeAcquireProgress
 from elbepack.filesystem import hostfs
 
@@ -97,29 +98,17 @@ def run_command(argv):
         pkglist = get_initvm_pkglist()
         cache = Cache()
         cache.open()
-        for pkg in pkglist:
-            try:
-                p = cache[pkg.name]
-                pkgver = p.installed
-                deb = pkgver.fetch_binary(opt.archive,
-                                          ElbeAcquireProgress(cb=None))
-                repo.includedeb(deb, 'main')
-            except ValueError:
-                log.printo("No Package " + pkg.name +
-                           "-" + str(pkg.installed_version))
-            except FetchError:
-                log.printo(
-                    "Package " +
-                    pkg.name +
-                    "-" +
-                    pkgver.version +
-                    " could not be downloaded")
-            except TypeError:
-                log.printo("Package " +
-                           pkg.name +
-                           "-" +
-                           str(pkg.installed_version) +
-                           " missing name or version")
+        pkgs = [(pkg.name, None) for pkg in pkglist]
+        fetched = fetch_binaries(cache, pkgs, opt.archive)
+        debs = []
+        for key in pkgs:
+            deb, err = fetched[key]
+            if deb is None:
+                log.printo(err)
+            else:
+                debs.append(deb)
+
+        repo.includedebs(debs, 'main')
 
     repo.finalize()
 
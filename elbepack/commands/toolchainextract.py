@@ -74,8 +74,7 @@ def run_command(argv):
         opt.output,
         StdoutLog())
 
-    for p in pkgs:
-        repo.includedeb(os.path.join(tmpdir, p))
+    repo.includedebs([os.path.join(tmpdir, p) for p in pkgs])
 
     repo.finalize()
     os.system('rm -r "%s"' % tmpdir)
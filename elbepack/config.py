@@ -17,6 +17,13 @@ class Config(dict):
         self['elbepass'] = "foo"
         self['pbuilder_jobs'] = "auto"
         self['initvm_domain'] = "initvm"
+        self['debootstrap_cache_size'] = "4GiB"
+        self['asyncworkers'] = "4"
+        self['debpool_size'] = "8GiB"
+        self['licence_cache_size'] = "64MiB"
+        self['imgbackend'] = "mount"
+        self['pack_cpus'] = "auto"
+        self['hostsysroot_cache_size'] = "4GiB"
 
         if 'ELBE_SOAPPORT' in os.environ:
             self['soapport'] = os.environ['ELBE_SOAPPORT']
@@ -36,5 +43,29 @@ class Config(dict):
         if 'ELBE_INITVM_DOMAIN' in os.environ:
             self['initvm_domain'] = os.environ['ELBE_INITVM_DOMAIN']
 
+        if 'ELBE_DEBOOTSTRAP_CACHE_SIZE' in os.environ:
+            self['debootstrap_cache_size'] = \
+                os.environ['ELBE_DEBOOTSTRAP_CACHE_SIZE']
+
+        if 'ELBE_ASYNCWORKERS' in os.environ:
+            self['asyncworkers'] = os.environ['ELBE_ASYNCWORKERS']
+
+        if 'ELBE_DEBPOOL_SIZE' in os.environ:
+            self['debpool_size'] = os.environ['ELBE_DEBPOOL_SIZE']
+
+        if 'ELBE_LICENCE_CACHE_SIZE' in os.environ:
+            self['licence_cache_size'] = \
+                os.environ['ELBE_LICENCE_CACHE_SIZE']
+
+        if 'ELBE_IMGBACKEND' in os.environ:
+            self['imgbackend'] = os.environ['ELBE_IMGBACKEND']
+
+        if 'ELBE_PACK_CPUS' in os.environ:
+            self['pack_cpus'] = os.environ['ELBE_PACK_CPUS']
+
+        if 'ELBE_HOSTSYSROOT_CACHE_SIZE' in os.environ:
+            self['hostsysroot_cache_size'] = \
+                os.environ['ELBE_HOSTSYSROOT_CACHE_SIZE']
+
 
 cfg = Config()
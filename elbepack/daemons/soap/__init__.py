@@ -9,6 +9,7 @@ from __future__ import print_function
 import sys
 
 from esoap import ESoap
+from download import FileDownloadApp, download_path
 from elbepack.projectmanager import ProjectManager
 
 from beaker.middleware import SessionMiddleware
@@ -31,6 +32,22 @@ class EsoapApp(Application):
         self.pm = ProjectManager("/var/cache/elbe")
 
 
+class EsoapDispatcher(object):
+
+    """ routes <soap>/download to the raw file download, everything
+        else to the soap application. Both share the beaker session.
+    """
+
+    def __init__(self, wsgi, download):
+        self.wsgi = wsgi
+        self.download = download
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO', '') == download_path:
+            return self.download(environ, start_response)
+        return self.wsgi(environ, start_response)
+
+
 class MySession (SessionMiddleware, SimplePlugin):
     def __init__(self, app, pm, engine):
         self.pm = pm
@@ -53,4 +70,5 @@ def get_app(engine):
                    out_protocol=Soap11())
 
     wsgi = WsgiApplication(app)
-    return MySession(wsgi, app.pm, engine)
+    dispatcher = EsoapDispatcher(wsgi, FileDownloadApp(app.pm))
+    return MySession(dispatcher, app.pm, engine)
@@ -5,7 +5,7 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 from spyne.model.complex import ComplexModel
-from spyne.model.primitive import Unicode, DateTime, Integer
+from spyne.model.primitive import Unicode, DateTime, Integer, Boolean
 
 
 class SoapProject (ComplexModel):
@@ -46,3 +46,17 @@ class SoapCmdReply (ComplexModel):
         # pylint: disable=super-init-not-called
         self.ret = ret
         self.out = out
+
+
+class SoapLogTail (ComplexModel):
+    __namespace__ = 'soap'
+
+    busy = Boolean()
+    offset = Integer()
+    data = Unicode()
+
+    def __init__(self, busy, offset, data):
+        # pylint: disable=super-init-not-called
+        self.busy = busy
+        self.offset = offset
+        self.data = data
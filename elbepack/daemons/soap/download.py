@@ -0,0 +1,136 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# Copyright (c) 2018 Linutronix GmbH
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import re
+
+from urlparse import parse_qs
+
+from elbepack.db import ElbeDBError
+from elbepack.projectmanager import PermissionDenied
+
+download_path = "/download"
+
+_range_re = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """ returns (start, end) of a single byte range, end is inclusive.
+        None is returned for an empty file or an unsatisfiable range,
+        multiple ranges are not supported and are ignored.
+    """
+    m = _range_re.match(header.strip())
+    if not m:
+        return (0, size - 1)
+
+    start, end = m.groups()
+    if not start:
+        if not end:
+            return (0, size - 1)
+        # suffix range, the last <end> bytes
+        start = max(size - int(end), 0)
+        end = size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+
+    if start > end or start >= size:
+        return None
+    return (start, end)
+
+
+def _read_range(fp, start, end, blocksize=1024 * 1024):
+    try:
+        fp.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = fp.read(min(blocksize, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        fp.close()
+
+
+class FileDownloadApp(object):
+
+    """ Serves the files of a project as raw http, so that big images
+        do not need to be base64 encoded into soap messages. The user
+        must be logged in via the soap login call of the same session.
+
+        GET <soap>/download?builddir=<builddir>&name=<filename>
+    """
+
+    def __init__(self, pm):
+        self.pm = pm
+
+    @staticmethod
+    def _error(start_response, status):
+        start_response(status, [('Content-Type', 'text/plain')])
+        return [status + "\n"]
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return self._error(start_response, '405 Method Not Allowed')
+
+        s = environ['beaker.session']
+        try:
+            uid = s['userid']
+        except KeyError:
+            return self._error(start_response, '401 Unauthorized')
+
+        qs = parse_qs(environ.get('QUERY_STRING', ''))
+        try:
+            builddir = qs['builddir'][0]
+            name = qs['name'][0]
+        except KeyError:
+            return self._error(start_response, '400 Bad Request')
+
+        try:
+            pf = self.pm.open_project_file(uid, builddir, name)
+        except PermissionDenied:
+            return self._error(start_response, '403 Forbidden')
+        except (ElbeDBError, IOError):
+            return self._error(start_response, '404 Not Found')
+
+        fp = pf.fobj
+        size = os.fstat(fp.fileno()).st_size
+        headers = [('Content-Type', pf.mime_type or
+                    'application/octet-stream'),
+                   ('Accept-Ranges', 'bytes')]
+
+        status = '200 OK'
+        start, end = 0, size - 1
+        if 'HTTP_RANGE' in environ and size > 0:
+            r = parse_range(environ['HTTP_RANGE'], size)
+            if r is None:
+                fp.close()
+                start_response('416 Requested Range Not Satisfiable',
+                               [('Content-Range', 'bytes */%d' % size)])
+                return []
+            start, end = r
+
+        if (start, end) != (0, size - 1):
+            status = '206 Partial Content'
+            headers.append(('Content-Range',
+                            'bytes %d-%d/%d' % (start, end, size)))
+
+        headers.append(('Content-Length', str(end - start + 1)))
+        start_response(status, headers)
+
+        if environ['REQUEST_METHOD'] == 'HEAD' or size == 0:
+            fp.close()
+            return []
+
+        # wsgi.file_wrapper lets the server use sendfile(), it always
+        # sends until the end of the file, so use it for ranges up to
+        # the end only.
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper and end == size - 1:
+            fp.seek(start)
+            return file_wrapper(fp, 1024 * 1024)
+
+        return _read_range(fp, start, end)
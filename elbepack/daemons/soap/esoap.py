@@ -22,7 +22,7 @@ from elbepack.elbexml import ValidationMode
 from elbepack.filesystem import hostfs
 
 from .faults import soap_faults
-from .datatypes import SoapProject, SoapFile, SoapCmdReply
+from .datatypes import SoapProject, SoapFile, SoapCmdReply, SoapLogTail
 from .authentication import authenticated_admin, authenticated_uid
 
 try:
@@ -378,6 +378,14 @@ class ESoap (ServiceBase):
             return 'FINISH'
         return log
 
+    @rpc(String, Integer, _returns=SoapLogTail)
+    @authenticated_uid
+    @soap_faults
+    def get_project_log_tail(self, uid, builddir, offset):
+        self.app.pm.open_project(uid, builddir)
+        busy, offset, data = self.app.pm.current_project_log_tail(uid, offset)
+        return SoapLogTail(busy, offset, data)
+
     @rpc()
     @authenticated_uid
     @soap_faults
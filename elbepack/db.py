@@ -852,6 +852,10 @@ class ElbeDB(object):
                                       "text/plain; charset=utf-8",
                                       "Log file")
 
+            _update_project_file(s, p.builddir, "build-profile.json",
+                                      "application/json",
+                                      "Build stage profile")
+
             _update_project_file(s, p.builddir, "sysroot.tar.xz",
                                       "application/x-xz-compressed-tar",
                                       "sysroot for cross-toolchains")
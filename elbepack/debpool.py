@@ -0,0 +1,68 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# Copyright (c) 2018 Linutronix GmbH
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import errno
+
+from elbepack.cachedir import CacheDir
+from elbepack.config import cfg
+from elbepack.shellhelper import system, CommandError
+
+
+def link_or_copy(src, dst):
+    """ hardlinks src to dst, or creates a reflink copy if src and dst
+        are on different filesystems.
+    """
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        system('cp --reflink=auto "%s" "%s"' % (src, dst))
+
+
+class DebPool(CacheDir):
+
+    """ .deb files shared by all projects, keyed by their sha256.
+        The files are handed out as hardlinks, so they must never be
+        modified in place.
+    """
+
+    def __init__(self, maxsize=None):
+        if maxsize is None:
+            maxsize = cfg['debpool_size']
+        CacheDir.__init__(self, 'debpool', maxsize)
+
+    def fetch(self, sha256, dst):
+        """ places the .deb with the given sha256 at dst. Returns False,
+            if it is not in the pool.
+        """
+        if not sha256:
+            return False
+        try:
+            fname = self.lookup(sha256)
+            if fname is None:
+                return False
+            link_or_copy(fname, dst)
+        except (IOError, OSError, CommandError):
+            # evicted in the meantime or pool not accessible
+            return False
+        return True
+
+    def add(self, fname, sha256):
+        """ adds fname to the pool. Failures are ignored, the pool is a
+            cache only.
+        """
+        if not sha256 or os.path.exists(self._stamp(sha256)):
+            return
+        try:
+            self.store(sha256, lambda tmp: link_or_copy(fname, tmp))
+        except (IOError, OSError, CommandError):
+            pass
+
+
+debpool = DebPool()
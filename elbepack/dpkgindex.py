@@ -0,0 +1,156 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# Copyright (c) 2018 Linutronix GmbH
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import time
+
+from array import array
+from bisect import bisect_left
+from threading import Lock
+from multiprocessing.pool import ThreadPool
+
+try:
+    from sys import intern
+except ImportError:
+    # python2 has intern() as builtin
+    pass
+
+dpkg_info = 'var/lib/dpkg/info'
+dpkg_status = 'var/lib/dpkg/status'
+
+# root path -> (status key, last use, DpkgFileIndex), the indexes of
+# the most recently used root filesystems are kept
+_index_cache = {}
+_index_cache_size = 4
+_index_lock = Lock()
+
+
+def _read_list(fname):
+    with open(fname, "r") as f:
+        return f.read().splitlines()
+
+
+class DpkgFileIndex(object):
+
+    """ Maps the files of the installed packages of a root filesystem
+        to the owning packages, read from var/lib/dpkg/info/*.list.
+
+        The paths are kept in a sorted list, with an array of indexes
+        into the list of package names next to it. A path that is
+        listed by several packages (e.g. a directory) has one entry
+        per package.
+    """
+
+    def __init__(self, pkgnames, lists, arch=None):
+        self.pkgnames = pkgnames
+        self.suffix = arch and ':' + arch
+
+        entries = []
+        for i, files in enumerate(lists):
+            entries.extend((f, i) for f in files if f)
+        entries.sort()
+
+        self.paths = [e[0] for e in entries]
+        self.owners = array('I', [e[1] for e in entries])
+        self.pkgids = dict((n, i) for i, n in enumerate(pkgnames))
+
+    @classmethod
+    def from_rfs(cls, rfs, arch, threads=8):
+        """ arch is the native architecture. The packages are named like
+            python-apt does it: without the architecture for the native
+            one, with it for foreign ones.
+        """
+        suffix = ':' + arch
+        names = []
+        fnames = []
+        for f in sorted(os.listdir(rfs.fname(dpkg_info))):
+            if not f.endswith('.list'):
+                continue
+            name = f[:-5]
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+            # intern, the names are repeated for every file
+            names.append(intern(name))
+            fnames.append(os.path.join(rfs.fname(dpkg_info), f))
+
+        pool = ThreadPool(threads)
+        try:
+            lists = pool.map(_read_list, fnames, chunksize=64)
+        finally:
+            pool.close()
+            pool.join()
+
+        return cls(names, lists, arch)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _first(self, path):
+        i = bisect_left(self.paths, path)
+        if i < len(self.paths) and self.paths[i] == path:
+            return i
+        return None
+
+    def __contains__(self, path):
+        return self._first(path) is not None
+
+    def __getitem__(self, path):
+        i = self._first(path)
+        if i is None:
+            raise KeyError(path)
+        return self.pkgnames[self.owners[i]]
+
+    def get(self, path, default=None):
+        i = self._first(path)
+        if i is None:
+            return default
+        return self.pkgnames[self.owners[i]]
+
+    def _pkgname(self, name):
+        # a native package may be given with the architecture as well
+        if self.suffix and name.endswith(self.suffix):
+            return name[:-len(self.suffix)]
+        return name
+
+    def files(self, pkgnames):
+        """ returns the sorted list of all paths of the given packages,
+            unknown package names are ignored.
+        """
+        pkgnames = [self._pkgname(n) for n in pkgnames]
+        ids = set(self.pkgids[n] for n in pkgnames if n in self.pkgids)
+        ret = []
+        last = None
+        for i, owner in enumerate(self.owners):
+            if owner in ids and self.paths[i] != last:
+                last = self.paths[i]
+                ret.append(last)
+        return ret
+
+
+def get_dpkg_fileindex(rfs, arch):
+    """ returns the DpkgFileIndex of rfs. It is rebuilt only, when the
+        dpkg status file has changed since the last call.
+    """
+    try:
+        st = os.stat(rfs.fname(dpkg_status))
+        key = (arch, st.st_mtime, st.st_size, st.st_ino)
+    except OSError:
+        key = None
+
+    with _index_lock:
+        cached = _index_cache.get(rfs.path)
+        if key is not None and cached is not None and cached[0] == key:
+            _index_cache[rfs.path] = (key, time.time(), cached[2])
+            return cached[2]
+
+    index = DpkgFileIndex.from_rfs(rfs, arch)
+
+    with _index_lock:
+        _index_cache[rfs.path] = (key, time.time(), index)
+        while len(_index_cache) > _index_cache_size:
+            oldest = min(_index_cache, key=lambda k: _index_cache[k][1])
+            del _index_cache[oldest]
+
+    return index
@@ -15,6 +15,8 @@ from elbepack.finetuning import do_finetuning
 from elbepack.filesystem import hostfs
 from elbepack.version import elbe_version
 from elbepack.aptpkgutils import APTPackage
+from elbepack.dpkgindex import get_dpkg_fileindex
+from elbepack.fssnapshot import FsSnapshot
 
 
 def get_initvm_pkglist():
@@ -86,27 +88,24 @@ def check_full_pkgs(pkgs, fullpkgs, errorname, cache):
     errors = 0
 
     if pkgs:
+        names = {}
+        pkglist = []
         for p in pkgs:
             name = p.et.text
             nomulti_name = name.split(":")[0]
-            if not cache.has_pkg(nomulti_name):
-                elog.printo("- package %s does not exist" % nomulti_name)
-                errors += 1
-                continue
-
-            if not cache.is_installed(nomulti_name):
-                elog.printo("- package %s is not installed" % nomulti_name)
-                errors += 1
-                continue
-
-            ver = p.et.get('version')
-            pkg = cache.get_pkg(nomulti_name)
-            if ver and (pkg.installed_version != ver):
+            names[nomulti_name] = name
+            pkglist.append((nomulti_name, p.et.get('version'), None))
+
+        for problem, name, want, have in cache.check_pkglist(pkglist):
+            if problem == 'missing':
+                elog.printo("- package %s does not exist" % name)
+            elif problem == 'not_installed':
+                elog.printo("- package %s is not installed" % name)
+            elif problem == 'version':
                 elog.printo(
                     "- package %s version %s does not match installed version %s" %
-                    (name, ver, pkg.installed_version))
-                errors += 1
-                continue
+                    (names[name], want, have))
+            errors += 1
 
     if errors == 0:
         elog.printo("No Errors found")
@@ -117,44 +116,26 @@ def check_full_pkgs(pkgs, fullpkgs, errorname, cache):
     elog.h2("Full Packagelist validation")
     errors = 0
 
-    pindex = {}
-    for p in fullpkgs:
-        name = p.et.text
-        ver = p.et.get('version')
-        md5 = p.et.get('md5')
-
-        pindex[name] = p
+    pkglist = [(p.et.text, p.et.get('version'), p.et.get('md5'))
+               for p in fullpkgs]
 
-        if not cache.has_pkg(name):
+    for problem, name, want, have in cache.check_pkglist(pkglist, full=True):
+        if problem == 'missing':
             elog.printo("- package %s does not exist" % name)
-            errors += 1
-            continue
-
-        if not cache.is_installed(name):
+        elif problem == 'not_installed':
             elog.printo("- package %s is not installed" % name)
-            errors += 1
-            continue
-
-        pkg = cache.get_pkg(name)
-
-        if pkg.installed_version != ver:
+        elif problem == 'version':
             elog.printo(
                 "- package %s version %s does not match installed version %s" %
-                (name, ver, pkg.installed_version))
-            errors += 1
-            continue
-
-        if pkg.installed_md5 != md5:
+                (name, want, have))
+        elif problem == 'md5':
             elog.printo("- package %s md5 %s does not match installed md5 %s" %
-                        (name, md5, pkg.installed_md5))
-            errors += 1
-
-    for cp in cache.get_installed_pkgs():
-        if cp.name not in pindex:
+                        (name, want, have))
+        elif problem == 'additional':
             elog.printo(
                 "additional package %s installed, that was not requested" %
-                cp.name)
-            errors += 1
+                name)
+        errors += 1
 
     if errors == 0:
         elog.printo("No Errors found")
@@ -201,53 +182,54 @@ def elbe_report(xml, buildenv, cache, reportname, errorname, targetfs):
         outf.printo("|%s|%s|%s" % (p.name, p.installed_version, p.origin))
     outf.table()
 
-    index = cache.get_fileindex()
-    mt_index = targetfs.mtime_snap()
+    arch = xml.text("project/buildimage/arch", key="arch")
+    index = get_dpkg_fileindex(rfs, arch)
+    snap = FsSnapshot(targetfs)
 
     outf.h2("archive extract")
 
     if xml.has("archive") and not xml.text("archive") is None:
         with xml.archive_tmpfile() as fp:
             outf.do('tar xvfj "%s" -h -C "%s"' % (fp.name, targetfs.path))
-        mt_index_postarch = targetfs.mtime_snap()
+        snap_postarch = FsSnapshot(targetfs)
     else:
-        mt_index_postarch = mt_index
+        snap_postarch = snap
 
     outf.h2("finetuning log")
     outf.verbatim_start()
 
     if xml.has("target/finetuning"):
         do_finetuning(xml, outf, buildenv, targetfs)
-        mt_index_post_fine = targetfs.mtime_snap()
+        snap_post_fine = FsSnapshot(targetfs)
     else:
-        mt_index_post_fine = mt_index_postarch
+        snap_post_fine = snap_postarch
 
     outf.verbatim_end()
 
+    added_arch, _, changed_arch = snap_postarch.diff(snap)
+    added_fine, removed_fine, changed_fine = \
+        snap_post_fine.diff(snap_postarch)
+
     outf.h2("fileslist")
     outf.table()
 
     tgt_pkg_list = set()
 
-    for fpath, _ in targetfs.walk_files():
+    for fpath in snap_post_fine:
         if fpath in index:
             pkg = index[fpath]
             tgt_pkg_list.add(pkg)
         else:
             pkg = "postinst generated"
 
-        if fpath in mt_index_post_fine:
-            if fpath in mt_index_postarch:
-                if mt_index_post_fine[fpath] != mt_index_postarch[fpath]:
-                    pkg = "modified finetuning"
-                elif fpath in mt_index:
-                    if mt_index_postarch[fpath] != mt_index[fpath]:
-                        pkg = "from archive"
-                    # else leave pkg as is
-                else:
-                    pkg = "added in archive"
-            else:
-                pkg = "added in finetuning"
+        if fpath in added_fine:
+            pkg = "added in finetuning"
+        elif fpath in changed_fine:
+            pkg = "modified finetuning"
+        elif fpath in added_arch:
+            pkg = "added in archive"
+        elif fpath in changed_arch:
+            pkg = "from archive"
         # else leave pkg as is
 
         outf.printo("|+%s+|%s" % (fpath, pkg))
@@ -256,13 +238,13 @@ def elbe_report(xml, buildenv, cache, reportname, errorname, targetfs):
 
     outf.h2("Deleted Files")
     outf.table()
-    for fpath in list(mt_index.keys()):
-        if fpath not in mt_index_post_fine:
-            if fpath in index:
-                pkg = index[fpath]
-            else:
-                pkg = "postinst generated"
-            outf.printo("|+%s+|%s" % (fpath, pkg))
+    _, deleted, _ = snap_post_fine.diff(snap)
+    for fpath in sorted(deleted):
+        if fpath in index:
+            pkg = index[fpath]
+        else:
+            pkg = "postinst generated"
+        outf.printo("|+%s+|%s" % (fpath, pkg))
     outf.table()
 
     outf.h2("Target Package List")
@@ -303,19 +285,17 @@ def elbe_report(xml, buildenv, cache, reportname, errorname, targetfs):
 
     errors = 0
 
-    for fpath in list(mt_index_postarch.keys()):
-        if fpath not in mt_index or \
-                mt_index_postarch[fpath] != mt_index[fpath]:
-            if fpath not in mt_index_post_fine:
-                elog.printo(
-                        "- archive file %s deleted in finetuning" %
-                        fpath)
-                errors += 1
-            elif mt_index_post_fine[fpath] != mt_index_postarch[fpath]:
-                elog.printo(
-                        "- archive file %s modified in finetuning" %
-                        fpath)
-                errors += 1
+    for fpath in sorted(added_arch | changed_arch):
+        if fpath in removed_fine:
+            elog.printo(
+                    "- archive file %s deleted in finetuning" %
+                    fpath)
+            errors += 1
+        elif fpath in changed_fine:
+            elog.printo(
+                    "- archive file %s modified in finetuning" %
+                    fpath)
+            errors += 1
 
     if errors == 0:
         elog.printo("No Errors found")
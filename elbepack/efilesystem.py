@@ -12,14 +12,19 @@ import shutil
 import subprocess
 import io
 import stat
+import threading
+
+from multiprocessing import cpu_count
 
 from elbepack.asciidoclog import CommandError
 from elbepack.filesystem import Filesystem
 from elbepack.version import elbe_version
-from elbepack.hdimg import do_hdimg
+from elbepack.hdimg import do_hdimg, run_jobs
 from elbepack.fstab import fstabentry
-from elbepack.licencexml import copyright_xml
+from elbepack.licencexml import copyright_xml, parse_copyrights
 from elbepack.packers import default_packer
+from elbepack.config import cfg
+from elbepack.dpkgindex import get_dpkg_fileindex
 
 
 def copy_filelist(src, filelist, dst):
@@ -61,19 +66,7 @@ def extract_target(src, xml, dst, log, cache):
 
             pkglist = list(set(withdeps))
 
-        file_list = []
-        for line in pkglist:
-            file_list += src.cat_file("var/lib/dpkg/info/%s.list" % (line))
-            file_list += src.cat_file("var/lib/dpkg/info/%s.conffiles" %
-                                      (line))
-
-            file_list += src.cat_file("var/lib/dpkg/info/%s:%s.list" %
-                                      (line, arch))
-            file_list += src.cat_file(
-                "var/lib/dpkg/info/%s:%s.conffiles" %
-                (line, arch))
-
-        file_list = list(sorted(set(file_list)))
+        file_list = get_dpkg_fileindex(src, arch).files(pkglist)
         copy_filelist(src, file_list, dst)
     else:
         # first copy most diretories
@@ -137,8 +130,11 @@ class ElbeFilesystem(Filesystem):
         self.chmod("etc/elbe_base.xml", stat.S_IREAD)
 
     def write_licenses(self, f, log, xml_fname=None):
-        licence_xml = copyright_xml()
-        for d in self.listdir("usr/share/doc/", skiplinks=True):
+        # read all copyright files first, the packages are written in
+        # sorted order, so that the output does not depend on the
+        # order of the directory entries.
+        licenses = []
+        for d in sorted(self.listdir("usr/share/doc/", skiplinks=True)):
             try:
                 with io.open(os.path.join(d, "copyright"), "rb") as lic:
                     lic_text = lic.read()
@@ -153,24 +149,98 @@ class ElbeFilesystem(Filesystem):
             except BaseException:
                 lic_text = unicode(lic_text, encoding='iso-8859-1')
 
-            if f is not None:
-                f.write(unicode(os.path.basename(d)))
+            licenses.append((os.path.basename(d), lic_text))
+
+        if f is not None:
+            for pkg_name, lic_text in licenses:
+                f.write(unicode(pkg_name))
                 f.write(u":\n======================================"
                         "==========================================")
                 f.write(u"\n")
                 f.write(lic_text)
                 f.write(u"\n\n")
 
-            if xml_fname is not None:
-                licence_xml.add_copyright_file(os.path.basename(d), lic_text)
-
         if xml_fname is not None:
+            licence_xml = copyright_xml()
+            texts = [copyright_xml.sanitize(text) for _, text in licenses]
+            for (pkg_name, _), text, parsed in zip(licenses, texts,
+                                                   parse_copyrights(texts)):
+                licence_xml.add_copyright_file(pkg_name, text, parsed)
             licence_xml.write(xml_fname)
 
 
-class ChRootFilesystem(ElbeFilesystem):
+# subprocesses and mount/umount calls saved by RefCountedContext,
+# per thread, so that the builds of the asyncworker threads can be
+# told apart
+_saved = threading.local()
+
+
+def chroot_reuse_stats():
+    """ returns the numbers of subprocesses and mount/umount calls,
+        the current thread saved by reusing active chroots.
+    """
+    return (getattr(_saved, 'subprocesses', 0),
+            getattr(_saved, 'mounts', 0))
+
+
+class RefCountedContext(object):
+
+    """ A context manager, which is only set up by the outermost 'with'
+        and torn down, when the last one is left. Nested entries reuse
+        the active context.
+
+        Subclasses implement _setup() and _teardown() and report the
+        subprocesses and mount/umount calls these need via
+        _count(), so that the calls saved by the reuse are known.
+    """
+
+    def __init__(self):
+        self._refs = 0
+        self._reused = 0
+        self._cost = [0, 0]
+
+    def _count(self, subprocesses=1, mounts=0):
+        self._cost[0] += subprocesses
+        self._cost[1] += mounts
+
+    def _setup(self):
+        raise NotImplementedError('abstract method called')
+
+    def _teardown(self, typ, value, traceback):
+        raise NotImplementedError('abstract method called')
+
+    def __enter__(self):
+        self._refs += 1
+        if self._refs > 1:
+            self._reused += 1
+            return self
+
+        self._reused = 0
+        self._cost = [0, 0]
+        try:
+            self._setup()
+        except BaseException:
+            self._refs -= 1
+            raise
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        self._refs -= 1
+        if self._refs > 0:
+            return
+
+        self._teardown(typ, value, traceback)
+
+        # every reused entry saved a setup and a teardown
+        subprocesses, mounts = chroot_reuse_stats()
+        _saved.subprocesses = subprocesses + self._reused * self._cost[0]
+        _saved.mounts = mounts + self._reused * self._cost[1]
+
+
+class ChRootFilesystem(ElbeFilesystem, RefCountedContext):
     def __init__(self, path, interpreter=None, clean=False):
         ElbeFilesystem.__init__(self, path, clean)
+        RefCountedContext.__init__(self)
         self.interpreter = interpreter
         self.cwd = os.open("/", os.O_RDONLY)
         self.inchroot = False
@@ -178,7 +248,11 @@ class ChRootFilesystem(ElbeFilesystem):
     def __del__(self):
         os.close(self.cwd)
 
-    def __enter__(self):
+    def _system(self, cmd, mounts=0):
+        self._count(1, mounts)
+        os.system(cmd)
+
+    def _setup(self):
         if self.interpreter:
             if not self.exists("usr/bin"):
                 self.mkdir("usr/bin")
@@ -186,60 +260,63 @@ class ChRootFilesystem(ElbeFilesystem):
             ui = "/usr/share/elbe/qemu-elbe/" + self.interpreter
             if not os.path.exists(ui):
                 ui = "/usr/bin/" + self.interpreter
-            os.system('cp %s %s' % (ui, self.fname("usr/bin")))
+            self._system('cp %s %s' % (ui, self.fname("usr/bin")))
 
         if self.exists("/etc/resolv.conf"):
-            os.system('mv %s %s' % (self.fname("etc/resolv.conf"),
-                                    self.fname("etc/resolv.conf.orig")))
-        os.system('cp %s %s' % ("/etc/resolv.conf",
-                                self.fname("etc/resolv.conf")))
+            self._system('mv %s %s' % (self.fname("etc/resolv.conf"),
+                                       self.fname("etc/resolv.conf.orig")))
+        self._system('cp %s %s' % ("/etc/resolv.conf",
+                                   self.fname("etc/resolv.conf")))
 
         if self.exists("/etc/apt/apt.conf"):
-            os.system('cp %s %s' % (self.fname("/etc/apt/apt.conf"),
-                                    self.fname("/etc/apt/apt.conf.orig")))
+            self._system('cp %s %s' % (self.fname("/etc/apt/apt.conf"),
+                                       self.fname("/etc/apt/apt.conf.orig")))
         if os.path.exists("/etc/apt/apt.conf"):
-            os.system('cp %s %s' % ("/etc/apt/apt.conf",
-                                    self.fname("/etc/apt/")))
+            self._system('cp %s %s' % ("/etc/apt/apt.conf",
+                                       self.fname("/etc/apt/")))
 
         self.mkdir_p("usr/sbin")
         self.write_file("usr/sbin/policy-rc.d",
                         0o755, "#!/bin/sh\nexit 101\n")
 
         self.mount()
-        return self
 
-    def __exit__(self, _typ, _value, _traceback):
+    def __exit__(self, typ, value, traceback):
         if self.inchroot:
             self.leave_chroot()
+        RefCountedContext.__exit__(self, typ, value, traceback)
+
+    def _teardown(self, _typ, _value, _traceback):
         self.umount()
         if self.interpreter:
-            os.system('rm -f %s' %
-                      os.path.join(self.path, "usr/bin/" + self.interpreter))
+            self._system('rm -f %s' %
+                         os.path.join(self.path,
+                                      "usr/bin/" + self.interpreter))
 
-        os.system('rm -f %s' % (self.fname("etc/resolv.conf")))
+        self._system('rm -f %s' % (self.fname("etc/resolv.conf")))
 
         if self.exists("/etc/resolv.conf.orig"):
-            os.system('mv %s %s' % (self.fname("etc/resolv.conf.orig"),
-                                    self.fname("etc/resolv.conf")))
+            self._system('mv %s %s' % (self.fname("etc/resolv.conf.orig"),
+                                       self.fname("etc/resolv.conf")))
 
         if self.exists("/etc/apt/apt.conf"):
-            os.system('rm -f %s' % (self.fname("etc/apt/apt.conf")))
+            self._system('rm -f %s' % (self.fname("etc/apt/apt.conf")))
 
         if self.exists("/etc/apt/apt.conf.orig"):
-            os.system('mv %s %s' % (self.fname("etc/apt/apt.conf.orig"),
-                                    self.fname("etc/apt/apt.conf")))
+            self._system('mv %s %s' % (self.fname("etc/apt/apt.conf.orig"),
+                                       self.fname("etc/apt/apt.conf")))
 
         if self.exists("/usr/sbin/policy-rc.d"):
-            os.system('rm -f %s' % (self.fname("usr/sbin/policy-rc.d")))
+            self._system('rm -f %s' % (self.fname("usr/sbin/policy-rc.d")))
 
     def mount(self):
         if self.path == '/':
             return
         try:
-            os.system("mount -t proc none %s/proc" % self.path)
-            os.system("mount -t sysfs none %s/sys" % self.path)
-            os.system("mount -o bind /dev %s/dev" % self.path)
-            os.system("mount -o bind /dev/pts %s/dev/pts" % self.path)
+            self._system("mount -t proc none %s/proc" % self.path, 1)
+            self._system("mount -t sysfs none %s/sys" % self.path, 1)
+            self._system("mount -o bind /dev %s/dev" % self.path, 1)
+            self._system("mount -o bind /dev/pts %s/dev/pts" % self.path, 1)
         except BaseException:
             self.umount()
             raise
@@ -261,7 +338,7 @@ class ChRootFilesystem(ElbeFilesystem):
 
     def _umount(self, path):
         if os.path.ismount(path):
-            os.system("umount %s" % path)
+            self._system("umount %s" % path, 1)
 
     def umount(self):
         if self.path == '/':
@@ -339,14 +416,11 @@ class TargetFs(ChRootFilesystem):
                 pass
 
         if self.xml.has("target/package/cpio"):
-            oldwd = os.getcwd()
             cpio_name = self.xml.text("target/package/cpio/name")
-            os.chdir(self.fname(''))
             try:
                 self.log.do(
-                    "find . -print | cpio -ov -H newc >%s" %
-                    os.path.join(
-                        targetdir, cpio_name))
+                    'cd "%s"; find . -print | cpio -ov -H newc >%s' %
+                    (self.fname(''), os.path.join(targetdir, cpio_name)))
                 # only append filename if creating cpio was successful
                 self.images.append(cpio_name)
             except CommandError:
@@ -354,9 +428,7 @@ class TargetFs(ChRootFilesystem):
                 pass
 
         if self.xml.has("target/package/squashfs"):
-            oldwd = os.getcwd()
             sfs_name = self.xml.text("target/package/squashfs/name")
-            os.chdir(self.fname(''))
             try:
                 self.log.do(
                     "mksquashfs %s %s/%s -noappend -no-progress" %
@@ -367,12 +439,36 @@ class TargetFs(ChRootFilesystem):
                 # error was logged; continue
                 pass
 
-    def pack_images(self, builddir):
-        for img, packer in self.image_packers.items():
+    def pack_images(self, builddir, cpus=None):
+        """ packs the images concurrently, the multi threaded packers
+            share the cpus (default: pack_cpus from the config).
+        """
+        if cpus is None:
+            cpus = cfg['pack_cpus']
+        if cpus == "auto":
+            cpus = cpu_count()
+        cpus = max(1, int(cpus))
+
+        imgs = sorted(self.image_packers.items(), key=lambda i: i[0])
+        if not imgs:
+            return
+
+        # every image gets the same share of the cpus, a packer with
+        # an explicit thread count uses that
+        workers = min(len(imgs), cpus)
+        threads = max(1, cpus // workers)
+
+        def pack(item):
+            img, packer = item
+            return packer.pack_file(self.log, builddir, img,
+                                    packer.max_threads or threads)
+
+        packed = run_jobs([lambda i=i: pack(i) for i in imgs], workers)
+
+        for (img, _), p in zip(imgs, packed):
             self.images.remove(img)
-            packed = packer.pack_file(self.log, builddir, img)
-            if packed:
-                self.images.append(packed)
+            if p:
+                self.images.append(p)
 
 
 class BuildImgFs(ChRootFilesystem):
@@ -19,10 +19,10 @@ from elbepack.shellhelper import CommandError
 from elbepack.elbexml import (ElbeXML, NoInitvmNode,
                               ValidationError, ValidationMode)
 
-from elbepack.rfs import BuildEnv
-from elbepack.rpcaptcache import get_rpcaptcache
+from elbepack.rfs import BuildEnv, debootstrap_cmd, key_digest
+from elbepack.rpcaptcache import get_rpcaptcache, log_mark_failures
 from elbepack.efilesystem import TargetFs
-from elbepack.efilesystem import extract_target
+from elbepack.efilesystem import extract_target, chroot_reuse_stats
 
 from elbepack.dump import elbe_report
 from elbepack.dump import dump_debootstrappkgs, dump_initvmpkgs, dump_fullpkgs
@@ -37,6 +37,10 @@ from elbepack.repomanager import ProjectRepo
 from elbepack.config import cfg
 from elbepack.templates import write_pack_template
 from elbepack.finetuning import do_prj_finetuning
+from elbepack.buildprofile import BuildProfile
+from elbepack.sysroot import SysrootSelector, tar_xz_cmd, sdk_payload_cmd
+from elbepack.cachedir import CacheDir, cache_key, link_tree
+from elbepack.version import elbe_version
 
 
 class IncompatibleArchitectureException(Exception):
@@ -215,6 +219,9 @@ class ElbeProject (object):
         # same for host_sysroot instance recreate it in any case
         self.host_sysrootenv = None
 
+        # Per stage timings of the last build, see build()
+        self.profile = None
+
     def build_chroottarball(self):
         self.log.do("tar cJf %s/chroot.tar.xz \
                 --exclude=./tmp/*  --exclude=./dev/* \
@@ -244,7 +251,7 @@ class ElbeProject (object):
 
         return paths
 
-    def build_sysroot(self):
+    def build_sysroot(self, reproducible=False):
 
         self.log.do('rm -rf %s; mkdir "%s"' % (self.sysrootpath,
                                                self.sysrootpath))
@@ -291,21 +298,26 @@ class ElbeProject (object):
         except IOError:
             self.log.printo("dump elbeversion into sysroot failed")
 
-        sysrootfilelist = os.path.join(self.builddir, "sysroot-filelist")
-
         with self.sysrootenv.rfs:
             self.log.do("chroot %s /usr/bin/symlinks -cr /usr/lib" %
                         self.sysrootpath)
 
-        paths = self.get_sysroot_paths()
+        # build_sysroot is also called outside of build()
+        profile = self.profile or BuildProfile(self.log)
 
-        self.log.do("rm %s" % sysrootfilelist, allow_fail=True)
-        os.chdir(self.sysrootpath)
-        for p in paths:
-            self.log.do('find -path "%s" >> %s' % (p, sysrootfilelist))
+        with profile.stage("sysroot_select"):
+            selector = SysrootSelector(self.get_sysroot_paths())
+            files = selector.select(self.sysrootpath)
+            self.log.printo("%d sysroot paths selected" % len(files))
+
+        with profile.stage("sysroot_compress"):
+            self.log.do(tar_xz_cmd(os.path.join(self.builddir,
+                                                "sysroot.tar.xz"),
+                                   self.sysrootpath,
+                                   reproducible=reproducible),
+                        stdin="\0".join(files), log_stdin=False)
 
-        self.log.do("tar cfJ %s/sysroot.tar.xz -C %s -T %s" %
-                    (self.builddir, self.sysrootpath, sysrootfilelist))
+        return files
 
     def build_host_sysroot(self, pkgs, hostsysrootpath):
         self.log.do('rm -rf %s; mkdir "%s"' % (hostsysrootpath,
@@ -330,14 +342,7 @@ class ElbeProject (object):
             except Exception as e:
                 raise AptCacheUpdateError(e)
 
-            for p in pkgs:
-                try:
-                    cache.mark_install(p, None)
-                except KeyError:
-                    self.log.printo("No Package " + p)
-                except SystemError as e:
-                    self.log.printo("Error: Unable to correct problems "
-                                    "in package %s (%s)" % (p, str(e)))
+            log_mark_failures(self.log, cache.mark_install_many(pkgs))
 
             try:
                 cache.commit()
@@ -363,6 +368,23 @@ class ElbeProject (object):
         self.host_sysrootenv.rfs.rmtree('/tmp')
         self.host_sysrootenv.rfs.rmtree('/var')
 
+    def restore_host_sysroot(self, cache, key, hostsysrootpath):
+        if not cache.enabled:
+            return False
+
+        with cache.lock():
+            entry = cache.lookup(key)
+            if entry is None:
+                self.log.printo("host sysroot cache miss: %s" % key)
+                return False
+
+            self.log.printo("host sysroot cache hit: %s" % key)
+            # the sdk directory is only archived, so the files can be
+            # shared with the cache
+            self.log.do('rm -rf "%s"' % hostsysrootpath)
+            link_tree(entry, hostsysrootpath)
+        return True
+
     def build_sdk(self):
         triplet = self.xml.defs["triplet"]
         elfcode = self.xml.defs["elfcode"]
@@ -381,15 +403,34 @@ class ElbeProject (object):
             host_pkglist.append('gdb-multiarch')
 
         # build target sysroot including libs and headers for the target
-        self.build_sysroot()
-        sdktargetpath = os.path.join(self.sdkpath, "sysroots", "target")
-        self.log.do("mkdir -p %s" % sdktargetpath)
-        self.log.do("tar xJf %s/sysroot.tar.xz -C %s" % (self.builddir,
-                                                         sdktargetpath))
+        sysroot_files = self.build_sysroot()
+
         # build host sysroot including cross compiler
+        # everything in sdkpath goes into the sdk, start with a clean one
+        self.log.do('rm -rf "%s"; mkdir -p "%s"' % (
+            self.sdkpath, os.path.join(self.sdkpath, 'sysroots')))
         hostsysrootpath = os.path.join(self.sdkpath, 'sysroots', 'host')
 
-        self.build_host_sysroot(host_pkglist, hostsysrootpath)
+        # the host sysroot only depends on the mirrors, their keys, the
+        # debootstrap variant and the host packages, so it is shared
+        # between the projects. A cdrom path does not identify its
+        # content, it is not cached.
+        cache = None
+        if not self.xml.has("project/mirror/cdrom"):
+            cache = CacheDir("hostsysroot", cfg['hostsysroot_cache_size'])
+            key = cache_key(self.xml.prj.text("suite"),
+                            self.xml.create_apt_sources_list(),
+                            host_pkglist, debootstrap_cmd(self.xml),
+                            key_digest(self.xml), elbe_version)
+
+        if cache is None or not self.restore_host_sysroot(cache, key,
+                                                          hostsysrootpath):
+            self.build_host_sysroot(host_pkglist, hostsysrootpath)
+
+            if cache is not None and cache.enabled:
+                self.log.printo("host sysroot cache: storing %s" % key)
+                cache.store(key, lambda path: link_tree(hostsysrootpath,
+                                                        path))
 
         n = gen_sdk_scripts(triplet,
                             elfcode,
@@ -398,12 +439,15 @@ class ElbeProject (object):
                             self.builddir,
                             self.sdkpath)
 
-        # create sdk tar and append it to setup script
-        self.log.do("cd %s; tar cJf ../sdk.txz ." % self.sdkpath)
+        # append the sdk archive to the setup script. The target sysroot
+        # is taken from the sysroot directory, it is not extracted from
+        # sysroot.tar.xz into the sdk directory.
+        self.log.do(sdk_payload_cmd(os.path.join(self.builddir, n),
+                                    self.sdkpath,
+                                    self.sysrootpath),
+                    stdin="\0".join(sysroot_files), log_stdin=False)
         self.log.do("cd %s; rm -rf sdk" % self.builddir)
-        self.log.do("cd %s; cat sdk.txz >> %s" % (self.builddir, n))
         self.log.do("cd %s; chmod +x %s" % (self.builddir, n))
-        self.log.do("cd %s; rm sdk.txz" % self.builddir)
 
     def pbuild(self, p):
         self.pdebuild_init()
@@ -483,6 +527,28 @@ class ElbeProject (object):
     def build(self, build_bin=False, build_sources=False, cdrom_size=None,
               skip_pkglist=False, skip_pbuild=False):
 
+        # pylint: disable=too-many-arguments
+
+        self.profile = BuildProfile(self.log)
+        saved_start = chroot_reuse_stats()
+        try:
+            self._build(build_bin, build_sources, cdrom_size,
+                        skip_pkglist, skip_pbuild)
+        finally:
+            saved = chroot_reuse_stats()
+            self.profile.set_counter("chroot_saved_subprocesses",
+                                     saved[0] - saved_start[0])
+            self.profile.set_counter("chroot_saved_mounts",
+                                     saved[1] - saved_start[1])
+            try:
+                self.profile.write(os.path.join(self.builddir,
+                                                "build-profile.json"))
+            except IOError:
+                self.log.printo("write build-profile.json failed")
+
+    def _build(self, build_bin, build_sources, cdrom_size,
+               skip_pkglist, skip_pbuild):
+
         # pylint: disable=too-many-arguments
         # pylint: disable=too-many-locals
         # pylint: disable=too-many-statements
@@ -497,31 +563,37 @@ class ElbeProject (object):
         else:
             m = ValidationMode.CHECK_BINARIES
 
-        self.xml.validate_apt_sources(m, self.arch)
+        with self.profile.stage("validate_apt_sources"):
+            self.xml.validate_apt_sources(m, self.arch)
 
         if self.xml.has('target/pbuilder') and not skip_pbuild:
-            if not os.path.exists(os.path.join(self.builddir, "pbuilder")):
-                self.create_pbuilder()
-            for p in self.xml.node('target/pbuilder'):
-                self.pbuild(p)
-                # the package might be needed by a following pbuild, so update
-                # the project repo that it can be installed in as
-                # build-dependency
-                self.repo.finalize()
+            with self.profile.stage("pbuild"):
+                if not os.path.exists(os.path.join(self.builddir,
+                                                   "pbuilder")):
+                    self.create_pbuilder()
+                for p in self.xml.node('target/pbuilder'):
+                    self.pbuild(p)
+                    # the package might be needed by a following pbuild, so
+                    # update the project repo that it can be installed in as
+                    # build-dependency
+                    self.repo.finalize()
 
         # To avoid update cache errors, the project repo needs to have
         # Release and Packages files, even if it's empty. So don't do this
         # in the if case above!
-        self.repo.finalize()
+        with self.profile.stage("repo_finalize"):
+            self.repo.finalize()
 
         # Create the build environment, if it does not a valid one
         # self.buildenv might be set when we come here.
         # However, if its not a full_buildenv, we specify clean here,
         # so it gets rebuilt properly.
         if not self.has_full_buildenv():
-            self.log.do('mkdir -p "%s"' % self.chrootpath)
-            self.buildenv = BuildEnv(self.xml, self.log, self.chrootpath,
-                                     build_sources=build_sources, clean=True)
+            with self.profile.stage("buildenv"):
+                self.log.do('mkdir -p "%s"' % self.chrootpath)
+                self.buildenv = BuildEnv(self.xml, self.log, self.chrootpath,
+                                         build_sources=build_sources,
+                                         clean=True)
             skip_pkglist = False
 
         # Import keyring
@@ -530,7 +602,8 @@ class ElbeProject (object):
 
         # Install packages
         if not skip_pkglist:
-            self.install_packages(self.buildenv)
+            with self.profile.stage("install_packages"):
+                self.install_packages(self.buildenv)
 
         try:
             self.buildenv.rfs.dump_elbeversion(self.xml)
@@ -539,11 +612,11 @@ class ElbeProject (object):
 
         # Extract target FS. We always create a new instance here with
         # clean=true, because we want a pristine directory.
-        self.targetfs = TargetFs(self.targetpath, self.log,
-                                 self.buildenv.xml, clean=True)
-        os.chdir(self.buildenv.rfs.fname(''))
-        extract_target(self.buildenv.rfs, self.xml, self.targetfs,
-                       self.log, self.get_rpcaptcache())
+        with self.profile.stage("extract_target"):
+            self.targetfs = TargetFs(self.targetpath, self.log,
+                                     self.buildenv.xml, clean=True)
+            extract_target(self.buildenv.rfs, self.xml, self.targetfs,
+                           self.log, self.get_rpcaptcache())
 
         # The validation file is created using check_full_pkgs() and
         # elbe_report(), both opening the file in append mode. So if an
@@ -553,16 +626,19 @@ class ElbeProject (object):
 
         # Package validation and package list
         if not skip_pkglist:
-            pkgs = self.xml.xml.node("/target/pkg-list")
-            if self.xml.has("fullpkgs"):
-                check_full_pkgs(pkgs, self.xml.xml.node("/fullpkgs"),
-                                self.validationpath, self.get_rpcaptcache())
-            else:
-                check_full_pkgs(pkgs, None, self.validationpath,
-                                self.get_rpcaptcache())
-            dump_fullpkgs(self.xml, self.buildenv.rfs, self.get_rpcaptcache())
-
-            self.xml.dump_elbe_version()
+            with self.profile.stage("check_full_pkgs"):
+                pkgs = self.xml.xml.node("/target/pkg-list")
+                if self.xml.has("fullpkgs"):
+                    check_full_pkgs(pkgs, self.xml.xml.node("/fullpkgs"),
+                                    self.validationpath,
+                                    self.get_rpcaptcache())
+                else:
+                    check_full_pkgs(pkgs, None, self.validationpath,
+                                    self.get_rpcaptcache())
+                dump_fullpkgs(self.xml, self.buildenv.rfs,
+                              self.get_rpcaptcache())
+
+                self.xml.dump_elbe_version()
 
         self.targetfs.write_fstab(self.xml)
 
@@ -574,7 +650,8 @@ class ElbeProject (object):
 
         # install packages for buildenv
         if not skip_pkglist:
-            self.install_packages(self.buildenv, buildenv=True)
+            with self.profile.stage("install_buildenv_packages"):
+                self.install_packages(self.buildenv, buildenv=True)
 
         # Write source.xml
         try:
@@ -584,33 +661,35 @@ class ElbeProject (object):
             self.log.printo("write source.xml failed (archive to huge?)")
 
         # Elbe report
-        reportpath = os.path.join(self.builddir, "elbe-report.txt")
-        elbe_report(self.xml, self.buildenv, self.get_rpcaptcache(),
-                    reportpath, self.validationpath, self.targetfs)
+        with self.profile.stage("elbe_report"):
+            reportpath = os.path.join(self.builddir, "elbe-report.txt")
+            elbe_report(self.xml, self.buildenv, self.get_rpcaptcache(),
+                        reportpath, self.validationpath, self.targetfs)
 
         # the current license code raises an exception that interrupts the hole
         # build if a licence can't be converted to utf-8. Exception handling
         # can be removed as soon as the licence code is more stable
         lic_err = False
-        try:
-            f = io.open(
-                os.path.join(
-                    self.builddir,
-                    "licence.txt"),
-                "w+",
-                encoding='utf-8')
-            self.buildenv.rfs.write_licenses(
-                f, self.log, os.path.join(
-                    self.builddir, "licence.xml"))
-        except Exception:
-            self.log.printo("error during generating licence.txt/xml")
-            self.log.printo(sys.exc_info()[0])
-            lic_err = True
-        finally:
-            f.close()
-        if lic_err:
-            os.remove(os.path.join(self.builddir, "licence.txt"))
-            os.remove(os.path.join(self.builddir, "licence.xml"))
+        with self.profile.stage("write_licenses"):
+            try:
+                f = io.open(
+                    os.path.join(
+                        self.builddir,
+                        "licence.txt"),
+                    "w+",
+                    encoding='utf-8')
+                self.buildenv.rfs.write_licenses(
+                    f, self.log, os.path.join(
+                        self.builddir, "licence.xml"))
+            except Exception:
+                self.log.printo("error during generating licence.txt/xml")
+                self.log.printo(sys.exc_info()[0])
+                lic_err = True
+            finally:
+                f.close()
+            if lic_err:
+                os.remove(os.path.join(self.builddir, "licence.txt"))
+                os.remove(os.path.join(self.builddir, "licence.xml"))
 
         # Use some handwaving to determine grub version
         # jessie and wheezy grubs are 2.0 but differ in behaviour
@@ -639,25 +718,32 @@ class ElbeProject (object):
             # version 0 == skip_grub
             grub_version = 0
             grub_fw_type = ""
-        self.targetfs.part_target(self.builddir, grub_version, grub_fw_type)
 
-        self.build_cdroms(build_bin, build_sources, cdrom_size)
+        with self.profile.stage("part_target"):
+            self.targetfs.part_target(self.builddir, grub_version,
+                                      grub_fw_type)
+
+        with self.profile.stage("build_cdroms"):
+            self.build_cdroms(build_bin, build_sources, cdrom_size)
 
         if self.postbuild_file:
-            self.log.h2("postbuild script:")
-            self.log.do(self.postbuild_file + ' "%s %s %s"' % (
-                self.builddir,
-                self.xml.text("project/version"),
-                self.xml.text("project/name")),
-                allow_fail=True)
+            with self.profile.stage("postbuild"):
+                self.log.h2("postbuild script:")
+                self.log.do(self.postbuild_file + ' "%s %s %s"' % (
+                    self.builddir,
+                    self.xml.text("project/version"),
+                    self.xml.text("project/name")),
+                    allow_fail=True)
 
-        do_prj_finetuning(self.xml,
-                          self.log,
-                          self.buildenv,
-                          self.targetfs,
-                          self.builddir)
+        with self.profile.stage("finetuning"):
+            do_prj_finetuning(self.xml,
+                              self.log,
+                              self.buildenv,
+                              self.targetfs,
+                              self.builddir)
 
-        self.targetfs.pack_images(self.builddir)
+        with self.profile.stage("pack_images"):
+            self.targetfs.pack_images(self.builddir)
 
         os.system('cat "%s"' % self.validationpath)
 
@@ -813,7 +899,8 @@ class ElbeProject (object):
                 arch,
                 self.rpcaptcache_notifier,
                 norecommend,
-                self.xml.prj.has('noauth'))
+                self.xml.prj.has('noauth'),
+                self.xml.get_proxy_env("localhost"))
         return env.rpcaptcache
 
     def drop_rpcaptcache(self, env=None):
@@ -951,14 +1038,8 @@ class ElbeProject (object):
                 pkgs = pkgs + target.xml.get_buildenv_packages()
 
             # Now install requested packages
-            for p in pkgs:
-                try:
-                    self.get_rpcaptcache(env=target).mark_install(p, None)
-                except KeyError:
-                    self.log.printo("No Package " + p)
-                except SystemError as e:
-                    self.log.printo("Error: Unable to correct problems in "
-                                    "package %s (%s)" % (p, str(e)))
+            failed = self.get_rpcaptcache(env=target).mark_install_many(pkgs)
+            log_mark_failures(self.log, failed)
 
             # temporary disabled because of
             # https://bugs.debian.org/cgi-bin/bugreport.cgi?bug=776057
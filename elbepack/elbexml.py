@@ -8,11 +8,11 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-import os
 import re
 import urllib2
 
 from base64 import standard_b64decode
+from urlparse import urlparse
 from tempfile import NamedTemporaryFile
 
 from elbepack.treeutils import etree
@@ -132,6 +132,20 @@ class ElbeXML(object):
 
         return mirror.replace("LOCALMACHINE", "10.0.2.2")
 
+    def get_proxy_env(self, localmachine):
+        """ returns the environment variables, which set the proxy of
+            the project mirror. They are passed to the commands, not set
+            in os.environ, which is shared by all projects of the daemon.
+        """
+        if not self.prj.has("mirror/primary_proxy"):
+            return {"http_proxy": "", "https_proxy": "", "no_proxy": ""}
+
+        proxy = self.prj.text("mirror/primary_proxy").strip()
+        proxy = proxy.replace("LOCALMACHINE", localmachine)
+        return {"http_proxy": proxy,
+                "https_proxy": proxy,
+                "no_proxy": "10.0.2.2,localhost,127.0.0.1"}
+
     # XXX: maybe add cdrom path param ?
     def create_apt_sources_list(self, build_sources=False):
         if self.prj is None:
@@ -168,12 +182,16 @@ class ElbeXML(object):
 
         return mirror.replace("LOCALMACHINE", "10.0.2.2")
 
-    def validate_repo(self, r):
+    @staticmethod
+    def validate_repo(r, opener=None):
+        if opener is None:
+            opener = urllib2.build_opener()
+
         try:
-            fp = urllib2.urlopen(r["url"] + "InRelease", None, 10)
+            fp = opener.open(r["url"] + "InRelease", None, 10)
         except urllib2.URLError:
             try:
-                fp = urllib2.urlopen(r["url"] + "Release", None, 10)
+                fp = opener.open(r["url"] + "Release", None, 10)
             except urllib2.URLError:
                 return False
 
@@ -249,22 +267,20 @@ class ElbeXML(object):
         if not self.prj:
             return
 
-        if self.prj.has("mirror/primary_proxy"):
-            os.environ["no_proxy"] = "10.0.2.2,localhost,127.0.0.1"
-            proxy = self.prj.text(
-                "mirror/primary_proxy").strip().replace("LOCALMACHINE",
-                                                        "10.0.2.2")
-            os.environ["http_proxy"] = proxy
-            os.environ["https_proxy"] = proxy
-        else:
-            os.environ["http_proxy"] = ""
-            os.environ["https_proxy"] = ""
-            os.environ["no_proxy"] = ""
+        proxy_env = self.get_proxy_env("10.0.2.2")
+        proxies = {}
+        if proxy_env["http_proxy"]:
+            proxies = {"http": proxy_env["http_proxy"],
+                       "https": proxy_env["https_proxy"]}
+        no_proxy = proxy_env["no_proxy"].split(",")
 
+        # the openers are local, installing them or setting the proxy in
+        # os.environ would affect the other projects of the daemon
         passman = urllib2.HTTPPasswordMgrWithDefaultRealm()
-        authhandler = urllib2.HTTPBasicAuthHandler(passman)
-        opener = urllib2.build_opener(authhandler)
-        urllib2.install_opener(opener)
+        opener = urllib2.build_opener(urllib2.HTTPBasicAuthHandler(passman),
+                                      urllib2.ProxyHandler(proxies))
+        direct = urllib2.build_opener(urllib2.HTTPBasicAuthHandler(passman),
+                                      urllib2.ProxyHandler({}))
 
         for r in repos:
             if '@' in r["url"]:
@@ -278,7 +294,11 @@ class ElbeXML(object):
                 r["url"] = scheme + t[1]
                 usr, passwd = auth.split(':')
                 passman.add_password(None, r["url"], usr, passwd)
-            if not self.validate_repo(r):
+            if urlparse(r["url"]).hostname in no_proxy:
+                valid = self.validate_repo(r, direct)
+            else:
+                valid = self.validate_repo(r, opener)
+            if not valid:
                 raise ValidationError(
                     ["Repository %s can not be validated" % r["url"]])
 
@@ -220,17 +220,6 @@ class Filesystem(object):
                 realpath = os.path.join(dirpath, f)
                 yield "/" + fpath, realpath
 
-    def mtime_snap(self, dirname='', exclude_dirs=None):
-        if not exclude_dirs:
-            exclude_dirs = []
-        mtime_index = {}
-
-        for fpath, realpath in self.walk_files(dirname, exclude_dirs):
-            stat = os.lstat(realpath)
-            mtime_index[fpath] = stat.st_mtime
-
-        return mtime_index
-
     def __disk_usage(self, directory):
         size = os.path.getsize(directory)
 
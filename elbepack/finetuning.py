@@ -15,7 +15,6 @@ import base64
 from shutil import rmtree
 from gpg import core
 from gpg.constants import PROTOCOL_OpenPGP
-from apt.package import FetchError
 
 from elbepack.repomanager import UpdateRepo
 from elbepack.rpcaptcache import get_rpcaptcache
@@ -512,38 +511,19 @@ class UpdatedAction(FinetuningAction):
         with buildenv:
             cache = get_rpcaptcache(buildenv.rfs, "updated-repo.log", arch)
 
-            pkglist = cache.get_installed_pkgs()
-            for pkg in pkglist:
-                try:
-                    cache.download_binary(
-                        pkg.name, '/tmp/pkgs', pkg.installed_version)
-                except ValueError:
-                    log.printo(
-                        "No Package " +
-                        pkg.name +
-                        "-" +
-                        pkg.installed_version)
-                except FetchError:
-                    log.printo(
-                        "Package " +
-                        pkg.name +
-                        "-" +
-                        pkg.installed_version +
-                        " could not be downloaded")
-                except TypeError:
-                    log.printo(
-                        "Package " +
-                        pkg.name +
-                        "-" +
-                        pkg.installed_version +
-                        " missing name or version")
+            pkgs = [(pkg.name, pkg.installed_version)
+                    for pkg in cache.get_installed_pkgs()]
+            fetched = cache.download_binaries(pkgs, '/tmp/pkgs')
+            for key in pkgs:
+                deb, err = fetched[key]
+                if deb is None:
+                    log.printo(err)
 
         r = UpdateRepo(target.xml,
                        target.path + '/var/cache/elbe/repos/base',
                        log)
 
-        for d in buildenv.rfs.glob('tmp/pkgs/*.deb'):
-            r.includedeb(d, 'main')
+        r.includedebs(buildenv.rfs.glob('tmp/pkgs/*.deb'), 'main')
         r.finalize()
 
         slist = target.path + '/etc/apt/sources.list.d/base.list'
@@ -682,9 +662,16 @@ class SetPackerAction(FinetuningAction):
 
     def execute_prj(self, _log, _buildenv, target, _builddir):
         img = self.node.et.text
-        packer = self.node.et.attrib['packer']
+        packer = packers[self.node.et.attrib['packer']]
 
-        target.image_packers[img] = packers[packer]
+        level = self.node.et.attrib.get('level')
+        if level is not None:
+            level = int(level)
+        threads = self.node.et.attrib.get('threads')
+        if threads is not None:
+            threads = int(threads)
+
+        target.image_packers[img] = packer.with_options(level, threads)
 
 
 FinetuningAction.register(SetPackerAction)
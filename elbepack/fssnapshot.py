@@ -0,0 +1,124 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# Copyright (c) 2018 Linutronix GmbH
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import stat
+
+from array import array
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+def _scan_scandir(dirname, subpath, exclude_dirs, out):
+    dirs = []
+    for entry in scandir(dirname):
+        fpath = subpath + "/" + entry.name
+        # like os.walk: symlinks to directories are neither listed
+        # as files nor followed
+        if entry.is_dir():
+            if not entry.is_symlink() and fpath not in exclude_dirs:
+                dirs.append((entry.path, fpath))
+            continue
+        out.append((fpath, entry.stat(follow_symlinks=False)))
+
+    for d, fpath in dirs:
+        _scan_scandir(d, fpath, exclude_dirs, out)
+
+
+def _scan_listdir(dirname, subpath, exclude_dirs, out):
+    dirs = []
+    for name in os.listdir(dirname):
+        fpath = subpath + "/" + name
+        realpath = os.path.join(dirname, name)
+        st = os.lstat(realpath)
+        if stat.S_ISDIR(st.st_mode):
+            if fpath not in exclude_dirs:
+                dirs.append((realpath, fpath))
+            continue
+        if stat.S_ISLNK(st.st_mode) and os.path.isdir(realpath):
+            continue
+        out.append((fpath, st))
+
+    for d, fpath in dirs:
+        _scan_listdir(d, fpath, exclude_dirs, out)
+
+
+def _mtime_ns(st):
+    try:
+        return st.st_mtime_ns
+    except AttributeError:
+        return int(round(st.st_mtime * 1000000000))
+
+
+class FsSnapshot(object):
+
+    """ The state of all files below a directory, taken with a single
+        walk. Paths are kept in a sorted list, inode, size, mtime in ns
+        and mode in arrays next to it, so that two snapshots can be
+        compared with a single merge pass.
+    """
+
+    def __init__(self, fs, dirname='', exclude_dirs=None):
+        entries = []
+        scan = _scan_scandir if scandir is not None else _scan_listdir
+        scan(fs.fname(dirname), "/" + dirname.strip("/") if dirname else "",
+             set(exclude_dirs or []), entries)
+        entries.sort(key=lambda e: e[0])
+
+        self.paths = [e[0] for e in entries]
+        self.ino = array('L', [e[1].st_ino for e in entries])
+        self.size = array('L', [e[1].st_size for e in entries])
+        self.mtime_ns = array('l', [_mtime_ns(e[1]) for e in entries])
+        self.mode = array('L', [e[1].st_mode for e in entries])
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def _same(self, i, other, j):
+        return (self.ino[i] == other.ino[j] and
+                self.size[i] == other.size[j] and
+                self.mtime_ns[i] == other.mtime_ns[j] and
+                self.mode[i] == other.mode[j])
+
+    def diff(self, older):
+        """ compares this snapshot with an older one. Returns the sets
+            of added, removed and changed paths.
+        """
+        added = set()
+        removed = set()
+        changed = set()
+
+        i = 0
+        j = 0
+        n = len(self.paths)
+        m = len(older.paths)
+        while i < n and j < m:
+            p = self.paths[i]
+            q = older.paths[j]
+            if p == q:
+                if not self._same(i, older, j):
+                    changed.add(p)
+                i += 1
+                j += 1
+            elif p < q:
+                added.add(p)
+                i += 1
+            else:
+                removed.add(q)
+                j += 1
+
+        added.update(self.paths[i:])
+        removed.update(older.paths[j:])
+
+        return added, removed, changed
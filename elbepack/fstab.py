@@ -137,6 +137,10 @@ class fstabentry(object):
         self.partnum = ppart.number
         self.number = '{}{}'.format(disk.type, ppart.number)
 
-    def losetup(self, outf, loopdev):
-        outf.do('losetup -o%d --sizelimit %d /dev/%s "%s"' %
-                (self.offset, self.size, loopdev, self.filename))
+    def losetup(self, outf):
+        """ attaches a free loop device to the partition and returns
+            its path, e.g. /dev/loop3
+        """
+        return outf.get_command_out(
+            'losetup --find --show -o%d --sizelimit %d "%s"' %
+            (self.offset, self.size, self.filename)).strip()
@@ -10,6 +10,13 @@
 from __future__ import print_function
 
 import os
+import copy
+import errno
+import tempfile
+import functools
+
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 
 import parted
 import _ped
@@ -17,18 +24,24 @@ import _ped
 from elbepack.fstab import fstabentry, mountpoint_dict
 from elbepack.asciidoclog import CommandError
 from elbepack.filesystem import size_to_int
+from elbepack.config import cfg
 
+SEEK_DATA = getattr(os, "SEEK_DATA", 3)
+SEEK_HOLE = getattr(os, "SEEK_HOLE", 4)
 
-def mkfs_mtd(outf, mtd, fslabel, target):
+# python >= 3.8
+copy_file_range = getattr(os, "copy_file_range", None)
 
-    # generated files
-    img_files = []
+
+def ubifs_volumes(mtd, fslabel):
+    """ returns the ubi volumes of mtd, which need an ubifs image """
+
+    vols = []
 
     if not mtd.has("ubivg"):
-        return img_files
+        return vols
 
-    ubivg = mtd.node("ubivg")
-    for v in ubivg:
+    for v in mtd.node("ubivg"):
         if not v.tag == "ubi":
             continue
 
@@ -38,23 +51,44 @@ def mkfs_mtd(outf, mtd, fslabel, target):
         if v.has("binary"):
             continue
 
-        label = v.text("label")
-        if label not in fslabel:
+        if v.text("label") not in fslabel:
             continue
 
-        try:
-            outf.do("mkfs.ubifs -r %s -o %s.ubifs -m %s -e %s -c %s %s" % (
-                os.path.join(target, "filesystems", fslabel[label].id),
-                os.path.join(target, label),
-                ubivg.text("miniosize"),
-                ubivg.text("logicaleraseblocksize"),
-                ubivg.text("maxlogicaleraseblockcount"),
-                fslabel[label].mkfsopt))
-            # only append the ubifs file if creation didn't fail
-            img_files.append("%s.ubifs" % label)
-        except CommandError:
-            # continue creating further ubifs filesystems
-            pass
+        vols.append(v)
+
+    return vols
+
+
+def mkfs_ubifs(outf, mtd, v, fslabel, target):
+    """ creates the ubifs image of volume v and returns the list of
+        generated files
+    """
+
+    ubivg = mtd.node("ubivg")
+    label = v.text("label")
+
+    try:
+        outf.do("mkfs.ubifs -r %s -o %s.ubifs -m %s -e %s -c %s %s" % (
+            os.path.join(target, "filesystems", fslabel[label].id),
+            os.path.join(target, label),
+            ubivg.text("miniosize"),
+            ubivg.text("logicaleraseblocksize"),
+            ubivg.text("maxlogicaleraseblockcount"),
+            fslabel[label].mkfsopt))
+        # only append the ubifs file if creation didn't fail
+        return ["%s.ubifs" % label]
+    except CommandError:
+        # continue creating further ubifs filesystems
+        return []
+
+
+def mkfs_mtd(outf, mtd, fslabel, target):
+
+    # generated files
+    img_files = []
+
+    for v in ubifs_volumes(mtd, fslabel):
+        img_files.extend(mkfs_ubifs(outf, mtd, v, fslabel, target))
 
     return img_files
 
@@ -143,6 +177,49 @@ def build_image_mtd(outf, mtd, target):
     return img_files
 
 
+def losetup_image(outf, fname, partscan=False):
+    """ attaches a free loop device to the image fname and returns its
+        path. The device is allocated by losetup, so that several images
+        can be built at the same time.
+    """
+    opt = "--partscan " if partscan else ""
+    return outf.get_command_out(
+        'losetup --find --show %s"%s"' % (opt, fname)).strip()
+
+
+def losetup_detach(outf, loopdev):
+    if loopdev:
+        outf.do('losetup --detach "%s"' % loopdev, allow_fail=True)
+
+
+def poop_device(outf, loopdev):
+    """ grub-install and grub-probe handle /dev/loop* devices specially,
+        so grub gets a copy of the device node of loopdev, named
+        /dev/poop<N>. Returns the path of the copy.
+    """
+    poopdev = loopdev.replace('/dev/loop', '/dev/poop', 1)
+    outf.do('cp -a "%s" "%s"' % (loopdev, poopdev))
+    return poopdev
+
+
+def remove_poop_device(outf, poopdev):
+    if poopdev:
+        outf.do('rm -f "%s"' % poopdev, allow_fail=True)
+
+
+def make_imagemnt(target):
+    # every image uses its own mount point, the images of several
+    # projects or of one project may be built at the same time
+    return tempfile.mkdtemp(prefix="imagemnt-", dir=target)
+
+
+def remove_imagemnt(imagemnt):
+    try:
+        os.rmdir(imagemnt)
+    except OSError:
+        pass
+
+
 class grubinstaller_base(object):
     def __init__(self, outf, fw_type=None):
         self.outf = outf
@@ -171,26 +248,31 @@ class grubinstaller202(grubinstaller_base):
         if not self.root:
             return
 
-        imagemnt = os.path.join(target, "imagemnt")
+        imagemnt = make_imagemnt(target)
+        loopdev = None
+        poopdev = None
         try:
-            self.outf.do('cp -a /dev/loop0 /dev/poop0')
+            loopdev = losetup_image(self.outf, self.root.filename)
+            poopdev = poop_device(self.outf, loopdev)
+            self.outf.do('kpartx -as "%s"' % poopdev)
+
+            # kpartx names the partitions after the device node
+            mapper = "/dev/mapper/%sp%%d" % os.path.basename(poopdev)
 
-            self.outf.do('losetup /dev/poop0 "%s"' % self.root.filename)
-            self.outf.do('kpartx -as /dev/poop0')
             self.outf.do(
-                'mount /dev/mapper/poop0p%d %s' %
-                (self.root.partnum, imagemnt))
+                'mount %s %s' %
+                (mapper % self.root.partnum, imagemnt))
 
             if self.boot:
                 self.outf.do(
-                    'mount /dev/mapper/poop0p%d %s' %
-                    (self.boot.partnum, os.path.join(
+                    'mount %s %s' %
+                    (mapper % self.boot.partnum, os.path.join(
                         imagemnt, "boot")))
 
             if self.boot_efi:
                 self.outf.do(
-                    'mount /dev/mapper/poop0p%d %s' %
-                    (self.boot_efi.partnum, os.path.join(
+                    'mount %s %s' %
+                    (mapper % self.boot_efi.partnum, os.path.join(
                         imagemnt, "boot/efi")))
 
             self.outf.do(
@@ -212,7 +294,7 @@ class grubinstaller202(grubinstaller_base):
             self.outf.do('mkdir -p "%s"' % os.path.join(imagemnt, "boot/grub"))
 
             devmap = open(os.path.join(imagemnt, "boot/grub/device.map"), "w")
-            devmap.write("(hd0) /dev/poop0\n")
+            devmap.write("(hd0) %s\n" % poopdev)
             devmap.close()
 
             self.outf.do("chroot %s  update-initramfs -u -k all" % imagemnt)
@@ -221,16 +303,18 @@ class grubinstaller202(grubinstaller_base):
             if self.fw_type == "efi" or self.fw_type == "hybrid":
                 self.outf.do(
                     "chroot %s grub-install --target=x86_64-efi --removable "
-                    "--no-floppy /dev/poop0" %
-                    (imagemnt))
+                    "--no-floppy %s" %
+                    (imagemnt, poopdev))
             if self.fw_type == "hybrid" or self.fw_type is None:
                 # when we are in hybrid mode, install grub also into MBR
                 self.outf.do(
-                    "chroot %s grub-install --no-floppy /dev/poop0" %
-                    (imagemnt))
+                    "chroot %s grub-install --no-floppy %s" %
+                    (imagemnt, poopdev))
 
         finally:
-            os.unlink(os.path.join(imagemnt, "boot/grub/device.map"))
+            devmap = os.path.join(imagemnt, "boot/grub/device.map")
+            if os.path.exists(devmap):
+                os.unlink(devmap)
             self.outf.do(
                 "umount %s" %
                 os.path.join(
@@ -252,20 +336,21 @@ class grubinstaller202(grubinstaller_base):
 
             if self.boot_efi:
                 self.outf.do(
-                    'umount /dev/mapper/poop0p%d' %
-                    self.boot_efi.partnum, allow_fail=True)
+                    'umount %s' % os.path.join(imagemnt, "boot/efi"),
+                    allow_fail=True)
 
             if self.boot:
                 self.outf.do(
-                    'umount /dev/mapper/poop0p%d' %
-                    self.boot.partnum, allow_fail=True)
+                    'umount %s' % os.path.join(imagemnt, "boot"),
+                    allow_fail=True)
 
-            self.outf.do(
-                'umount /dev/mapper/poop0p%d' %
-                self.root.partnum, allow_fail=True)
+            self.outf.do('umount %s' % imagemnt, allow_fail=True)
 
-            self.outf.do('kpartx -d /dev/poop0', allow_fail=True)
-            self.outf.do("losetup -d /dev/poop0", allow_fail=True)
+            if poopdev:
+                self.outf.do('kpartx -d "%s"' % poopdev, allow_fail=True)
+            remove_poop_device(self.outf, poopdev)
+            losetup_detach(self.outf, loopdev)
+            remove_imagemnt(imagemnt)
 
 
 class grubinstaller199(grubinstaller_base):
@@ -274,26 +359,30 @@ class grubinstaller199(grubinstaller_base):
         if not self.root:
             return
 
-        imagemnt = os.path.join(target, "imagemnt")
+        imagemnt = make_imagemnt(target)
+        loopdev = None
+        rootdev = None
+        bootdev = None
+        poopdevs = []
         try:
-            self.outf.do('cp -a /dev/loop0 /dev/poop0')
-            self.outf.do('cp -a /dev/loop1 /dev/poop1')
-            self.outf.do('cp -a /dev/loop2 /dev/poop2')
-
-            self.outf.do('losetup /dev/poop0 "%s"' % self.root.filename)
-            self.root.losetup(self.outf, "poop1")
-            self.outf.do('mount /dev/poop1 %s' % imagemnt)
+            loopdev = losetup_image(self.outf, self.root.filename)
+            poopdevs.append(poop_device(self.outf, loopdev))
+            rootdev = self.root.losetup(self.outf)
+            poopdevs.append(poop_device(self.outf, rootdev))
+            self.outf.do('mount %s %s' % (rootdev, imagemnt))
 
             if self.boot:
-                self.boot.losetup(self.outf, "poop2")
-                self.outf.do('mount /dev/poop2 %s' %
-                             (os.path.join(imagemnt, "boot")))
+                bootdev = self.boot.losetup(self.outf)
+                poopdevs.append(poop_device(self.outf, bootdev))
+                self.outf.do('mount %s %s' %
+                             (bootdev, os.path.join(imagemnt, "boot")))
 
             devmap = open(os.path.join(imagemnt, "boot/grub/device.map"), "w")
-            devmap.write("(hd0) /dev/poop0\n")
-            devmap.write("(hd0,%s) /dev/poop1\n" % self.root.number)
+            devmap.write("(hd0) %s\n" % poopdevs[0])
+            devmap.write("(hd0,%s) %s\n" % (self.root.number, poopdevs[1]))
             if self.boot:
-                devmap.write("(hd0,%s) /dev/poop2\n" % self.boot.number)
+                devmap.write("(hd0,%s) %s\n" % (self.boot.number,
+                                                 poopdevs[2]))
 
             devmap.close()
 
@@ -317,11 +406,13 @@ class grubinstaller199(grubinstaller_base):
             self.outf.do("chroot %s  update-grub2" % imagemnt)
 
             self.outf.do(
-                "chroot %s  grub-install --no-floppy /dev/loop0" %
-                imagemnt)
+                "chroot %s  grub-install --no-floppy %s" %
+                (imagemnt, poopdevs[0]))
 
         finally:
-            os.unlink(os.path.join(imagemnt, "boot/grub/device.map"))
+            devmap = os.path.join(imagemnt, "boot/grub/device.map")
+            if os.path.exists(devmap):
+                os.unlink(devmap)
 
             self.outf.do(
                 "umount -l %s" %
@@ -342,14 +433,20 @@ class grubinstaller199(grubinstaller_base):
                     "sys"),
                 allow_fail=True)
 
-            self.outf.do("losetup -d /dev/poop0", allow_fail=True)
+            for poopdev in poopdevs:
+                remove_poop_device(self.outf, poopdev)
 
-            if self.boot:
-                self.outf.do('umount /dev/poop2', allow_fail=True)
-                self.outf.do('losetup -d /dev/poop2', allow_fail=True)
+            losetup_detach(self.outf, loopdev)
+
+            if bootdev:
+                self.outf.do('umount %s' % bootdev, allow_fail=True)
+                losetup_detach(self.outf, bootdev)
 
-            self.outf.do('umount /dev/poop1', allow_fail=True)
-            self.outf.do('losetup -d /dev/poop1', allow_fail=True)
+            if rootdev:
+                self.outf.do('umount %s' % rootdev, allow_fail=True)
+                losetup_detach(self.outf, rootdev)
+
+            remove_imagemnt(imagemnt)
 
 
 class simple_fstype(object):
@@ -399,11 +496,14 @@ def create_partition(
     return ppart
 
 
-def create_label(outf, disk, part, ppart, fslabel, target, grub):
+def create_label(disk, part, ppart, fslabel, grub, partitions):
 
     # pylint: disable=too-many-arguments
 
-    entry = fslabel[part.text("label")]
+    # the same label may be used by several images, which are built
+    # at the same time, so every partition gets its own copy of the
+    # fstab entry
+    entry = copy.copy(fslabel[part.text("label")])
     entry.set_geometry(ppart, disk)
 
     if entry.mountpoint == "/":
@@ -413,33 +513,150 @@ def create_label(outf, disk, part, ppart, fslabel, target, grub):
     elif entry.mountpoint == "/boot/efi":
         grub.set_boot_efi_entry(entry)
 
-    entry.losetup(outf, "loop0")
-    outf.do(
-        'mkfs.%s %s %s /dev/loop0' %
-        (entry.fstype,
-         entry.mkfsopt,
-         entry.get_label_opt()))
-
-    outf.do('mount /dev/loop0 %s' % os.path.join(target, "imagemnt"))
-    outf.do(
-        'cp -a "%s/." "%s/"' %
-        (os.path.join(
-            target, "filesystems", entry.id), os.path.join(
-            target, "imagemnt")), allow_fail=True)
-    outf.do('umount /dev/loop0')
-    outf.do('losetup -d /dev/loop0')
+    partitions.append(entry)
 
     return ppart
 
 
+# filesystems, which mkfs_from_dir() can create from a directory
+mkfs_dir_fstypes = ("ext2", "ext3", "ext4", "vfat", "btrfs")
+
+
+def mkfs_from_dir(outf, entry, fname, srcdir):
+    """ creates the filesystem of entry in the file fname and fills
+        it with the contents of srcdir, without mounting it.
+    """
+    if entry.fstype in ("ext2", "ext3", "ext4"):
+        outf.do('mkfs.%s %s %s -d "%s" "%s"' %
+                (entry.fstype, entry.mkfsopt, entry.get_label_opt(),
+                 srcdir, fname))
+    elif entry.fstype == "btrfs":
+        outf.do('mkfs.btrfs %s %s --rootdir "%s" "%s"' %
+                (entry.mkfsopt, entry.get_label_opt(), srcdir, fname))
+    elif entry.fstype == "vfat":
+        outf.do('mkfs.vfat %s %s "%s"' %
+                (entry.mkfsopt, entry.get_label_opt(), fname))
+        names = sorted(os.listdir(srcdir))
+        if names:
+            # like 'cp -a' into a mounted vfat, files that vfat can
+            # not hold (e.g. symlinks) do not fail the build
+            outf.do('mcopy -s -p -m -i "%s" %s ::/' %
+                    (fname, " ".join('"%s"' % os.path.join(srcdir, n)
+                                     for n in names)),
+                    allow_fail=True, env_add={'MTOOLS_SKIP_CHECK': '1'})
+    else:
+        raise ValueError("can not create %s from a directory" %
+                         entry.fstype)
+
+
+def splice_file(src, dst, offset, blocksize=4 * 1024 * 1024):
+    """ copies src into dst at offset. Only the data regions of src are
+        copied, holes are skipped, so that a sparse dst stays sparse.
+        The region of dst must be zeroed already.
+    """
+
+    # pylint: disable=too-many-locals
+
+    fsrc = os.open(src, os.O_RDONLY)
+    fdst = os.open(dst, os.O_WRONLY)
+    try:
+        size = os.fstat(fsrc).st_size
+        pos = 0
+        while pos < size:
+            try:
+                start = os.lseek(fsrc, pos, SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    # no data after pos
+                    break
+                raise
+            end = os.lseek(fsrc, start, SEEK_HOLE)
+
+            while start < end:
+                count = min(blocksize, end - start)
+                if copy_file_range is not None:
+                    n = copy_file_range(fsrc, fdst, count, start,
+                                        offset + start)
+                else:
+                    os.lseek(fsrc, start, os.SEEK_SET)
+                    data = os.read(fsrc, count)
+                    os.lseek(fdst, offset + start, os.SEEK_SET)
+                    n = 0
+                    while n < len(data):
+                        n += os.write(fdst, data[n:])
+                if n <= 0:
+                    raise IOError("short copy from %s" % src)
+                start += n
+
+            pos = end
+    finally:
+        os.close(fsrc)
+        os.close(fdst)
+
+
+def populate_partition_nomount(outf, entry, target):
+    """ creates the filesystem in a sparse file, which is then copied
+        into the disk image at the offset of the partition.
+    """
+    fd, fname = tempfile.mkstemp(prefix="partition-", suffix=".img",
+                                 dir=target)
+    try:
+        os.ftruncate(fd, entry.size)
+        os.close(fd)
+        fd = None
+
+        mkfs_from_dir(outf, entry, fname,
+                      os.path.join(target, "filesystems", entry.id))
+        outf.printo("copying %s into %s at offset %d" %
+                    (fname, entry.filename, entry.offset))
+        splice_file(fname, entry.filename, entry.offset)
+    finally:
+        if fd is not None:
+            os.close(fd)
+        os.unlink(fname)
+
+
+def populate_partition(outf, entry, target, backend="mount"):
+    """ backend is either "mount", the partition is mounted via a loop
+        device and filled with 'cp -a', or "mkfs", the filesystem is
+        created from the directory without mounting it. "mkfs" falls
+        back to "mount" for filesystems, which can not be created from
+        a directory.
+    """
+    if backend == "mkfs" and entry.fstype in mkfs_dir_fstypes:
+        populate_partition_nomount(outf, entry, target)
+        return
+
+    loopdev = entry.losetup(outf)
+    imagemnt = make_imagemnt(target)
+    try:
+        outf.do(
+            'mkfs.%s %s %s %s' %
+            (entry.fstype,
+             entry.mkfsopt,
+             entry.get_label_opt(),
+             loopdev))
+
+        outf.do('mount %s %s' % (loopdev, imagemnt))
+        try:
+            outf.do(
+                'cp -a "%s/." "%s/"' %
+                (os.path.join(target, "filesystems", entry.id), imagemnt),
+                allow_fail=True)
+        finally:
+            outf.do('umount %s' % loopdev)
+    finally:
+        losetup_detach(outf, loopdev)
+        remove_imagemnt(imagemnt)
+
+
 def create_logical_partitions(
-        outf,
         disk,
         extended,
         epart,
         fslabel,
-        target,
-        grub):
+        grub,
+        partitions):
 
     # pylint: disable=too-many-arguments
 
@@ -459,78 +676,116 @@ def create_logical_partitions(
             size_in_sectors,
             current_sector)
         if logical.has("label") and logical.text("label") in fslabel:
-            create_label(outf, disk, logical, lpart, fslabel, target, grub)
+            create_label(disk, logical, lpart, fslabel, grub, partitions)
 
         current_sector += lpart.getLength()
 
 
-def do_image_hd(outf, hd, fslabel, target, grub_version, grub_fw_type=None):
+class HdImage(object):
 
-    # pylint: disable=too-many-arguments
-    # pylint: disable=too-many-locals
-    # pylint: disable=too-many-branches
+    """ A msdoshd or gpthd image. The partition table is written by
+        the constructor, the partitions are filled by populate() and
+        grub is installed by finish(), after all partitions are done.
+    """
 
-    sector_size = 512
-    s = size_to_int(hd.text("size"))
-    size_in_sectors = s / sector_size
+    def __init__(self, outf, hd, fslabel, target, grub_version,
+                 grub_fw_type=None):
 
-    imagename = os.path.join(target, hd.text("name"))
-    outf.do('rm -f "%s"' % imagename, allow_fail=True)
-    f = open(imagename, "wb")
-    f.truncate(size_in_sectors * sector_size)
-    f.close()
-
-    imag = parted.Device(imagename)
-    if hd.tag == "gpthd":
-        disk = parted.freshDisk(imag, "gpt")
-    else:
-        disk = parted.freshDisk(imag, "msdos")
-
-    if grub_version == 199:
-        grub = grubinstaller199(outf)
-    elif grub_version == 202 and grub_fw_type == "efi":
-        grub = grubinstaller202(outf, "efi")
-    elif grub_version == 202 and grub_fw_type == "hybrid":
-        grub = grubinstaller202(outf, "hybrid")
-    elif grub_version == 202:
-        grub = grubinstaller202(outf)
-    else:
-        grub = grubinstaller_base(outf)
-
-    current_sector = 2048
-    for part in hd:
-
-        if part.tag == "partition":
-            ppart = create_partition(
-                disk,
-                part,
-                parted.PARTITION_NORMAL,
-                fslabel,
-                size_in_sectors,
-                current_sector)
-            if part.text("label") in fslabel:
-                create_label(outf, disk, part, ppart, fslabel, target, grub)
-        elif part.tag == "extended":
-            ppart = create_partition(
-                disk,
-                part,
-                parted.PARTITION_EXTENDED,
-                fslabel,
-                size_in_sectors,
-                current_sector)
-            create_logical_partitions(
-                outf, disk, part, ppart, fslabel, target, grub)
+        # pylint: disable=too-many-arguments
+        # pylint: disable=too-many-locals
+        # pylint: disable=too-many-branches
+
+        self.outf = outf
+        self.hd = hd
+        self.target = target
+        self.grub_version = grub_version
+        self.name = hd.text("name")
+        self.partitions = []
+
+        sector_size = 512
+        s = size_to_int(hd.text("size"))
+        size_in_sectors = s / sector_size
+
+        imagename = os.path.join(target, self.name)
+        outf.do('rm -f "%s"' % imagename, allow_fail=True)
+        f = open(imagename, "wb")
+        f.truncate(size_in_sectors * sector_size)
+        f.close()
+
+        imag = parted.Device(imagename)
+        if hd.tag == "gpthd":
+            disk = parted.freshDisk(imag, "gpt")
         else:
-            continue
+            disk = parted.freshDisk(imag, "msdos")
+
+        if grub_version == 199:
+            self.grub = grubinstaller199(outf)
+        elif grub_version == 202 and grub_fw_type == "efi":
+            self.grub = grubinstaller202(outf, "efi")
+        elif grub_version == 202 and grub_fw_type == "hybrid":
+            self.grub = grubinstaller202(outf, "hybrid")
+        elif grub_version == 202:
+            self.grub = grubinstaller202(outf)
+        else:
+            self.grub = grubinstaller_base(outf)
+
+        current_sector = 2048
+        for part in hd:
+
+            if part.tag == "partition":
+                ppart = create_partition(
+                    disk,
+                    part,
+                    parted.PARTITION_NORMAL,
+                    fslabel,
+                    size_in_sectors,
+                    current_sector)
+                if part.text("label") in fslabel:
+                    create_label(disk, part, ppart, fslabel, self.grub,
+                                 self.partitions)
+            elif part.tag == "extended":
+                ppart = create_partition(
+                    disk,
+                    part,
+                    parted.PARTITION_EXTENDED,
+                    fslabel,
+                    size_in_sectors,
+                    current_sector)
+                create_logical_partitions(
+                    disk, part, ppart, fslabel, self.grub, self.partitions)
+            else:
+                continue
 
-        current_sector += ppart.getLength()
+            current_sector += ppart.getLength()
 
-    disk.commit()
+        # the partition table lies outside of the partitions, so it
+        # can be written before the partitions are filled
+        disk.commit()
 
-    if hd.has("grub-install") and grub_version:
-        grub.install(target)
+    def populate_jobs(self, backend="mount"):
+        return [functools.partial(populate_partition, self.outf, entry,
+                                  self.target, backend)
+                for entry in self.partitions]
 
-    return hd.text("name")
+    def finish(self):
+        if self.hd.has("grub-install") and self.grub_version:
+            self.grub.install(self.target)
+
+
+def run_jobs(jobs, workers):
+    """ runs the callables in jobs with at most workers threads and
+        returns their results in the order of jobs. All jobs are
+        finished, when an exception is raised.
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        return [job() for job in jobs]
+
+    pool = ThreadPool(min(workers, len(jobs)))
+    try:
+        return pool.map(lambda job: job(), jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
 
 
 def add_binary_blob(outf, hd, target):
@@ -566,7 +821,8 @@ def add_binary_blob(outf, hd, target):
             bs))
 
 
-def do_hdimg(outf, xml, target, rfs, grub_version, grub_fw_type=None):
+def do_hdimg(outf, xml, target, rfs, grub_version, grub_fw_type=None,
+             workers=None, backend=None):
 
     # pylint: disable=too-many-arguments
     # pylint: disable=too-many-locals
@@ -604,6 +860,8 @@ def do_hdimg(outf, xml, target, rfs, grub_version, grub_fw_type=None):
     fspath = os.path.join(target, "filesystems")
     outf.do('mkdir -p %s' % fspath)
 
+    # the images use private mount points, imagemnt is used by the
+    # project finetuning
     imagemnt = os.path.join(target, "imagemnt")
     outf.do('mkdir -p %s' % imagemnt)
 
@@ -616,32 +874,43 @@ def do_hdimg(outf, xml, target, rfs, grub_version, grub_fw_type=None):
             outf.do('mv "%s"/* "%s"' % (rfs.fname(l.mountpoint), os.path.join(
                 fspath, l.id)), allow_fail=True)
 
+    if workers is None:
+        workers = cpu_count()
+
+    if backend is None:
+        backend = cfg['imgbackend']
+
     try:
-        # Now iterate over all images and create filesystems and partitions
+        # Write the partition tables first, then fill the partitions
+        # of all images and the ubifs volumes at the same time. grub
+        # is installed, when all partitions of an image are done.
+        hdimages = []
+        jobs = []
+        # the names of the disk images and the indexes of the ubifs
+        # jobs, in the order of the xml
+        order = []
         for i in xml.tgt.node("images"):
-            if i.tag == "msdoshd":
-                img = do_image_hd(
-                    outf,
-                    i,
-                    fslabel,
-                    target,
-                    grub_version,
-                    grub_fw_type)
-                img_files.append(img)
-
-            if i.tag == "gpthd":
-                img = do_image_hd(
-                    outf,
-                    i,
-                    fslabel,
-                    target,
-                    grub_version,
-                    grub_fw_type)
-                img_files.append(img)
+            if i.tag in ("msdoshd", "gpthd"):
+                img = HdImage(outf, i, fslabel, target, grub_version,
+                              grub_fw_type)
+                hdimages.append(img)
+                jobs.extend(img.populate_jobs(backend))
+                order.append(img.name)
 
             if i.tag == "mtd":
-                imgs = mkfs_mtd(outf, i, fslabel, target)
-                img_files.extend(imgs)
+                for v in ubifs_volumes(i, fslabel):
+                    order.append(len(jobs))
+                    jobs.append(functools.partial(mkfs_ubifs, outf, i, v,
+                                                  fslabel, target))
+
+        results = run_jobs(jobs, workers)
+        for o in order:
+            if isinstance(o, int):
+                img_files.extend(results[o])
+            else:
+                img_files.append(o)
+
+        run_jobs([h.finish for h in hdimages], workers)
     finally:
         # Put back the filesystems into /target
         # most shallow fs first...
@@ -664,6 +933,10 @@ def do_hdimg(outf, xml, target, rfs, grub_version, grub_fw_type=None):
         if (i.tag == "msdoshd") or (i.tag == "gpthd"):
             add_binary_blob(outf, i, target)
 
-    # use set() to remove duplicates, but
-    # return a list
-    return list(set(img_files))
+    # remove duplicates, but keep the order of the xml, so that
+    # the list does not depend on the order the jobs finished
+    ret = []
+    for f in img_files:
+        if f not in ret:
+            ret.append(f)
+    return ret
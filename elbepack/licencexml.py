@@ -7,11 +7,18 @@
 
 import io
 import re
+import json
+import hashlib
+import threading
 
 import warnings
 
+from multiprocessing import Pool, cpu_count
+
 from debian.copyright import Copyright, LicenseParagraph
 from elbepack.treeutils import etree
+from elbepack.cachedir import CacheDir
+from elbepack.config import cfg
 
 warnings.simplefilter('error')
 
@@ -43,30 +50,162 @@ def get_heuristics_license_list(c):
     return set(licenses)
 
 
+def parse_copyright(copyright_text):
+    """ parses a copyright file, copyright_text must already be free of
+        illegal characters. Returns a tuple of ('machinereadable',
+        [(globs, license, copyright), ...]), ('heuristics', [licenses])
+        or None, if nothing was found.
+
+        Only plain types are returned, so that the result can be passed
+        between processes and stored as json.
+    """
+    bytesio = io.StringIO(unicode(copyright_text))
+    try:
+        c = Copyright(bytesio)
+        files = []
+
+        for cc in c.all_files_paragraphs():
+            files.append((list(cc.files), cc.license.synopsis, cc.copyright))
+
+        return ('machinereadable', files)
+
+    except Exception:
+        pass
+
+    bytesio.seek(0)
+
+    c = do_heuristics(bytesio)
+
+    if c is not None:
+        return ('heuristics', sorted(get_heuristics_license_list(c)))
+
+    # Heuristics did not find anything either
+    return None
+
+
+class LicenceCache(CacheDir):
+
+    """ The results of parse_copyright(), stored as json and keyed by
+        the sha256 of the sanitized copyright text. Most packages ship
+        the same copyright file in every build, so it needs to be
+        parsed only once.
+    """
+
+    # bump, when the format of the parse_copyright() result changes
+    version = 1
+
+    def __init__(self, maxsize=None):
+        if maxsize is None:
+            maxsize = cfg['licence_cache_size']
+        CacheDir.__init__(self, 'licences', maxsize)
+
+    @classmethod
+    def key(cls, copyright_text):
+        m = hashlib.sha256(copyright_text.encode('utf-8'))
+        return "%s-%d" % (m.hexdigest(), cls.version)
+
+    def get(self, key):
+        """ returns (True, parsed) for a cached entry, (False, None)
+            otherwise.
+        """
+        try:
+            fname = self.lookup(key)
+            if fname is None:
+                return (False, None)
+            with open(fname, "r") as f:
+                return (True, json.load(f))
+        except (IOError, OSError, ValueError):
+            return (False, None)
+
+    def put(self, key, parsed):
+        def populate(tmp):
+            with open(tmp, "w") as f:
+                json.dump(parsed, f)
+        try:
+            self.store(key, populate)
+        except (IOError, OSError):
+            # the cache is an optimisation only
+            pass
+
+
+def parse_copyrights(texts, processes=None):
+    """ returns the parse_copyright() results for the sanitized texts,
+        in the same order. Texts that are not in the LicenceCache are
+        parsed in a process pool, identical texts only once.
+
+        A process, which runs other threads, e.g. the soap daemon, is
+        not forked, the child could deadlock on a lock held by one of
+        the other threads. The texts are parsed in the calling thread
+        then.
+    """
+    cache = LicenceCache()
+    keys = [LicenceCache.key(t) for t in texts]
+
+    results = {}
+    todo = []
+    for key, text in zip(keys, texts):
+        if key in results:
+            continue
+        found, parsed = cache.get(key)
+        if found:
+            results[key] = parsed
+        else:
+            results[key] = None
+            todo.append((key, text))
+
+    if len(todo) > 1 and threading.active_count() == 1:
+        pool = Pool(processes or cpu_count())
+        try:
+            parsed = pool.map(parse_copyright, [t[1] for t in todo],
+                              chunksize=max(1, len(todo) // 64))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        parsed = [parse_copyright(t[1]) for t in todo]
+
+    for (key, _), p in zip(todo, parsed):
+        results[key] = p
+        cache.put(key, p)
+
+    return [results[key] for key in keys]
+
+
 class copyright_xml (object):
     def __init__(self):
         self.outxml = etree(None)
         self.pkglist = self.outxml.setroot('pkglicenses')
 
-    def add_copyright_file(self, pkg_name, copyright_text):
+    @staticmethod
+    def sanitize(copyright_text):
+        # remove illegal characters from copyright_text
+        copyright_text, _ = remove_re.subn('', copyright_text)
+        return copyright_text
+
+    def add_copyright_file(self, pkg_name, copyright_text, parsed=False):
+        """ parsed is the result of parse_copyright() for the sanitized
+            text, it is computed here, if it is not given.
+        """
 
         # pylint: disable=too-many-locals
 
-        # remove illegal characters from copyright_text
-        copyright_text, _ = remove_re.subn('', copyright_text)
+        copyright_text = self.sanitize(copyright_text)
 
         xmlpkg = self.pkglist.append('pkglicense')
         xmlpkg.et.attrib['name'] = pkg_name
         txtnode = xmlpkg.append('text')
         txtnode.et.text = copyright_text
 
-        bytesio = io.StringIO(unicode(txtnode.et.text))
-        try:
-            c = Copyright(bytesio)
-            files = []
+        if parsed is False:
+            parsed = parse_copyright(copyright_text)
+
+        if parsed is None:
+            return
 
-            for cc in c.all_files_paragraphs():
-                files.append((cc.files, cc.license.synopsis, cc.copyright))
+        kind, data = parsed
+
+        if kind == 'machinereadable':
+            files = data
 
             xmlpkg.append('machinereadable')
             xmllic = xmlpkg.append('debian_licenses')
@@ -90,29 +229,12 @@ class copyright_xml (object):
 
                 cc = ff.append('copyright')
                 cc.et.text = f[2]
-
-            return
-
-        except Exception:
-            pass
-
-        bytesio.seek(0)
-
-        c = do_heuristics(bytesio)
-
-        if c is not None:
-            lics = get_heuristics_license_list(c)
+        else:
             xmlpkg.append('heuristics')
             xmllic = xmlpkg.append('debian_licenses')
-            for i in lics:
+            for i in data:
                 ltag = xmllic.append('license')
                 ltag.et.text = i
 
-            return
-
-        # Heuristics did not find anything either
-        # just return
-        return
-
     def write(self, fname):
         self.outxml.write(fname, encoding="iso-8859-1")
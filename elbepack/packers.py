@@ -4,18 +4,33 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import os
+import copy
 from elbepack.shellhelper import CommandError
 
 
 class Packer(object):
-    # pylint: disable=too-few-public-methods
-    def pack_file(self, _log, _builddir, _fname):
+
+    # number of threads, the packer can make use of
+    # None means: as many as it gets
+    max_threads = 1
+
+    def pack_file(self, _log, _builddir, _fname, _threads=1):
         raise NotImplementedError('abstract method called')
 
+    def with_options(self, level=None, threads=None):
+        """ returns a copy of the packer with the compression level
+            and the number of threads set, packers without these options
+            ignore them.
+        """
+        # pylint: disable=unused-argument
+        return self
+
 
 class NoPacker(Packer):
     # pylint: disable=too-few-public-methods
-    def pack_file(self, _log, _builddir, fname):
+    max_threads = 0
+
+    def pack_file(self, _log, _builddir, fname, _threads=1):
         return fname
 
 
@@ -26,7 +41,7 @@ class InPlacePacker(Packer):
         self.cmd = cmd
         self.suffix = suffix
 
-    def pack_file(self, log, builddir, fname):
+    def pack_file(self, log, builddir, fname, _threads=1):
         try:
             fpath = os.path.join(builddir, fname)
             log.do('%s "%s"' % (self.cmd, fpath))
@@ -45,7 +60,7 @@ class TarArchiver(Packer):
         self.flag = flag
         self.suffix = suffix
 
-    def pack_file(self, log, builddir, fname):
+    def pack_file(self, log, builddir, fname, _threads=1):
         try:
             fpath = os.path.join(builddir, fname)
             dirname = os.path.dirname(fpath)
@@ -69,10 +84,110 @@ class TarArchiver(Packer):
         return fname + self.suffix
 
 
+class Compressor(object):
+
+    """ A compressor command with a compression level, which can use
+        several threads. cmd is formatted with level and threads,
+        inplace are the options to replace a file by the compressed
+        file.
+    """
+
+    def __init__(self, cmd, level, inplace, threads=None):
+        self.cmd = cmd
+        self.level = level
+        self.inplace = inplace
+        self.threads = threads
+
+    def command(self, threads, inplace=False):
+        cmd = self.cmd % {'level': self.level,
+                          'threads': self.threads or threads}
+        if inplace:
+            cmd += " " + self.inplace
+        return cmd
+
+
+class ParallelPacker(Packer):
+
+    """ compresses the file in place with a multi threaded compressor,
+        the compressor removes the original file.
+    """
+
+    max_threads = None
+
+    def __init__(self, compressor, suffix):
+        self.compressor = compressor
+        self.suffix = suffix
+
+    def with_options(self, level=None, threads=None):
+        ret = copy.copy(self)
+        ret.compressor = copy.copy(self.compressor)
+        if level is not None:
+            # the level goes into the command line
+            ret.compressor.level = int(level)
+        if threads is not None:
+            ret.compressor.threads = threads
+            ret.max_threads = threads
+        return ret
+
+    def pack_file(self, log, builddir, fname, threads=1):
+        try:
+            fpath = os.path.join(builddir, fname)
+            log.do('%s "%s"' % (self.compressor.command(threads, True),
+                                fpath))
+        except CommandError:
+            # same as InPlacePacker
+            return None
+
+        return fname + self.suffix
+
+
+class ParallelTarArchiver(ParallelPacker):
+
+    """ creates a sparse tar archive, which is compressed by a multi
+        threaded compressor.
+    """
+
+    def pack_file(self, log, builddir, fname, threads=1):
+        try:
+            fpath = os.path.join(builddir, fname)
+            dirname = os.path.dirname(fpath)
+            basename = os.path.basename(fpath)
+            archname = fpath + self.suffix
+            log.do('tar cv --sparse -I "%s" -f "%s" -C "%s" "%s"' % (
+                   self.compressor.command(threads),
+                   archname,
+                   dirname,
+                   basename))
+            log.do('rm -f "%s"' % fpath)
+        except CommandError:
+            # same as TarArchiver
+            return None
+
+        return fname + self.suffix
+
+
+def pigz():
+    return Compressor('pigz -p%(threads)d -%(level)d', 6, '-f')
+
+
+def xz():
+    return Compressor('xz -T%(threads)d -%(level)d', 6, '-f')
+
+
+def zstd():
+    return Compressor('zstd -q -T%(threads)d -%(level)d', 3, '-f --rm')
+
+
 packers = {'none': NoPacker(),
            'gzip': InPlacePacker('gzip -f', '.gz'),
            'tar':  TarArchiver('', '.tar'),
            'tarxz': TarArchiver('J', '.tar.xz'),
-           'targz': TarArchiver('z', '.tar.gz')}
+           'targz': TarArchiver('z', '.tar.gz'),
+           'pigz': ParallelPacker(pigz(), '.gz'),
+           'xz': ParallelPacker(xz(), '.xz'),
+           'zstd': ParallelPacker(zstd(), '.zst'),
+           'tarpigz': ParallelTarArchiver(pigz(), '.tar.gz'),
+           'tarxzmt': ParallelTarArchiver(xz(), '.tar.xz'),
+           'tarzstd': ParallelTarArchiver(zstd(), '.tar.zst')}
 
 default_packer = packers['targz']
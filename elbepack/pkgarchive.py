@@ -9,6 +9,7 @@ from os import path, remove
 from shutil import rmtree, copytree, move
 from apt.package import FetchError
 from elbepack.repomanager import RepoBase, RepoAttributes
+from elbepack.rpcaptcache import log_mark_failures
 
 
 class ArchiveRepo(RepoBase):
@@ -50,48 +51,38 @@ def gen_binpkg_archive(ep, repodir):
 
         c = ep.get_rpcaptcache()
         pkglist = c.get_installed_pkgs()
+        debs = []
 
+        missing = []
         for pkg in pkglist:
             # Use package from local APT archive, if the file exists
             filename = pkg.installed_deb
             rel_path = path.join('var/cache/apt/archives', filename)
             abs_path = ep.buildenv.rfs.fname(rel_path)
 
-            if not path.isfile(abs_path):
-                # Package file does not exist, download it and adjust path name
+            if path.isfile(abs_path):
+                debs.append(abs_path)
+            else:
+                # Package file does not exist, download it below
                 ep.log.printo(
                     "Package file " +
                     filename +
                     " not found in var/cache/apt/archives, downloading it")
-                abs_path = ep.buildenv.rfs.fname(rel_path)
-                try:
-                    abs_path = c.download_binary(pkg.name,
-                                                 '/var/cache/elbe/pkgarchive',
-                                                 pkg.installed_version)
-                except ValueError:
-                    ep.log.printo("No Package " + pkg.name + "-" +
-                                  pkg.installed_version)
-                    raise
-                except FetchError:
-                    ep.log.printo(
-                        "Package " +
-                        pkg.name +
-                        "-" +
-                        pkg.installed_version +
-                        " could not be downloaded")
-                    raise
-                except TypeError:
-                    ep.log.printo(
-                        "Package " +
-                        pkg.name +
-                        "-" +
-                        pkg.installed_version +
-                        " missing name or version")
-                    raise
-
-            # Add package to repository
-            # XXX Use correct component
-            repo.includedeb(abs_path, "main")
+                missing.append((pkg.name, pkg.installed_version))
+
+        if missing:
+            fetched = c.download_binaries(missing,
+                                          '/var/cache/elbe/pkgarchive')
+            for key in missing:
+                abs_path, err = fetched[key]
+                if abs_path is None:
+                    ep.log.printo(err)
+                    raise FetchError(err)
+                debs.append(abs_path)
+
+        # Add packages to repository
+        # XXX Use correct component
+        repo.includedebs(debs, "main")
 
         repo.finalize()
 
@@ -143,26 +134,48 @@ def checkout_binpkg_archive(ep, repodir):
             c = ep.get_rpcaptcache()
             c.update()
 
-            # Iterate over all packages, and mark them for installation or
-            # deletion, using the same logic as in commands/updated.py
+            # Compute the install, keep and delete sets from the
+            # fullpkgs and the installed packages, using the same logic as
+            # in commands/updated.py. Only the installed packages and the
+            # packages of the fullpkgs list are fetched from the cache.
             ep.log.printo("Calculating packages to install/remove")
-            fpl = ep.xml.node("fullpkgs")
-            pkgs = c.get_pkglist('all')
-
-            for p in pkgs:
-                marked = False
-                for fpi in fpl:
-                    if p.name == fpi.et.text:
-                        version = fpi.et.get('version')
-                        ep.log.printo("Install " + p.name + "-" + version)
-                        c.mark_install(p.name, version,
-                                       from_user=not fpi.et.get('auto'),
-                                       nodeps=True)
-                        marked = True
-
-                if not marked:
-                    ep.log.printo("Delete " + p.name + "-" + version)
-                    c.mark_delete(p.name)
+            fullpkgs = {}
+            for fpi in ep.xml.node("fullpkgs"):
+                fullpkgs[fpi.et.text] = (fpi.et.get('version'),
+                                         fpi.et.get('auto') != 'true')
+
+            installed = c.get_installed_pkgs()
+            known = c.get_pkgs_by_name(list(fullpkgs))
+
+            install = []
+            keep = 0
+            for name in sorted(fullpkgs):
+                version, from_user = fullpkgs[name]
+                if known[name] is None:
+                    ep.log.printo("Package " + name + "-" + version +
+                                  " is not in the package archive")
+                    continue
+                if known[name].installed_version == version:
+                    keep += 1
+                else:
+                    ep.log.printo("Install " + name + "-" + version)
+                # installed packages are marked as well, so that their
+                # auto flag is restored
+                install.append((name, version, from_user))
+
+            delete = sorted(p.name for p in installed
+                            if p.name not in fullpkgs)
+            for name in delete:
+                ep.log.printo("Delete " + name)
+
+            ep.log.printo("%d packages to install, %d to keep, %d to "
+                          "delete" % (len(install) - keep, keep,
+                                      len(delete)))
+
+            failed = c.mark_pkgs(install, delete, nodeps=True)
+            log_mark_failures(ep.log, failed)
+            if failed:
+                raise SystemError("marking %d packages failed" % len(failed))
 
             # Now commit the changes
             ep.log.printo("Commiting package changes")
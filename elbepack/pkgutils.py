@@ -13,6 +13,7 @@ from apt_pkg import TagFile
 from elbepack.shellhelper import CommandError, system
 from elbepack.virtapt import get_virtaptcache
 from elbepack.hashes import validate_sha256, HashValidationFailed
+from elbepack.debpool import debpool
 
 
 class NoPackageException(Exception):
@@ -115,6 +116,9 @@ def download_pkg(prj,
         uri = u[1]
         dest = os.path.join(target_dir, "%s.deb" % u[0])
 
+        if debpool.fetch(sha256, dest):
+            continue
+
         try:
             if uri.startswith("file://"):
                 system('cp "%s" "%s"' % (uri[len("file://"):], dest))
@@ -131,6 +135,7 @@ def download_pkg(prj,
             except HashValidationFailed as e:
                 raise NoPackageException('%s failed to verify: %s' % package,
                                          e.message)
+            debpool.add(dest, sha256)
         else:
             if log:
                 log.printo("WARNING: Using untrusted %s package" % package)
@@ -25,6 +25,7 @@ from elbepack.asyncworker import (AsyncWorker, BuildJob, APTUpdateJob,
                                   BuildSDKJob, BuildCDROMsJob)
 
 from elbepack.elbexml import ValidationMode
+from elbepack.asciidoclog import read_log_tail
 
 
 class ProjectManagerError(Exception):
@@ -188,6 +189,15 @@ class ProjectManager(object):
             pfd = self.db.get_project_file(builddir, filename)
             return OpenProjectFile(pfd, mode)
 
+    def open_project_file(self, userid, builddir, filename, mode='rb'):
+        # Unlike open_current_project_file() the project does not need
+        # to be opened, so a download does not change the current
+        # project of the user.
+        self._check_project_permission(userid, builddir)
+
+        pfd = self.db.get_project_file(builddir, filename)
+        return OpenProjectFile(pfd, mode)
+
     def set_current_project_private_data(self, userid, private_data):
         with self.lock:
             ep = self._get_current_project(userid)
@@ -541,6 +551,21 @@ class ProjectManager(object):
             logline = unicode(part) + u'###' + logline
             return self.db.is_busy(ep.builddir), logline
 
+    def current_project_log_tail(self, userid, offset, maxsize=64 * 1024):
+        """ returns the busy state, the offset to continue from and the
+            log data written since offset. At most maxsize bytes are
+            returned, cut at the last complete line if possible.
+        """
+        with self.lock:
+            ep = self._get_current_project(userid)
+            busy = self.db.is_busy(ep.builddir)
+
+        # read the busy state before the log, so that the log is complete,
+        # when the project is no longer busy
+        offset, data = read_log_tail(os.path.join(ep.builddir, 'log.txt'),
+                                     offset, busy, maxsize)
+        return busy, offset, data
+
     def _get_current_project(self, userid, allow_busy=True):
         # Must be called with self.lock held
         if userid not in self.userid2project:
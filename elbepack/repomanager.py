@@ -53,6 +53,9 @@ class RepoBase(object):
 
     # pylint: disable=too-many-instance-attributes
 
+    # maximum number of files handed to a single reprepro call
+    max_batch = 256
+
     def __init__(
             self,
             path,
@@ -82,6 +85,13 @@ class RepoBase(object):
         self.origin = origin
         self.description = description
         self.maxsize = maxsize
+        self.reprepro_calls = 0
+        self.reprepro_saved = 0
+
+        # Bytes used by the current volume. The volume is scanned once
+        # when it is opened, afterwards the sizes of the included files
+        # are added up.
+        self.vol_usage = None
         self.fs = self.get_volume_fs(self.volume_count)
 
         # if repo exists retrive the keyid otherwise
@@ -108,6 +118,18 @@ class RepoBase(object):
         self.volume_count += 1
         self.fs = self.get_volume_fs(self.volume_count)
         self.gen_repo_conf()
+        self.vol_usage = None
+
+    def volume_usage(self):
+        if self.vol_usage is None:
+            if self.fs.isdir("/"):
+                self.vol_usage = self.fs.disk_usage("")
+            else:
+                self.vol_usage = 0
+        return self.vol_usage
+
+    def _fits_volume(self, size):
+        return self.volume_usage() + size <= self.maxsize
 
     def gen_repo_conf(self):
         self.fs.mkdir_p("conf")
@@ -188,10 +210,11 @@ class RepoBase(object):
                 env_add={'GNUPGHOME': '/var/cache/elbe/gnupg'})
 
     def _includedeb(self, path, codename, component):
-        if self.maxsize:
-            new_size = self.fs.disk_usage("") + os.path.getsize(path)
-            if new_size > self.maxsize:
-                self.new_repo_volume()
+        self.reprepro_calls += 1
+
+        size = os.path.getsize(path)
+        if self.maxsize and not self._fits_volume(size):
+            self.new_repo_volume()
 
         self.log.do(
             'reprepro --keepunreferencedfiles --export=never --basedir "' +
@@ -203,6 +226,77 @@ class RepoBase(object):
             ' ' +
             path)
 
+        if self.maxsize:
+            self.vol_usage += size
+
+    def _includedebs(self, paths, component, force):
+        """ includes all debs in paths with as few reprepro calls as
+            possible. A new batch is started, when the volume would
+            exceed maxsize.
+        """
+        batch = []
+        batch_size = 0
+
+        for path in paths:
+            size = os.path.getsize(path)
+
+            if self.maxsize and not self._fits_volume(batch_size + size):
+                self._includedeb_batch(batch, component, force, batch_size)
+                self.new_repo_volume()
+                batch = []
+                batch_size = 0
+            elif len(batch) >= self.max_batch:
+                self._includedeb_batch(batch, component, force, batch_size)
+                batch = []
+                batch_size = 0
+
+            batch.append(path)
+            batch_size += size
+
+        self._includedeb_batch(batch, component, force, batch_size)
+
+    def _includedeb_batch(self, batch, component, force, batch_size):
+        if not batch:
+            return
+
+        self.reprepro_calls += 1
+
+        try:
+            self.log.do(
+                'reprepro --keepunreferencedfiles --export=never --basedir "' +
+                self.fs.path +
+                '" -C ' +
+                component +
+                ' includedeb ' +
+                self.repo_attr.codename +
+                ' ' +
+                " ".join('"%s"' % p for p in batch))
+        except CommandError:
+            # reprepro might have included a part of the batch already.
+            # Include the debs one by one in the same volume, before the
+            # next volume is started, so that force can replace packages
+            # that already exist with a different md5.
+            for path in batch:
+                pkgname = os.path.basename(path).split('_')[0]
+                self.includedeb(path, component, pkgname, force)
+            return
+
+        self.reprepro_saved += len(batch) - 1
+        if self.maxsize:
+            self.vol_usage += batch_size
+
+    def includedebs(self, paths, component="main", force=False):
+        """ includes a list of debs. If reprepro fails on a batch, the
+            debs of that batch are included one by one.
+        """
+        calls = self.reprepro_calls
+        self._includedebs(paths, component, force)
+
+        self.log.printo("included %d debs with %d reprepro calls, "
+                        "%d reprepro calls saved so far" % (
+                            len(paths), self.reprepro_calls - calls,
+                            self.reprepro_saved))
+
     def includedeb(self, path, component="main", pkgname=None, force=False):
         # pkgname needs only to be specified if force is enabled
         try:
@@ -261,12 +355,8 @@ class RepoBase(object):
 
 
     def _includedsc(self, path, codename, component):
-        if self.maxsize:
-            new_size = self.fs.disk_usage("") + get_dsc_size(path)
-            if new_size > self.maxsize:
-                self.new_repo_volume()
-
-        if self.maxsize and (self.fs.disk_usage("") > self.maxsize):
+        size = get_dsc_size(path)
+        if self.maxsize and not self._fits_volume(size):
             self.new_repo_volume()
 
         self.log.do(
@@ -279,6 +369,9 @@ class RepoBase(object):
             ' ' +
             path)
 
+        if self.maxsize:
+            self.vol_usage += size
+
     def includedsc(self, path, component="main", force=False):
         try:
             self._includedsc(path, self.repo_attr.codename, component)
@@ -8,13 +8,23 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import os
+import hashlib
 import urlparse
 import urllib2
 
-from elbepack.efilesystem import BuildImgFs
+from glob import glob
+
+from elbepack.efilesystem import BuildImgFs, RefCountedContext
 from elbepack.templates import (write_pack_template, get_preseed,
                                 preseed_to_text)
 from elbepack.shellhelper import CommandError
+from elbepack.cachedir import CacheDir, cache_key, copy_tree
+from elbepack.config import cfg
+from elbepack.version import elbe_version
+
+
+# the keyrings of the host, debootstrap verifies the mirror with
+debootstrap_keyrings = "/usr/share/keyrings/*-archive-keyring.gpg"
 
 
 class DebootstrapException (Exception):
@@ -22,11 +32,58 @@ class DebootstrapException (Exception):
         Exception.__init__(self, "Debootstrap Failed")
 
 
-class BuildEnv (object):
+def get_raw_keys(xml):
+    """ returns the raw keys of the additional mirrors """
+    ret = []
+    if xml.has('project/mirror/url-list'):
+        for url in xml.node('project/mirror/url-list'):
+            if url.has('raw-key'):
+                ret.append("\n".join(line.strip(" \t") for line in
+                                      url.text('raw-key').splitlines()[1:-1]))
+    return ret
+
+
+def key_digest(xml):
+    """ returns the sha256 of the key material, the mirrors of xml are
+        verified with: the archive keyrings of the host and the raw keys
+        of the additional mirrors.
+    """
+    m = hashlib.sha256()
+    for fname in sorted(glob(debootstrap_keyrings)):
+        with open(fname, 'rb') as f:
+            m.update(f.read())
+    for key in get_raw_keys(xml):
+        m.update(key.encode('utf-8') + b'\0')
+    return m.hexdigest()
+
+
+def debootstrap_cmd(xml):
+    """ returns the debootstrap command with the variant and the
+        packages to include of xml.
+    """
+    includepkgs = None
+    strapcmd  = 'debootstrap '
+    if xml.has("target/debootstrapvariant"):
+        bootstrapvariant = xml.text("target/debootstrapvariant")
+        includepkgs = xml.node("target/debootstrapvariant").et.get("includepkgs")
+        strapcmd += '--variant="%s" ' % bootstrapvariant
+
+    if includepkgs and not "gnupg2" in includepkgs.split(','):
+        includepkgs += ",gnupg2"
+    if not includepkgs:
+        includepkgs = "gnupg2"
+
+    strapcmd += ' --include="%s"' % includepkgs
+    return strapcmd
+
+
+class BuildEnv (RefCountedContext):
     def __init__(self, xml, log, path, build_sources=False, clean=False, arch="default"):
 
         # pylint: disable=too-many-arguments
 
+        RefCountedContext.__init__(self)
+
         self.xml = xml
         self.log = log
         self.path = path
@@ -35,6 +92,10 @@ class BuildEnv (object):
 
         self.rfs = BuildImgFs(path, xml.defs["userinterpr"])
 
+        # the repo of the project is bind mounted, a left over mount
+        # must not be removed together with the buildenv
+        self.repo_umount()
+
         if clean:
             self.rfs.rmtree("")
 
@@ -64,6 +125,7 @@ class BuildEnv (object):
                         self.path)
             self.log.do("rm -f %s/etc/apt/trusted.gpg.d/elbe-cdtargetrepo.gpg" %
                         self.path)
+            self._count(3, 1)
 
     def cdrom_mount(self):
         if self.xml.has("project/mirror/cdrom"):
@@ -71,16 +133,38 @@ class BuildEnv (object):
             self.log.do('mkdir -p "%s"' % cdrompath)
             self.log.do('mount -o loop "%s" "%s"'
                         % (self.xml.text("project/mirror/cdrom"), cdrompath))
+            self._count(2, 1)
+
+    def repo_mount(self):
+        # the repo is bind mounted, so it stays in place for everything
+        # else, that uses it while the buildenv is active
+        repo = os.path.join(self.path, 'repo')
+        self.log.do('mkdir -p "%s"' % repo)
+        self.log.do('mount --bind "%s" "%s"' % (
+            os.path.join(self.path, '../repo'), repo))
+        self.log.do('echo "deb copy:///repo %s main" > '
+                    '%s/etc/apt/sources.list.d/local.list' % (
+                        self.xml.text("project/suite"), self.path))
+        self.log.do('echo "deb-src copy:///repo %s main" >> '
+                    '%s/etc/apt/sources.list.d/local.list' % (
+                        self.xml.text("project/suite"), self.path))
+        self._count(4, 1)
+
+    def repo_umount(self):
+        repo = os.path.join(self.path, 'repo')
+        if not os.path.ismount(repo):
+            return
 
-    def __enter__(self):
+        self.log.do('umount "%s"' % repo)
+        self.log.do('rmdir "%s"' % repo)
+        self.log.do("rm -f %s/etc/apt/sources.list.d/local.list" % self.path)
+        self.log.do("rm -f %s/etc/apt/trusted.gpg.d/elbe-localrepo.gpg" %
+                    self.path)
+        self._count(4, 1)
+
+    def _setup(self):
         if os.path.exists(self.path + '/../repo/pool'):
-            self.log.do("mv %s/../repo %s" % (self.path, self.path))
-            self.log.do('echo "deb copy:///repo %s main" > '
-                        '%s/etc/apt/sources.list.d/local.list' % (
-                            self.xml.text("project/suite"), self.path))
-            self.log.do('echo "deb-src copy:///repo %s main" >> '
-                        '%s/etc/apt/sources.list.d/local.list' % (
-                            self.xml.text("project/suite"), self.path))
+            self.repo_mount()
 
         self.cdrom_mount()
         self.rfs.__enter__()
@@ -94,44 +178,33 @@ class BuildEnv (object):
                             'apt-key '
                             '--keyring /etc/apt/trusted.gpg.d/elbe-cdtargetrepo.gpg '
                             'add /cdrom/targetrepo/repo.pub')
+            self._count(2)
 
         if os.path.exists(os.path.join(self.rfs.path, 'repo/pool')):
             self.log.chroot(self.rfs.path,
                             'apt-key '
                             '--keyring /etc/apt/trusted.gpg.d/elbe-localrepo.gpg '
                             'add /repo/repo.pub')
-        return self
+            self._count(1)
 
-    def __exit__(self, typ, value, traceback):
+    def _teardown(self, typ, value, traceback):
         self.rfs.__exit__(typ, value, traceback)
         self.cdrom_umount()
-        if os.path.exists(self.path + '/repo'):
-            self.log.do("mv %s/repo %s/../" % (self.path, self.path))
-            self.log.do("rm %s/etc/apt/sources.list.d/local.list" % self.path)
-            self.log.do("rm %s/etc/apt/trusted.gpg.d/elbe-localrepo.gpg" %
-                        self.path)
+        self.repo_umount()
 
     def debootstrap(self, arch="default"):
 
         # pylint: disable=too-many-statements
         # pylint: disable=too-many-branches
 
-        cleanup = False
         suite = self.xml.prj.text("suite")
 
         primary_mirror = self.xml.get_primary_mirror(
             self.rfs.fname('/cdrom/targetrepo'))
 
-        if self.xml.prj.has("mirror/primary_proxy"):
-            os.environ["no_proxy"] = "10.0.2.2,localhost,127.0.0.1"
-            proxy = self.xml.prj.text("mirror/primary_proxy")
-            proxy = proxy.strip().replace("LOCALMACHINE", "localhost")
-            os.environ["http_proxy"] = proxy
-            os.environ["https_proxy"] = proxy
-        else:
-            os.environ["no_proxy"] = ""
-            os.environ["http_proxy"] = ""
-            os.environ["https_proxy"] = ""
+        # the proxy is passed to the commands, os.environ is shared by
+        # all projects of the daemon
+        env_add = self.xml.get_proxy_env("localhost")
 
         os.environ["LANG"] = "C"
         os.environ["LANGUAGE"] = "C"
@@ -147,19 +220,49 @@ class BuildEnv (object):
         host_arch = self.log.get_command_out(
             "dpkg --print-architecture").strip()
 
-        includepkgs = None
-        strapcmd  = 'debootstrap '
-        if self.xml.has("target/debootstrapvariant"):
-            bootstrapvariant = self.xml.text("target/debootstrapvariant")
-            includepkgs = self.xml.node("target/debootstrapvariant").et.get("includepkgs")
-            strapcmd += '--variant="%s" ' % bootstrapvariant
+        strapcmd = debootstrap_cmd(self.xml)
+
+        # a debootstrap from a cdrom is not cached, the cdrom path does
+        # not identify its content.
+        cache = None
+        if not self.xml.has("project/mirror/cdrom"):
+            cache = CacheDir("debootstrap", cfg['debootstrap_cache_size'])
+            key = cache_key(suite, arch, host_arch, primary_mirror,
+                            self.xml.has("project/noauth"), strapcmd,
+                            self.xml.defs["userinterpr"], key_digest(self.xml),
+                            elbe_version)
 
-        if includepkgs and not "gnupg2" in includepkgs.split(','):
-            includepkgs += ",gnupg2"
-        if not includepkgs:
-            includepkgs = "gnupg2"
+            if self.restore_debootstrap_cache(cache, key):
+                return
 
-        strapcmd += ' --include="%s"' % includepkgs
+        self.do_debootstrap(strapcmd, arch, suite, host_arch, primary_mirror,
+                            env_add)
+
+        if cache is not None and cache.enabled:
+            self.log.printo("debootstrap cache: storing %s" % key)
+            cache.store(key, lambda path: copy_tree(self.rfs.path, path))
+
+    def restore_debootstrap_cache(self, cache, key):
+        if not cache.enabled:
+            return False
+
+        with cache.lock():
+            entry = cache.lookup(key)
+            if entry is None:
+                self.log.printo("debootstrap cache miss: %s" % key)
+                return False
+
+            self.log.printo("debootstrap cache hit: %s" % key)
+            self.log.do('cp -a --reflink=auto "%s"/. "%s"' % (entry,
+                                                                self.rfs.path))
+        return True
+
+    def do_debootstrap(self, strapcmd, arch, suite, host_arch,
+                       primary_mirror, env_add):
+
+        # pylint: disable=too-many-arguments
+
+        cleanup = False
 
         if not self.xml.is_cross(host_arch):
             # ignore gpg verification if install from cdrom, cause debootstrap
@@ -175,7 +278,7 @@ class BuildEnv (object):
 
             try:
                 self.cdrom_mount()
-                self.log.do(cmd)
+                self.log.do(cmd, env_add=env_add)
             except CommandError:
                 cleanup = True
                 raise DebootstrapException()
@@ -200,7 +303,7 @@ class BuildEnv (object):
 
         try:
             self.cdrom_mount()
-            self.log.do(cmd)
+            self.log.do(cmd, env_add=env_add)
 
             ui = "/usr/share/elbe/qemu-elbe/" + self.xml.defs["userinterpr"]
 
@@ -212,12 +315,15 @@ class BuildEnv (object):
             if self.xml.has("project/noauth"):
                 self.log.chroot(
                     self.rfs.path,
-                    '/debootstrap/debootstrap --no-check-gpg --second-stage')
+                    '/debootstrap/debootstrap --no-check-gpg --second-stage',
+                    env_add=env_add)
             else:
                 self.log.chroot(self.rfs.path,
-                                '/debootstrap/debootstrap --second-stage')
+                                '/debootstrap/debootstrap --second-stage',
+                                env_add=env_add)
 
-            self.log.chroot(self.rfs.path, 'dpkg --configure -a')
+            self.log.chroot(self.rfs.path, 'dpkg --configure -a',
+                            env_add=env_add)
 
         except CommandError:
             cleanup = True
@@ -251,10 +357,8 @@ class BuildEnv (object):
             # https://github.com/Linutronix/elbe/issues/220
             #
             # I could make a none global 'noauth' flag for mirrors
-            for url in self.xml.node('project/mirror/url-list'):
-                if url.has('raw-key'):
-                    key = "\n".join(line.strip(" \t") for line in url.text('raw-key').splitlines()[1:-1])
-                    self.add_key(key)
+            for key in get_raw_keys(self.xml):
+                self.add_key(key)
 
     def initialize_dirs(self, build_sources=False):
         mirror = self.xml.create_apt_sources_list(build_sources=build_sources)
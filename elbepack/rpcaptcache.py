@@ -9,17 +9,104 @@
 import os
 import sys
 import time
+import hashlib
 import warnings
 
 from multiprocessing.util import Finalize
-from multiprocessing.managers import BaseManager
+from multiprocessing.managers import (BaseManager, MakeProxyType,
+                                      public_methods)
 
-from apt_pkg import config, version_compare
+from apt_pkg import (config, version_compare, SourceRecords, Acquire,
+                     AcquireFile)
 from apt import Cache
 
 from elbepack.aptprogress import (ElbeAcquireProgress, ElbeInstallProgress,
                                   ElbeOpProgress)
 from elbepack.aptpkgutils import getalldeps, APTPackage
+from elbepack.debpool import debpool
+
+
+def _file_is_same(path, size, md5):
+    if not os.path.isfile(path) or os.path.getsize(path) != size:
+        return False
+    m = hashlib.md5()
+    with open(path, "rb") as f:
+        buf = f.read(65536)
+        while buf:
+            m.update(buf)
+            buf = f.read(65536)
+    return m.hexdigest() == md5
+
+
+def fetch_binaries(cache, pkgs, path):
+    """ downloads the .debs of the given (name, version) pairs of an
+        apt Cache into path. version None selects the installed
+        version. All files are queued into a single Acquire run, so apt
+        fetches them concurrently instead of one after another.
+
+        Returns a dict mapping each pair to a (filename, error) tuple.
+        filename is None, if the package could not be downloaded.
+    """
+    result = {}
+    pending = []
+    queued = {}
+    acq = Acquire(ElbeAcquireProgress())
+
+    for name, version in pkgs:
+        try:
+            p = cache[name]
+            if version is None:
+                pkgver = p.installed
+            else:
+                pkgver = p.versions[version]
+        except KeyError:
+            result[(name, version)] = (None, "No Package %s-%s" %
+                                       (name, version))
+            continue
+
+        if pkgver is None:
+            result[(name, version)] = (None, "Package %s is not installed" %
+                                       name)
+            continue
+
+        base = os.path.basename(pkgver.filename)
+        destfile = os.path.join(path, base)
+
+        # avoid DeprecationWarning:
+        # "MD5Hash is deprecated, use Hashes instead"
+        # triggerd by python-apt
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", category=DeprecationWarning)
+            md5 = pkgver.md5
+
+        if destfile in queued or _file_is_same(destfile, pkgver.size, md5):
+            pending.append(((name, version), destfile, queued.get(destfile)))
+            continue
+
+        uri = pkgver.uri
+        if not uri:
+            result[(name, version)] = (None, "Package %s-%s has no uri" %
+                                       (name, pkgver.version))
+            continue
+
+        item = AcquireFile(acq, uri, md5, pkgver.size, base,
+                           destfile=destfile)
+        queued[destfile] = item
+        pending.append(((name, version), destfile, item))
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", category=DeprecationWarning)
+        acq.run()
+
+    for key, destfile, item in pending:
+        if item is not None and item.status != item.STAT_DONE:
+            result[key] = (None, "Package %s-%s could not be downloaded: %s" %
+                           (key[0], key[1], item.error_text))
+        else:
+            result[key] = (destfile, None)
+
+    return result
+
 
 class InChRootObject(object):
     def __init__(self, rfs):
@@ -106,6 +193,49 @@ class RPCAPTCache(InChRootObject):
                        auto_inst=not nodeps,
                        from_user=from_user)
 
+    def mark_install_many(self, pkgs, from_user=True, nodeps=False):
+        """ pkgs is a list of package names or (name, version) tuples.
+
+            Marks all packages with a single call through the manager
+            and returns a list of (name, error) tuples for the packages
+            that could not be marked. error is None for packages that
+            do not exist, the message of the SystemError otherwise.
+        """
+        failed = []
+        for p in pkgs:
+            if isinstance(p, (list, tuple)):
+                name, version = p
+            else:
+                name, version = p, None
+            self._try_mark(failed, self.mark_install, name, version,
+                           from_user, nodeps)
+        return failed
+
+    def mark_pkgs(self, install, delete, nodeps=False):
+        """ install is a list of (name, version, from_user) tuples,
+            delete a list of package names. All marks are applied with
+            a single call through the manager. Returns the failed
+            packages like mark_install_many().
+        """
+        failed = []
+        for name, version, from_user in install:
+            self._try_mark(failed, self.mark_install, name, version,
+                           from_user, nodeps)
+
+        for name in delete:
+            self._try_mark(failed, self.mark_delete, name)
+
+        return failed
+
+    @staticmethod
+    def _try_mark(failed, mark, name, *args):
+        try:
+            mark(name, *args)
+        except KeyError:
+            failed.append((name, None))
+        except SystemError as e:
+            failed.append((name, str(e)))
+
     def mark_install_devpkgs(self, ignore_pkgs, ignore_dev_pkgs):
         ignore_pkgs.discard('libc6')  # we don't want to ignore libc
         ignore_pkgs.discard('libstdc++5')
@@ -188,16 +318,6 @@ class RPCAPTCache(InChRootObject):
                     p.section == section and p.is_installed)]
             return pl
 
-    def get_fileindex(self):
-        index = {}
-
-        for p in self.cache:
-            if p.is_installed:
-                for f in p.installed_files:
-                    index[f] = p.name
-
-        return index
-
     def get_marked_install(self, section='all'):
         if section == 'all':
             ret = [APTPackage(p) for p in self.cache if p.marked_install]
@@ -232,6 +352,64 @@ class RPCAPTCache(InChRootObject):
     def get_pkg(self, pkgname):
         return APTPackage(self.cache[pkgname])
 
+    def get_pkgs_by_name(self, pkgnames):
+        """ returns a dict mapping each name to its APTPackage, or to
+            None if the package does not exist.
+        """
+        ret = {}
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", category=DeprecationWarning)
+            for name in pkgnames:
+                if name in self.cache:
+                    ret[name] = APTPackage(self.cache[name])
+                else:
+                    ret[name] = None
+        return ret
+
+    def check_pkglist(self, pkgs, full=False):
+        """ validates a package list against the installed packages.
+
+            pkgs is a list of (name, version, md5) tuples, version and
+            md5 may be None to skip that check. If full is set, packages
+            that are installed but not listed are reported too.
+
+            Returns a list of (problem, name, expected, found) tuples,
+            with problem being one of 'missing', 'not_installed',
+            'version', 'md5' and 'additional'.
+        """
+        errors = []
+        names = set()
+
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+            for name, version, md5 in pkgs:
+                names.add(name)
+
+                if name not in self.cache:
+                    errors.append(('missing', name, None, None))
+                    continue
+
+                p = self.cache[name]
+                if not p.is_installed:
+                    errors.append(('not_installed', name, None, None))
+                    continue
+
+                if (version or full) and p.installed.version != version:
+                    errors.append(('version', name, version,
+                                   p.installed.version))
+                    continue
+
+                if full and p.installed.md5 != md5:
+                    errors.append(('md5', name, md5, p.installed.md5))
+
+            if full:
+                for p in self.cache:
+                    if p.is_installed and p.name not in names:
+                        errors.append(('additional', p.name, None, None))
+
+        return errors
+
     def get_pkgs(self, pkgname):
         return [
             APTPackage(
@@ -241,12 +419,22 @@ class RPCAPTCache(InChRootObject):
     def compare_versions(self, ver1, ver2):
         return version_compare(ver1, ver2)
 
-    def download_binary(self, pkgname, path, version=None):
+    def _get_binary_version(self, pkgname, version):
         p = self.cache[pkgname]
         if version is None:
-            pkgver = p.installed
-        else:
-            pkgver = p.versions[version]
+            return p.installed
+        return p.versions[version]
+
+    def get_binary_info(self, pkgname, path, version=None):
+        """ returns the sha256 of the .deb and the host path
+            download_binary() would place it at.
+        """
+        pkgver = self._get_binary_version(pkgname, version)
+        fname = os.path.join(path, os.path.basename(pkgver.filename))
+        return pkgver.sha256, self.rfs.fname(fname)
+
+    def download_binary(self, pkgname, path, version=None):
+        pkgver = self._get_binary_version(pkgname, version)
         # avoid DeprecationWarning:
         # "MD5Hash is deprecated, use Hashes instead"
         # triggerd by python-apt
@@ -257,6 +445,32 @@ class RPCAPTCache(InChRootObject):
                                                ElbeAcquireProgress())
             return self.rfs.fname(rel_filename)
 
+    def get_binary_infos(self, pkgs, path):
+        """ get_binary_info() for a list of (name, version) pairs.
+            Unknown packages map to (None, None).
+        """
+        ret = {}
+        for name, version in pkgs:
+            try:
+                ret[(name, version)] = self.get_binary_info(name, path,
+                                                            version)
+            except (KeyError, AttributeError):
+                ret[(name, version)] = (None, None)
+        return ret
+
+    def download_binaries(self, pkgs, path):
+        """ downloads the .debs of the (name, version) pairs with a
+            single Acquire run. Returns a dict mapping each pair to a
+            (host path, error) tuple, see fetch_binaries().
+        """
+        ret = {}
+        for key, (fname, err) in fetch_binaries(self.cache, pkgs,
+                                                path).items():
+            if fname is not None:
+                fname = self.rfs.fname(fname)
+            ret[key] = (fname, err)
+        return ret
+
     def download_source(self, pkgname, path, version=None):
         p = self.cache[pkgname]
         if version is None:
@@ -275,12 +489,150 @@ class RPCAPTCache(InChRootObject):
                                                unpack=False)
             return self.rfs.fname(rel_filename)
 
+    def get_installed_srcpkgs(self, exclude=None):
+        """ maps the installed binary packages, except the ones listed in
+            exclude, to their source packages. Returns a sorted list of
+            ((source name, source version), [binary names]) tuples.
+        """
+        srcpkgs = {}
+        for p in self.cache:
+            if not p.is_installed:
+                continue
+            if exclude and p.name in exclude:
+                continue
+            key = (p.installed.source_name, p.installed.source_version)
+            srcpkgs.setdefault(key, []).append(p.name)
+
+        return sorted(srcpkgs.items())
+
+    def download_sources(self, srcpkgs, path, chunksize=64):
+        """ downloads the given (source name, source version) pairs.
+
+            The files of up to chunksize source packages are queued into
+            one Acquire run, so apt fetches them concurrently instead of
+            one package after another.
+
+            Returns a dict mapping each pair to a (dsc, error) tuple.
+            dsc is None, if the download failed. error is None too,
+            if no source for the pair is known.
+        """
+        result = {}
+        src = SourceRecords()
+
+        for i in range(0, len(srcpkgs), chunksize):
+            acq = Acquire(ElbeAcquireProgress())
+            pending = []
+            queued = set()
+
+            for name, version in srcpkgs[i:i + chunksize]:
+                src.restart()
+                found = src.lookup(name)
+                while found and src.version != version:
+                    found = src.lookup(name)
+
+                if not found:
+                    result[(name, version)] = (None, None)
+                    continue
+
+                dsc = None
+                items = []
+                for md5, size, fpath, typ in src.files:
+                    base = os.path.basename(fpath)
+                    destfile = os.path.join(path, base)
+                    if typ == 'dsc':
+                        dsc = destfile
+                    if destfile in queued or \
+                       _file_is_same(destfile, size, md5):
+                        continue
+                    queued.add(destfile)
+                    items.append(AcquireFile(acq,
+                                             src.index.archive_uri(fpath),
+                                             md5, size, base,
+                                             destfile=destfile))
+
+                pending.append(((name, version), dsc, items))
+
+            # avoid DeprecationWarning:
+            # "MD5Hash is deprecated, use Hashes instead"
+            # triggerd by python-apt
+            with warnings.catch_warnings():
+                warnings.filterwarnings("ignore",
+                                        category=DeprecationWarning)
+                acq.run()
+
+            for key, dsc, items in pending:
+                failed = [it for it in items if it.status != it.STAT_DONE]
+                if failed:
+                    result[key] = (None, "%s could not be fetched: %s" % (
+                        failed[0].destfile, failed[0].error_text))
+                else:
+                    result[key] = (self.rfs.fname(dsc), None)
+
+        return result
+
 
 class MyMan(BaseManager):
     pass
 
 
-MyMan.register("RPCAPTCache", RPCAPTCache)
+_RPCAPTCacheProxyBase = MakeProxyType("_RPCAPTCacheProxyBase",
+                                      public_methods(RPCAPTCache))
+
+
+class RPCAPTCacheProxy(_RPCAPTCacheProxyBase):
+
+    # runs in the client process: the cache itself is chrooted and
+    # can not reach the shared debpool below /var/cache/elbe.
+
+    def download_binary(self, pkgname, path, version=None):
+        sha256, dest = self._callmethod('get_binary_info',
+                                        (pkgname, path, version))
+        if debpool.fetch(sha256, dest):
+            return dest
+
+        dest = self._callmethod('download_binary', (pkgname, path, version))
+        debpool.add(dest, sha256)
+        return dest
+
+    def download_binaries(self, pkgs, path):
+        pkgs = [tuple(p) for p in pkgs]
+        infos = self._callmethod('get_binary_infos', (pkgs, path))
+
+        ret = {}
+        missing = []
+        for key in pkgs:
+            sha256, dest = infos[key]
+            if dest is not None and debpool.fetch(sha256, dest):
+                ret[key] = (dest, None)
+            else:
+                missing.append(key)
+
+        if missing:
+            fetched = self._callmethod('download_binaries', (missing, path))
+            for key, (dest, err) in fetched.items():
+                if dest is not None:
+                    debpool.add(dest, infos[key][0])
+                ret[key] = (dest, err)
+
+        return ret
+
+
+MyMan.register("RPCAPTCache", RPCAPTCache, proxytype=RPCAPTCacheProxy)
+
+
+def log_mark_failures(log, failed):
+    """ logs the packages, mark_install_many() or mark_pkgs() failed on """
+    for name, err in failed:
+        if err is None:
+            log.printo("No Package " + name)
+        else:
+            log.printo("Error: Unable to correct problems in package %s (%s)"
+                       % (name, err))
+
+
+def _update_environ(env_add):
+    if env_add:
+        os.environ.update(env_add)
 
 
 def get_rpcaptcache(
@@ -289,12 +641,15 @@ def get_rpcaptcache(
         arch,
         notifier=None,
         norecommend=False,
-        noauth=True):
+        noauth=True,
+        env_add=None):
 
     # pylint: disable=too-many-arguments
 
+    # env_add, e.g. the proxy of the project, is only set in the
+    # environment of the cache process
     mm = MyMan()
-    mm.start()
+    mm.start(_update_environ, (env_add,))
 
     # Disable false positive, because pylint can not
     # see the creation of MyMan.RPCAPTCache by
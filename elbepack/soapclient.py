@@ -16,13 +16,15 @@ import os
 import fnmatch
 
 from datetime import datetime
-from urllib2 import URLError
+from urllib import urlencode
+from urllib2 import URLError, HTTPError, Request, build_opener
+from urllib2 import HTTPCookieProcessor
 from httplib import BadStatusLine
 
 import deb822   # package for dealing with Debian related data
 
 from suds.client import Client
-from suds import WebFault
+from suds import WebFault, MethodNotFound
 
 from elbepack.filesystem import Filesystem
 from elbepack.elbexml import ElbeXML, ValidationMode
@@ -55,6 +57,8 @@ class ElbeSoapClient(object):
 
         # Attributes
         self.wsdl = "http://" + host + ":" + str(port) + "/soap/?wsdl"
+        self.download_url = "http://" + host + ":" + str(port) + \
+            "/soap/download"
         self.control = None
         self.retries = 0
 
@@ -84,6 +88,100 @@ class ElbeSoapClient(object):
         self.service.login(user, passwd)
 
     def download_file(self, builddir, filename, dst_fname):
+        try:
+            self.http_download_file(builddir, filename, dst_fname)
+        except HTTPError as e:
+            if e.code not in (404, 405):
+                print("%s: %s" % (filename, e), file=sys.stderr)
+                sys.exit(20)
+            # older daemons do not have the download route, a missing
+            # file is reported by get_file as well
+            self.soap_download_file(builddir, filename, dst_fname)
+
+    @staticmethod
+    def _download_size(resp):
+        """ returns the size of the complete file, the response is a
+            part of, or None, if the server does not tell it.
+        """
+        if resp.getcode() == 206:
+            # Content-Range: bytes <start>-<end>/<size>
+            crange = resp.info().getheader('Content-Range', '')
+            try:
+                return int(crange.rsplit('/', 1)[1])
+            except (IndexError, ValueError):
+                return None
+
+        length = resp.info().getheader('Content-Length')
+        if length is None:
+            return None
+        return int(length)
+
+    def http_download_file(self, builddir, filename, dst_fname):
+        try:
+            self._http_download_file(builddir, filename, dst_fname)
+        except HTTPError:
+            # do not leave an empty or partial file behind
+            os.remove(dst_fname)
+            raise
+
+    def _http_download_file(self, builddir, filename, dst_fname):
+        # the session cookie of the soap login authenticates the download
+        cookies = self.control.options.transport.cookiejar
+        opener = build_opener(HTTPCookieProcessor(cookies))
+        url = self.download_url + "?" + urlencode({'builddir': builddir,
+                                                   'name': filename})
+        retry = 5
+
+        with open(dst_fname, "wb") as fp:
+            while True:
+                req = Request(url)
+                pos = fp.tell()
+                if pos:
+                    # continue an interrupted transfer
+                    req.add_header('Range', 'bytes=%d-' % pos)
+                try:
+                    try:
+                        resp = opener.open(req)
+                    except HTTPError as e:
+                        if not pos or e.code != 416:
+                            raise
+                        # Content-Range: bytes */<size>
+                        crange = e.info().getheader('Content-Range', '')
+                        if crange.endswith('/%d' % pos):
+                            # the file was complete already
+                            return
+                        # the file has changed, start over
+                        fp.seek(0)
+                        fp.truncate()
+                        continue
+
+                    if pos and resp.getcode() != 206:
+                        fp.seek(0)
+                        fp.truncate()
+                    size = self._download_size(resp)
+
+                    while True:
+                        data = resp.read(1024 * 1024)
+                        if not data:
+                            break
+                        fp.write(data)
+
+                    # httplib does not complain about a short body, a
+                    # dropped connection looks like the end of the file
+                    if size is None or fp.tell() == size:
+                        return
+                    raise URLError("got %d of %d bytes" % (fp.tell(), size))
+                except HTTPError:
+                    raise
+                except (URLError, socket.error, BadStatusLine) as e:
+                    retry = retry - 1
+                    print("download of %s failed (%s), retry %d times" %
+                          (filename, e, retry), file=sys.stderr)
+                    if not retry:
+                        print("file transfer failed", file=sys.stderr)
+                        sys.exit(20)
+
+    def soap_download_file(self, builddir, filename, dst_fname):
         fp = file(dst_fname, "w")
         part = 0
 
@@ -583,6 +681,40 @@ class WaitProjectBusyAction(ClientAction):
             sys.exit(20)
 
         builddir = args[0]
+
+        try:
+            # pylint: disable=pointless-statement
+            client.service.get_project_log_tail
+        except MethodNotFound:
+            # initvm runs an elbe without get_project_log_tail
+            self.wait_busy_lines(client, builddir)
+            return
+
+        offset = 0
+
+        while True:
+            try:
+                tail = client.service.get_project_log_tail(builddir, offset)
+            except socket.error as e:
+                print(e.message, file=sys.stderr)
+                print("socket error during wait busy occured, retry..",
+                      file=sys.stderr)
+                continue
+
+            # an empty chunk only means, that there is no new data, if
+            # the offset did not change
+            if tail.offset != offset:
+                localtime = time.asctime(time.localtime(time.time()))
+                for line in (tail.data or "").splitlines():
+                    print("%s -- %s" % (localtime, line))
+                offset = tail.offset
+            elif not tail.busy:
+                break
+            else:
+                time.sleep(1)
+
+    @staticmethod
+    def wait_busy_lines(client, builddir):
         part = 1
 
         while True:
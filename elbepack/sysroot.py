@@ -0,0 +1,143 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# Copyright (c) 2018 Linutronix GmbH
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import re
+
+from multiprocessing import cpu_count
+
+# xz block size in multi threaded mode. The output depends on the
+# block size, but not on the number of threads, if it is fixed.
+# This is the default of 'xz -6' (three times the dictionary size).
+# -T1 selects the single threaded mode, which creates a different
+# output, so at least two threads are used for reproducible archives.
+xz_block_size = 3 * 8 * 1024 * 1024
+
+
+def _glob_to_re(pattern):
+    """ translates a pattern of 'find -path' into a regular expression.
+        Like with find, '*' and '?' also match '/'.
+    """
+    i = 0
+    n = len(pattern)
+    res = []
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == '*':
+            res.append('.*')
+        elif c == '?':
+            res.append('.')
+        elif c == '[':
+            j = i
+            if j < n and pattern[j] in '!^':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            while j < n and pattern[j] != ']':
+                j += 1
+            if j >= n:
+                res.append('\\[')
+            else:
+                # a '[' in the class is literal, re would read it as
+                # the start of a nested set
+                stuff = pattern[i:j].replace('\\', '\\\\')
+                stuff = stuff.replace('[', '\\[')
+                i = j + 1
+                if stuff[0] in '!^':
+                    stuff = '^' + stuff[1:]
+                res.append('[%s]' % stuff)
+        else:
+            res.append(re.escape(c))
+    return ''.join(res)
+
+
+class SysrootSelector(object):
+
+    """ Selects the files of a sysroot, which match any of the given
+        'find -path' patterns, e.g. './usr/lib/*.so'. All patterns are
+        compiled into a single regular expression, and the tree is
+        walked once.
+
+        A matching directory is archived recursively by tar, so it is
+        not walked any further.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.matcher = re.compile(
+            '(?:%s)\\Z' % '|'.join(_glob_to_re(p) for p in patterns),
+            re.S)
+
+    def select(self, root):
+        """ returns the sorted list of matching paths below root,
+            relative to root and starting with './', like find prints
+            them.
+        """
+        ret = []
+        self._walk(root, '.', ret)
+        return ret
+
+    def _walk(self, dirname, subpath, out):
+        if self.matcher.match(subpath):
+            out.append(subpath)
+            if subpath != '.':
+                return
+
+        try:
+            names = sorted(os.listdir(dirname))
+        except OSError:
+            return
+
+        for name in names:
+            fname = os.path.join(dirname, name)
+            fpath = subpath + '/' + name
+            # like find, symlinks to directories are not followed
+            if os.path.isdir(fname) and not os.path.islink(fname):
+                self._walk(fname, fpath, out)
+            elif self.matcher.match(fpath):
+                out.append(fpath)
+
+
+def tar_xz_cmd(archive, root, threads=None, reproducible=False):
+    """ returns the command, which creates the xz compressed tar
+        archive of the paths below root, given as '\\0' separated list
+        on stdin.
+
+        With reproducible set, the archive does only depend on the
+        files: tar sorts directory contents by name, and the xz block
+        size is fixed, so that the number of threads does not matter.
+    """
+    if not threads:
+        threads = cpu_count()
+
+    xz = "xz -T%d" % threads
+    opts = ""
+    if reproducible:
+        xz = "xz -T%d --block-size=%d" % (max(threads, 2), xz_block_size)
+        opts = "--sort=name --numeric-owner "
+
+    return 'tar c %s-I "%s" -f "%s" -C "%s" --null -T -' % (
+        opts, xz, archive, root)
+
+
+def sdk_payload_cmd(installer, sdkpath, sysroot, threads=None):
+    """ returns the command, which appends the xz compressed tar
+        archive of the sdk to the installer script. The archive
+        contains sdkpath and the paths below sysroot given as '\0'
+        separated list on stdin, which are stored below
+        sysroots/target.
+    """
+    if not threads:
+        threads = cpu_count()
+
+    # the names of sdkpath do not start with './', so that the
+    # transformation only applies to the sysroot paths. It is not
+    # applied to symlink targets.
+    names = " ".join('"%s"' % n for n in sorted(os.listdir(sdkpath)))
+
+    return ('tar c -I "xz -T%d" -f - -C "%s" %s -C "%s" '
+            '--transform "s,^\\./,./sysroots/target/,S" --null -T - '
+            '>> "%s"' % (threads, sdkpath, names, sysroot, installer))
@@ -15,8 +15,11 @@ import os
 import subprocess
 import sys
 import threading
+import time
 
-from multiprocessing import Process
+from contextlib import contextmanager
+from multiprocessing import Process, Queue
+from Queue import Empty
 from zipfile import (ZipFile, BadZipfile)
 from shutil import copyfile, rmtree, copy
 
@@ -28,7 +31,6 @@ from spyne.decorator import rpc
 from spyne.model.primitive import String
 from suds.client import Client
 
-import apt
 import apt_pkg
 
 from elbepack.aptprogress import (ElbeInstallProgress,
@@ -56,6 +58,7 @@ class UpdateStatus(object):
         self.nosign = False
         self.verbose = False
         self.repo_dir = ""
+        self.timings = []
         self.status_file = '/var/cache/elbe/update_state.txt'
         with rw_access_file(self.status_file, self) as f:
             f.write('ready')
@@ -67,13 +70,35 @@ class UpdateStatus(object):
             f.write(msg)
             f.truncate()
 
+    def _timings_field(self):
+        # the phase durations are appended as an additional field, so
+        # that readers of the first fields are not affected
+        if not self.timings:
+            return ''
+        return '\t' + ' '.join('%s=%.2fs' % t for t in self.timings)
+
     def set_progress(self, step, percent=''):
         self.step = step
-        self.write_status('in_progress\t%d\t%s' % (step, percent))
+        self.write_status('in_progress\t%d\t%s%s' %
+                          (step, percent, self._timings_field()))
 
     def set_finished(self, result):
         self.step = 0
-        self.write_status('finished\t%s' % result)
+        self.write_status('finished\t%s%s' % (result, self._timings_field()))
+        if self.timings:
+            self.log("phase timings: " +
+                     self._timings_field().strip())
+            self.timings = []
+
+    @contextmanager
+    def phase(self, name):
+        # not logged here, in step 3 log() parses the messages as apt
+        # progress output
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timings.append((name, time.time() - start))
 
     def log(self, msg):
         if not msg.endswith('\n'):
@@ -257,7 +282,18 @@ def mark_install(depcache, pkg, ver, auto, status):
                " is not available in the cache")
 
 
-def _apply_update(fname, status):
+def _apply_update(fname, status, timings):
+    # the timings of the parent, e.g. pre_sh, are inherited by the fork,
+    # only pass back the ones of this process
+    status.timings = []
+    try:
+        _apply_update_phases(fname, status)
+    finally:
+        # runs in its own process, pass the phase timings back
+        timings.put(status.timings)
+
+
+def _apply_update_phases(fname, status):
 
     # pylint: disable=too-many-locals
 
@@ -266,62 +302,62 @@ def _apply_update(fname, status):
     except BaseException:
         raise Exception("reading %s failed " % fname)
 
-    fpl = xml.node("fullpkgs")
+    # index the fullpkgs once, instead of searching the list for
+    # every package in the cache
+    fullpkgs = {}
+    for fpi in xml.node("fullpkgs"):
+        fullpkgs[fpi.et.text] = (fpi.et.get('version'), fpi.et.get('auto'))
 
-    sources = apt_pkg.SourceList()
-    sources.read_main_list()
+    with status.phase("init"):
+        sources = apt_pkg.SourceList()
+        sources.read_main_list()
 
-    status.log("initialize apt")
-    apt_pkg.init()
-    cache = apt_pkg.Cache(progress=ElbeOpProgress(cb=status.log))
+        status.log("initialize apt")
+        apt_pkg.init()
+        cache = apt_pkg.Cache(progress=ElbeOpProgress(cb=status.log))
 
     status.set_progress(1)
-    status.log("updating package cache")
-    cache.update(ElbeAcquireProgress(cb=status.log), sources)
-    # quote from python-apt api doc: "A call to this method does not affect the
-    # current Cache object, instead a new one should be created in order to use
-    # the changed index files."
-    cache = apt_pkg.Cache(progress=ElbeOpProgress(cb=status.log))
-    depcache = apt_pkg.DepCache(cache)
-    hl_cache = apt.cache.Cache(progress=ElbeOpProgress(cb=status.log))
-    hl_cache.update(fetch_progress=ElbeAcquireProgress(cb=status.log))
+    with status.phase("update"):
+        status.log("updating package cache")
+        cache.update(ElbeAcquireProgress(cb=status.log), sources)
+        # quote from python-apt api doc: "A call to this method does not
+        # affect the current Cache object, instead a new one should be
+        # created in order to use the changed index files."
+        cache = apt_pkg.Cache(progress=ElbeOpProgress(cb=status.log))
+        depcache = apt_pkg.DepCache(cache)
 
     # go through package cache, if a package is in the fullpkg list of the XML
     #  mark the package for installation (with the specified version)
     #  if it is not mentioned in the fullpkg list purge the package out of the
     #  system.
     status.set_progress(2)
-    status.log("calculating packages to install/remove")
-    count = len(hl_cache)
-    step = count / 10
-    i = 0
-    percent = 0
-    for p in hl_cache:
-        i = i + 1
-        if not i % step:
-            percent = percent + 10
-            status.log(str(percent) + "% - " + str(i) + "/" + str(count))
-            status.set_progress(2, str(percent) + "%")
-
-        pkg = cache[p.name]
-        marked = False
-        for fpi in fpl:
-            if pkg.name == fpi.et.text:
-                mark_install(depcache, pkg,
-                             fpi.et.get('version'),
-                             fpi.et.get('auto'),
-                             status)
-                marked = True
-
-        if not marked:
-            depcache.mark_delete(pkg, True)
+    with status.phase("calculate"):
+        status.log("calculating packages to install/remove")
+        count = cache.package_count
+        step = max(count / 10, 1)
+        i = 0
+        percent = 0
+        for pkg in cache.packages:
+            i = i + 1
+            if not i % step:
+                percent = percent + 10
+                status.log(str(percent) + "% - " + str(i) + "/" + str(count))
+                status.set_progress(2, str(percent) + "%")
+
+            if pkg.name in fullpkgs:
+                ver, auto = fullpkgs[pkg.name]
+                mark_install(depcache, pkg, ver, auto, status)
+            elif pkg.current_state != apt_pkg.CURSTATE_NOT_INSTALLED:
+                # only installed packages or left over config files need
+                # to be purged, marking the others is a no-op
+                depcache.mark_delete(pkg, True)
 
     status.set_progress(3)
-    status.log("applying snapshot")
-    depcache.commit(ElbeAcquireProgress(cb=status.log),
-                    ElbeInstallProgress(cb=status.log))
+    with status.phase("apply"):
+        status.log("applying snapshot")
+        depcache.commit(ElbeAcquireProgress(cb=status.log),
+                        ElbeInstallProgress(cb=status.log))
     del depcache
-    del hl_cache
     del cache
     del sources
 
@@ -410,7 +446,8 @@ def apply_update(fname, status):
     # open, we run the code in an own fork, than the files are closed on
     # process termination an we can remount the filesystem readonly
     # without errors.
-    p = Process(target=_apply_update, args=(fname, status))
+    timings = Queue()
+    p = Process(target=_apply_update, args=(fname, status, timings))
     with rw_access("/", status):
         try:
             t_ver = get_target_version(fname)
@@ -424,17 +461,27 @@ def apply_update(fname, status):
             status.log('get current version failed: ' + str(e))
             c_ver = ""
 
-        pre_sh(c_ver, t_ver, status)
+        status.timings = []
+        with status.phase("pre_sh"):
+            pre_sh(c_ver, t_ver, status)
         p.start()
         p.join()
-        status.log("cleanup /var/cache/apt/archives")
-        # don't use execute() here, it results in an error that the apt-cache
-        # is locked. We currently don't understand this behaviour :(
-        os.system("apt-get clean")
+        try:
+            # the few timings fit into the pipe, so the child could exit
+            status.timings.extend(timings.get(timeout=1))
+        except Empty:
+            pass
+        with status.phase("cleanup"):
+            status.log("cleanup /var/cache/apt/archives")
+            # don't use execute() here, it results in an error that the
+            # apt-cache is locked. We currently don't understand this
+            # behaviour :(
+            os.system("apt-get clean")
         if p.exitcode != 0:
             raise Exception(
                 "Applying update failed. See logfile for more information")
-        post_sh(c_ver, t_ver, status)
+        with status.phase("post_sh"):
+            post_sh(c_ver, t_ver, status)
 
 
 def action_select(upd_file, status):
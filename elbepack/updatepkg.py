@@ -116,12 +116,9 @@ def gen_update_pkg(project, xml_filename, upd_filename,
 
         repo = UpdateRepo(xml, repodir, project.log)
 
-        for fname in fnamelist:
-            path = os.path.join(
-                project.chrootpath,
-                "var/cache/apt/archives",
-                fname)
-            repo.includedeb(path)
+        repo.includedebs([os.path.join(project.chrootpath,
+                                       "var/cache/apt/archives",
+                                       fname) for fname in fnamelist])
 
         repo.finalize()
 
@@ -7,10 +7,44 @@
 
 import os
 import sys
+import hashlib
+
+from threading import Lock
 
 from lxml import etree
 from lxml.etree import XMLParser, parse
 
+elbe_schema = "https://www.linutronix.de/projects/Elbe/dbsfed.xsd"
+
+# compiled schemas, keyed by the schema url and the hash of the schema
+# the url was resolved to (usually a local file via the xml catalog)
+_schema_cache = {}
+
+# an XMLSchema keeps the error_log of the last validation, so the
+# validations with a cached schema are serialized
+schema_lock = Lock()
+
+
+def get_schema(schema_file=elbe_schema):
+    """ returns the compiled XMLSchema for schema_file. Parsing the xsd
+        is cheap, compiling it is not. The compiled schema is reused as
+        long as the parsed schema does not change.
+    """
+    schema_tree = etree.parse(schema_file)
+    digest = hashlib.sha256(etree.tostring(schema_tree)).hexdigest()
+
+    with schema_lock:
+        cached = _schema_cache.get(schema_file)
+        if cached is not None and cached[0] == digest:
+            return cached[1]
+
+    schema = etree.XMLSchema(schema_tree)
+
+    with schema_lock:
+        _schema_cache[schema_file] = (digest, schema)
+
+    return schema
+
 
 def error_log_to_strings(error_log):
     errors = []
@@ -34,30 +68,30 @@ def error_log_to_strings(error_log):
                       "behaviour, please specify <install-recommends /> !\n")
     return errors
 
+
 def validate_xml(fname):
     if os.path.getsize(fname) > (1 << 30):
         return ["%s is greater than 1 GiB. "
                 "Elbe does not support files of this size." % fname]
 
-    schema_file = "https://www.linutronix.de/projects/Elbe/dbsfed.xsd"
     parser = XMLParser(huge_tree=True)
-    schema_tree = etree.parse(schema_file)
-    schema = etree.XMLSchema(schema_tree)
+    schema = get_schema()
 
     try:
         xml = parse(fname, parser=parser)
 
-        if schema.validate(xml):
-            return validate_xml_content(xml)
+        with schema_lock:
+            if not schema.validate(xml):
+                # We have errors, return them in string form...
+                return error_log_to_strings(schema.error_log)
+
+        return validate_xml_content(xml)
     except etree.XMLSyntaxError:
         return ["XML Parse error\n" + str(sys.exc_info()[1])]
     except BaseException:
         return ["Unknown Exception during validation\n" +
                 str(sys.exc_info()[1])]
 
-    # We have errors, return them in string form...
-    return error_log_to_strings(schema.error_log)
-
 
 def validate_xml_content(xml):
     errors = []
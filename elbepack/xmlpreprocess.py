@@ -19,7 +19,7 @@ from lxml.etree import XMLParser, parse
 from elbepack.archivedir import ArchivedirError, combinearchivedir
 from elbepack.directories import elbe_exe
 from elbepack.shellhelper import command_out_stderr, CommandError
-from elbepack.validate import error_log_to_strings
+from elbepack.validate import error_log_to_strings, get_schema, schema_lock
 
 # list of sections that are allowed to exists multiple times before
 # preprocess and that childrens are merge into one section during preprocess
@@ -54,10 +54,8 @@ def xmlpreprocess(fname, output, variants=None):
     else:
         variants = set(variants)
 
-    schema_file = "https://www.linutronix.de/projects/Elbe/dbsfed.xsd"
     parser = XMLParser(huge_tree=True)
-    schema_tree = etree.parse(schema_file)
-    schema = etree.XMLSchema(schema_tree)
+    schema = get_schema()
 
     try:
         xml = parse(fname, parser=parser)
@@ -113,7 +111,11 @@ def xmlpreprocess(fname, output, variants=None):
         # Change public PGP url key to raw key
         preprocess_pgp_key(xml)
 
-        if schema.validate(xml):
+        with schema_lock:
+            valid = schema.validate(xml)
+            errors = error_log_to_strings(schema.error_log)
+
+        if valid:
             # if validation succedes write xml file
             xml.write(
                 output,
@@ -133,7 +135,7 @@ def xmlpreprocess(fname, output, variants=None):
             "Unknown Exception during validation\n" + str(sys.exc_info()[1]))
 
     # We have errors, return them in string form...
-    raise XMLPreprocessError("\n".join(error_log_to_strings(schema.error_log)))
+    raise XMLPreprocessError("\n".join(errors))
 
 
 class PreprocessWrapper(object):    # pylint: disable=too-few-public-methods
@@ -0,0 +1,73 @@
+#!/usr/bin/env python2
+#
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# Copyright (c) 2018 Linutronix GmbH
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Measures the manager round-trips and the duration of the per package
+# RPCAPTCache calls against the batched calls. The real RPCAPTCache
+# methods are called through the real manager proxy, only the apt cache
+# is replaced by the fake of test_rpcaptcache.py, so that no chroot is
+# needed. python-apt must be installed.
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+from optparse import OptionParser
+
+elbe_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, elbe_dir)
+
+# pylint: disable=wrong-import-position
+from test_rpcaptcache import FakeMan, CountingProxy, fake_pkgs
+
+
+def run(name, fn):
+    before = CountingProxy.calls
+    start = time.time()
+    fn()
+    duration = time.time() - start
+    rpcs = CountingProxy.calls - before
+    print("%-28s %6d rpcs %8.3fs" % (name, rpcs, duration))
+
+
+def main():
+    oparser = OptionParser(usage="usage: %prog [options]")
+    oparser.add_option("--pkgs", dest="pkgs", type="int", default=2000,
+                       help="number of packages in the image")
+    (opt, _) = oparser.parse_args()
+
+    pkgs = fake_pkgs(opt.pkgs)
+
+    mm = FakeMan()
+    mm.start()
+
+    # pylint: disable=no-member
+    cache = mm.FakeRPCAPTCache(pkgs)
+
+    names = [p.name for p in pkgs]
+    fullpkgs = [(p.name, p.installed.version, p.installed.md5) for p in pkgs]
+
+    def per_pkg_install():
+        for n in names:
+            cache.mark_install(n, None)
+
+    def per_pkg_check():
+        for n in names:
+            if cache.has_pkg(n):
+                cache.is_installed(n)
+
+    run("mark_install per package", per_pkg_install)
+    run("mark_install_many", lambda: cache.mark_install_many(names))
+    run("check per package", per_pkg_check)
+    run("check_pkglist", lambda: cache.check_pkglist(fullpkgs, full=True))
+
+    mm.shutdown()
+
+
+if __name__ == "__main__":
+    main()
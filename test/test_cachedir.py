@@ -0,0 +1,152 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# Copyright (c) 2018 Linutronix GmbH
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from elbepack.cachedir import CacheDir, cache_key
+
+try:
+    from elbepack.rfs import key_digest
+    import_error = None
+except ImportError as e:
+    # parted or apt are missing
+    import_error = str(e)
+
+
+class TestCacheKey(unittest.TestCase):
+
+    def test_stable(self):
+        self.assertEqual(cache_key('stretch', ['a', 'b'], True),
+                         cache_key('stretch', ['a', 'b'], True))
+
+    def test_list_order(self):
+        self.assertEqual(cache_key('stretch', ['a', 'b']),
+                         cache_key('stretch', ['b', 'a']))
+        self.assertEqual(cache_key(('a', 'b')), cache_key(set(['b', 'a'])))
+
+    def test_values(self):
+        self.assertNotEqual(cache_key('stretch', 'amd64'),
+                            cache_key('stretch', 'armhf'))
+        self.assertNotEqual(cache_key('a', 'b'), cache_key('ab'))
+        self.assertNotEqual(cache_key('a', 'b'), cache_key('b', 'a'))
+        self.assertNotEqual(cache_key(True), cache_key(False))
+
+
+class CountingCacheDir(CacheDir):
+
+    scans = 0
+
+    def _entries(self):
+        self.scans += 1
+        return CacheDir._entries(self)
+
+
+class TestCacheDir(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache = CountingCacheDir("test", 1000, root=self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def store(self, key, size):
+        def populate(path):
+            with open(path, "wb") as f:
+                f.write(b"x" * size)
+        return self.cache.store(key, populate)
+
+    def total(self):
+        with open(os.path.join(self.cache.path, ".total")) as f:
+            return int(f.read())
+
+    def test_store_lookup(self):
+        self.assertEqual(self.cache.lookup("a"), None)
+        path = self.store("a", 10)
+        self.assertEqual(self.cache.lookup("a"), path)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"x" * 10)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_running_total(self):
+        for i in range(50):
+            self.store("e%d" % i, 10)
+        self.assertEqual(self.total(), 500)
+        # only the first store reads the stamps, to create the total
+        self.assertEqual(self.cache.scans, 1)
+
+        # storing a key again does not change the total
+        self.store("e0", 10)
+        self.assertEqual(self.total(), 500)
+
+    def test_evict_lru(self):
+        for i in range(4):
+            self.store("e%d" % i, 250)
+            # the mtime of the stamps orders the entries
+            os.utime(self.cache._stamp("e%d" % i), (i, i))
+        self.assertEqual(self.cache.scans, 1)
+        self.cache.lookup("e0")
+
+        # e0 was used last, e1 is the least recently used one
+        self.store("e4", 250)
+        self.assertEqual(self.cache.scans, 2)
+        self.assertEqual(self.total(), 1000)
+        self.assertEqual(self.cache.lookup("e1"), None)
+        for key in ("e0", "e2", "e3", "e4"):
+            self.assertNotEqual(self.cache.lookup(key), None)
+
+    def test_missing_total(self):
+        self.store("a", 100)
+        os.unlink(os.path.join(self.cache.path, ".total"))
+        self.store("b", 200)
+        self.assertEqual(self.total(), 300)
+
+
+class FakeNode(object):
+
+    def __init__(self, children=None, text=None):
+        self.children = children or {}
+        self.txt = text
+
+    def has(self, path):
+        return path in self.children
+
+    def node(self, path):
+        return self.children[path]
+
+    def text(self, path):
+        return self.children[path].txt
+
+    def __iter__(self):
+        return iter(self.children['url'])
+
+
+def fake_xml(*keys):
+    urls = [FakeNode({'raw-key': FakeNode(text=k)}) for k in keys]
+    return FakeNode({'project/mirror/url-list': FakeNode({'url': urls})})
+
+
+@unittest.skipIf(import_error, "rfs: %s" % import_error)
+class TestKeyDigest(unittest.TestCase):
+
+    key_a = "-----BEGIN-----\n  AAAA\n-----END-----"
+    key_b = "-----BEGIN-----\n  BBBB\n-----END-----"
+
+    def test_raw_keys(self):
+        self.assertEqual(key_digest(fake_xml(self.key_a)),
+                         key_digest(fake_xml(self.key_a)))
+        self.assertNotEqual(key_digest(fake_xml(self.key_a)),
+                            key_digest(fake_xml(self.key_b)))
+        self.assertNotEqual(key_digest(fake_xml(self.key_a)),
+                            key_digest(fake_xml(self.key_a, self.key_b)))
+        self.assertNotEqual(key_digest(fake_xml()),
+                            key_digest(fake_xml(self.key_a)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# Copyright (c) 2018 Linutronix GmbH
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from elbepack.dpkgindex import DpkgFileIndex, dpkg_info
+from elbepack.filesystem import Filesystem
+
+
+class TestDpkgFileIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmp, dpkg_info))
+        self.write_list('base-files', ['/', '/etc', '/etc/issue'])
+        self.write_list('libc6:armhf', ['/', '/lib', '/lib/libc.so.6'])
+        self.write_list('libc6:amd64', ['/', '/lib64', '/lib64/libc.so.6'])
+        self.index = DpkgFileIndex.from_rfs(Filesystem(self.tmp), 'armhf')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write_list(self, name, files):
+        with open(os.path.join(self.tmp, dpkg_info, name + '.list'),
+                  'w') as fp:
+            fp.write('\n'.join(files) + '\n')
+
+    def test_owner(self):
+        self.assertEqual(self.index['/lib/libc.so.6'], 'libc6')
+        self.assertEqual(self.index['/lib64/libc.so.6'], 'libc6:amd64')
+        self.assertEqual(self.index.get('/usr'), None)
+        self.assertNotIn('/usr', self.index)
+
+    def test_files(self):
+        self.assertEqual(self.index.files(['base-files', 'libc6']),
+                         ['/', '/etc', '/etc/issue',
+                          '/lib', '/lib/libc.so.6'])
+
+    def test_files_native_arch(self):
+        self.assertEqual(self.index.files(['libc6:armhf']),
+                         self.index.files(['libc6']))
+
+    def test_files_foreign_arch(self):
+        self.assertEqual(self.index.files(['libc6:amd64']),
+                         ['/', '/lib64', '/lib64/libc.so.6'])
+
+    def test_files_unknown(self):
+        self.assertEqual(self.index.files(['unknown', 'unknown:armhf']), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# Copyright (c) 2018 Linutronix GmbH
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from elbepack import fssnapshot
+from elbepack.filesystem import Filesystem
+from elbepack.fssnapshot import FsSnapshot
+
+
+class TestFsSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fs = Filesystem(self.tmp)
+        self.write('etc/issue', 'elbe\n')
+        self.write('etc/hosts', '127.0.0.1 localhost\n')
+        self.write('usr/bin/true', '')
+        self.write('var/cache/apt/pkgcache.bin', 'cache')
+        os.symlink('usr/bin', os.path.join(self.tmp, 'bin'))
+        os.symlink('issue', os.path.join(self.tmp, 'etc/issue.net'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, fname, data, mtime=None):
+        path = os.path.join(self.tmp, fname)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write(data)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def walk_files(self, exclude_dirs=None):
+        return sorted(f for f, _ in self.fs.walk_files('', exclude_dirs))
+
+    def test_paths(self):
+        snap = FsSnapshot(self.fs)
+        # symlinks to directories are skipped like in walk_files()
+        self.assertEqual(list(snap), self.walk_files())
+        self.assertIn('/etc/issue.net', snap)
+        self.assertNotIn('/bin', snap)
+        self.assertEqual(len(snap), 5)
+
+    def test_exclude_dirs(self):
+        snap = FsSnapshot(self.fs, exclude_dirs=['/var/cache'])
+        self.assertEqual(list(snap), self.walk_files(['var/cache']))
+        self.assertNotIn('/var/cache/apt/pkgcache.bin', snap)
+
+    def test_dirname(self):
+        snap = FsSnapshot(self.fs, 'etc')
+        self.assertEqual(list(snap),
+                         ['/etc/hosts', '/etc/issue', '/etc/issue.net'])
+
+    def test_unchanged(self):
+        self.assertEqual(FsSnapshot(self.fs).diff(FsSnapshot(self.fs)),
+                         (set(), set(), set()))
+
+    def test_diff(self):
+        self.write('etc/hosts', '127.0.0.1 localhost\n', 1000000000)
+        older = FsSnapshot(self.fs)
+
+        # same size, only the mtime differs
+        self.write('etc/hosts', '127.0.0.1 localhost\n', 1000000001)
+        self.write('etc/issue', 'elbe 2\n')
+        os.chmod(os.path.join(self.tmp, 'usr/bin/true'), 0o755)
+        os.unlink(os.path.join(self.tmp, 'etc/issue.net'))
+        shutil.rmtree(os.path.join(self.tmp, 'var'))
+        self.write('etc/motd', 'welcome\n')
+        self.write('zzz/last', '')
+
+        added, removed, changed = FsSnapshot(self.fs).diff(older)
+        self.assertEqual(added, set(['/etc/motd', '/zzz/last']))
+        self.assertEqual(removed, set(['/etc/issue.net',
+                                       '/var/cache/apt/pkgcache.bin']))
+        self.assertEqual(changed, set(['/etc/hosts', '/etc/issue',
+                                       '/usr/bin/true']))
+
+    def test_replaced(self):
+        older = FsSnapshot(self.fs)
+        # a new inode with the same size and mtime
+        st = os.stat(os.path.join(self.tmp, 'etc/issue'))
+        self.write('etc/issue.new', 'elbe\n', st.st_mtime)
+        os.rename(os.path.join(self.tmp, 'etc/issue.new'),
+                  os.path.join(self.tmp, 'etc/issue'))
+        self.assertEqual(FsSnapshot(self.fs).diff(older),
+                         (set(), set(), set(['/etc/issue'])))
+
+    def test_listdir(self):
+        scandir = fssnapshot.scandir
+        fssnapshot.scandir = None
+        try:
+            snap = FsSnapshot(self.fs, exclude_dirs=['/var/cache'])
+        finally:
+            fssnapshot.scandir = scandir
+        self.assertEqual(list(snap), self.walk_files(['var/cache']))
+        self.assertEqual(snap.diff(FsSnapshot(self.fs,
+                                              exclude_dirs=['/var/cache'])),
+                         (set(), set(), set()))
+
+
+if __name__ == '__main__':
+    unittest.main()
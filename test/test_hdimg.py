@@ -0,0 +1,168 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# Copyright (c) 2018 Linutronix GmbH
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+try:
+    from elbepack import hdimg
+    from elbepack.fstab import fstabentry
+    import_error = None
+except ImportError as e:
+    # python-parted is missing
+    import_error = str(e)
+
+KiB = 1024
+MiB = 1024 * KiB
+
+
+class FakeLog(object):
+
+    def do(self, cmd, allow_fail=False, env_add=None):
+        env = dict(os.environ)
+        env.update(env_add or {})
+        ret = subprocess.call(cmd, shell=True, env=env,
+                              stdout=open(os.devnull, "w"),
+                              stderr=subprocess.STDOUT)
+        if ret != 0 and not allow_fail:
+            raise subprocess.CalledProcessError(ret, cmd)
+
+    def printo(self, _text=""):
+        pass
+
+
+def have_command(cmd):
+    return any(os.access(os.path.join(d, cmd), os.X_OK)
+               for d in os.environ.get("PATH", "").split(os.pathsep))
+
+
+def allocated(fname):
+    return os.stat(fname).st_blocks * 512
+
+
+@unittest.skipIf(import_error, "hdimg: %s" % import_error)
+class TestSpliceFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "part.img")
+        self.dst = os.path.join(self.tmp, "disk.img")
+
+        # 4MiB with data at 0, at 1MiB and at the end, holes in between
+        self.chunks = [(0, b"a" * (64 * KiB)),
+                       (1 * MiB, b"b" * (100 * KiB + 1)),
+                       (4 * MiB - 10, b"c" * 10)]
+        with open(self.src, "wb") as f:
+            f.truncate(4 * MiB)
+            for pos, data in self.chunks:
+                f.seek(pos)
+                f.write(data)
+        with open(self.dst, "wb") as f:
+            f.truncate(16 * MiB)
+            f.seek(0)
+            f.write(b"m" * 512)
+
+        if allocated(self.src) >= 4 * MiB:
+            self.skipTest("%s does not support sparse files" % self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def check(self, offset):
+        with open(self.dst, "rb") as f:
+            disk = f.read()
+        self.assertEqual(len(disk), 16 * MiB)
+
+        expected = bytearray(16 * MiB)
+        expected[0:512] = b"m" * 512
+        for pos, data in self.chunks:
+            expected[offset + pos:offset + pos + len(data)] = data
+        self.assertTrue(disk == bytes(expected))
+
+        # the holes of the source are not written
+        self.assertLess(allocated(self.dst), 1 * MiB)
+
+    def test_splice(self):
+        hdimg.splice_file(self.src, self.dst, 2 * MiB)
+        self.check(2 * MiB)
+
+    def test_splice_small_blocks(self):
+        hdimg.splice_file(self.src, self.dst, 3 * MiB + 512,
+                          blocksize=4 * KiB)
+        self.check(3 * MiB + 512)
+
+    def test_splice_read_write(self):
+        copy_file_range = hdimg.copy_file_range
+        hdimg.copy_file_range = None
+        try:
+            hdimg.splice_file(self.src, self.dst, 2 * MiB,
+                              blocksize=40 * KiB)
+        finally:
+            hdimg.copy_file_range = copy_file_range
+        self.check(2 * MiB)
+
+    def test_splice_empty(self):
+        with open(self.src, "wb") as f:
+            f.truncate(4 * MiB)
+        self.chunks = []
+        hdimg.splice_file(self.src, self.dst, 2 * MiB)
+        self.check(2 * MiB)
+
+
+@unittest.skipIf(import_error, "hdimg: %s" % import_error)
+class TestMkfsFromDir(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.srcdir = os.path.join(self.tmp, "rfs")
+        os.makedirs(os.path.join(self.srcdir, "etc"))
+        with open(os.path.join(self.srcdir, "etc", "issue"), "w") as f:
+            f.write("elbe\n")
+        os.symlink("etc/issue", os.path.join(self.srcdir, "issue"))
+
+        self.fname = os.path.join(self.tmp, "part.img")
+        with open(self.fname, "wb") as f:
+            f.truncate(8 * MiB)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    @staticmethod
+    def entry(fstype):
+        # only the attributes, that mkfs_from_dir() uses
+        entry = fstabentry.__new__(fstabentry)
+        entry.fstype = fstype
+        entry.label = "rfs"
+        entry.mkfsopt = ""
+        return entry
+
+    @unittest.skipIf(not have_command("debugfs"), "debugfs is missing")
+    def test_ext4(self):
+        hdimg.mkfs_from_dir(FakeLog(), self.entry("ext4"), self.fname,
+                            self.srcdir)
+
+        def debugfs(req):
+            return subprocess.check_output(["debugfs", "-R", req,
+                                            self.fname],
+                                           stderr=open(os.devnull, "w"))
+
+        self.assertEqual(debugfs("cat /etc/issue"), b"elbe\n")
+        self.assertIn(b"etc/issue", debugfs("stat /issue"))
+        self.assertIn(b"Filesystem volume name:   rfs",
+                      subprocess.check_output(["dumpe2fs", "-h",
+                                               self.fname],
+                                              stderr=open(os.devnull,
+                                                          "w")))
+
+    def test_unsupported(self):
+        self.assertRaises(ValueError, hdimg.mkfs_from_dir, FakeLog(),
+                          self.entry("xfs"), self.fname, self.srcdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# Copyright (c) 2018 Linutronix GmbH
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from elbepack.asciidoclog import read_log_tail
+
+
+class TestReadLogTail(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmp, 'log.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, data):
+        with open(self.fname, 'ab') as fp:
+            fp.write(data)
+
+    def test_missing_log(self):
+        self.assertEqual(read_log_tail(self.fname, 0, True), (0, u''))
+
+    def test_complete_lines_while_busy(self):
+        self.write(b'line 1\nline 2\npart')
+        offset, data = read_log_tail(self.fname, 0, True)
+        self.assertEqual((offset, data), (14, u'line 1\nline 2\n'))
+
+        self.assertEqual(read_log_tail(self.fname, offset, True),
+                         (offset, u''))
+
+        self.write(b'ial\n')
+        self.assertEqual(read_log_tail(self.fname, offset, True),
+                         (22, u'partial\n'))
+
+    def test_rest_when_done(self):
+        self.write(b'line 1\nno newline')
+        self.assertEqual(read_log_tail(self.fname, 7, False),
+                         (17, u'no newline'))
+
+    def test_long_line_is_split(self):
+        self.write(b'x' * 10 + b'\n')
+        self.assertEqual(read_log_tail(self.fname, 0, True, maxsize=4),
+                         (4, u'xxxx'))
+
+    def test_invalid_xml_chars(self):
+        self.write(b'\x1b[31mred\x1b[0m\x00\n')
+        offset, data = read_log_tail(self.fname, 0, True)
+        # the offset counts the bytes of the file, not of the escaped data
+        self.assertEqual(offset, 14)
+        self.assertEqual(data, u'\\x1b[31mred\\x1b[0m\\x00\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
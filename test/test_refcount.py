@@ -0,0 +1,95 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# Copyright (c) 2018 Linutronix GmbH
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import threading
+import unittest
+
+try:
+    from elbepack.efilesystem import RefCountedContext, chroot_reuse_stats
+    import_error = None
+except ImportError as e:
+    # parted, lxml or python-debian are missing
+    RefCountedContext = object
+    import_error = str(e)
+
+
+class Counting(RefCountedContext):
+
+    def __init__(self, fail=False):
+        RefCountedContext.__init__(self)
+        self.setups = 0
+        self.teardowns = 0
+        self.fail = fail
+
+    def _setup(self):
+        if self.fail:
+            raise RuntimeError("setup failed")
+        self.setups += 1
+        # a setup with two subprocesses, one of them a mount
+        self._count(2, 1)
+
+    def _teardown(self, typ, value, traceback):
+        self.teardowns += 1
+        self._count(1, 1)
+
+
+@unittest.skipIf(import_error, "efilesystem: %s" % import_error)
+class TestRefCountedContext(unittest.TestCase):
+
+    def run_in_thread(self, func):
+        # the saved calls are counted per thread
+        result = []
+        t = threading.Thread(target=lambda: result.append(func()))
+        t.start()
+        t.join()
+        return result[0]
+
+    def test_nesting(self):
+        def nested():
+            ctx = Counting()
+            with ctx:
+                with ctx:
+                    with ctx:
+                        self.assertEqual(ctx.setups, 1)
+                self.assertEqual(ctx.teardowns, 0)
+            return ctx.setups, ctx.teardowns, chroot_reuse_stats()
+
+        setups, teardowns, saved = self.run_in_thread(nested)
+        self.assertEqual((setups, teardowns), (1, 1))
+        # two reused entries, each saved a setup and a teardown
+        self.assertEqual(saved, (6, 4))
+
+    def test_sequential(self):
+        def sequential():
+            ctx = Counting()
+            with ctx:
+                pass
+            with ctx:
+                pass
+            return ctx.setups, ctx.teardowns, chroot_reuse_stats()
+
+        self.assertEqual(self.run_in_thread(sequential), (2, 2, (0, 0)))
+
+    def test_failed_setup(self):
+        ctx = Counting(fail=True)
+        with self.assertRaises(RuntimeError):
+            with ctx:
+                pass
+        ctx.fail = False
+        with ctx:
+            self.assertEqual(ctx.setups, 1)
+        self.assertEqual(ctx.teardowns, 1)
+
+    def test_exception_in_body(self):
+        ctx = Counting()
+        with self.assertRaises(ValueError):
+            with ctx:
+                with ctx:
+                    raise ValueError()
+        self.assertEqual((ctx.setups, ctx.teardowns), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
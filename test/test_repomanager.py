@@ -0,0 +1,119 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# Copyright (c) 2018 Linutronix GmbH
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from elbepack.shellhelper import CommandError
+
+try:
+    from elbepack.repomanager import RepoBase
+    import_error = None
+except ImportError as e:
+    # python-debian, gpg or apt are missing
+    RepoBase = object
+    import_error = str(e)
+
+
+class FakeLog(object):
+
+    def __init__(self, fail=()):
+        self.cmds = []
+        self.fail = fail
+
+    def do(self, cmd, **_args):
+        self.cmds.append(cmd)
+        if any(f in cmd for f in self.fail):
+            raise CommandError(cmd, 1)
+
+    def printo(self, _text=""):
+        pass
+
+
+class FakeRepo(RepoBase):
+
+    # pylint: disable=super-init-not-called
+
+    def __init__(self, log, maxsize=None, max_batch=256):
+        self.log = log
+        self.maxsize = maxsize
+        self.max_batch = max_batch
+        self.repo_attr = type('Attr', (), {'codename': 'stretch'})
+        self.fs = type('Fs', (), {'path': '/repo'})
+        self.volume_count = 0
+        self.vol_usage = 0
+        self.reprepro_calls = 0
+        self.reprepro_saved = 0
+        self.volumes = [[]]
+
+    def new_repo_volume(self):
+        self.volume_count += 1
+        self.vol_usage = 0
+        self.volumes.append([])
+
+    def removedeb(self, pkgname, component="main"):
+        self.log.cmds.append('removedeb ' + pkgname)
+
+
+@unittest.skipIf(import_error, "repomanager: %s" % import_error)
+class TestIncludedebs(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def debs(self, *sizes):
+        ret = []
+        for i, size in enumerate(sizes):
+            fname = os.path.join(self.tmp, 'pkg%d_1.0_amd64.deb' % i)
+            with open(fname, 'wb') as fp:
+                fp.write(b'x' * size)
+            ret.append(fname)
+        return ret
+
+    def test_single_batch(self):
+        repo = FakeRepo(FakeLog())
+        repo.includedebs(self.debs(1, 2, 3))
+        self.assertEqual(len(repo.log.cmds), 1)
+        self.assertEqual(repo.reprepro_saved, 2)
+
+    def test_max_batch(self):
+        repo = FakeRepo(FakeLog(), max_batch=2)
+        repo.includedebs(self.debs(1, 1, 1, 1, 1))
+        self.assertEqual(repo.reprepro_calls, 3)
+
+    def test_volumes(self):
+        repo = FakeRepo(FakeLog(), maxsize=10)
+        repo.includedebs(self.debs(4, 4, 4, 4, 4))
+        self.assertEqual(repo.volume_count, 2)
+        self.assertEqual(repo.reprepro_calls, 3)
+        self.assertEqual(repo.vol_usage, 4)
+
+    def test_failed_batch_in_same_volume(self):
+        debs = self.debs(4, 4, 4)
+        # the batch of the first volume fails, its debs are included one
+        # by one, before the second volume is started
+        repo = FakeRepo(FakeLog(fail=['" "']), maxsize=10)
+        volumes = []
+        orig = repo.log.do
+
+        def do(cmd, **args):
+            volumes.append(repo.volume_count)
+            orig(cmd, **args)
+        repo.log.do = do
+
+        repo.includedebs(debs, force=True)
+        self.assertEqual(volumes, [0, 0, 0, 1])
+        self.assertTrue(repo.log.cmds[1].endswith(debs[0]))
+        self.assertTrue(repo.log.cmds[2].endswith(debs[1]))
+        self.assertEqual(repo.vol_usage, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
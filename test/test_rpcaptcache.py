@@ -0,0 +1,175 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# Copyright (c) 2018 Linutronix GmbH
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Tests the batched RPCAPTCache calls with the real cache methods and
+# the real manager proxy. Only the apt cache is replaced by a fake, so
+# the manager round-trips can be counted.
+
+import unittest
+
+from multiprocessing.managers import BaseManager
+
+try:
+    from elbepack.rpcaptcache import RPCAPTCache, RPCAPTCacheProxy
+    import_error = None
+except ImportError as e:
+    # python-apt is missing
+    RPCAPTCache = RPCAPTCacheProxy = object
+    import_error = str(e)
+
+
+class FakeVersion(object):
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, version, md5):
+        self.version = version
+        self.md5 = md5
+
+
+class FakePackage(object):
+
+    def __init__(self, name, version, md5, installed=True, broken=False):
+        self.name = name
+        self.versions = {version: FakeVersion(version, md5)}
+        self.candidate = self.versions[version]
+        self.installed = installed and self.candidate or None
+        self.is_installed = installed
+        self.broken = broken
+        self.marked = None
+
+    def mark_install(self, auto_fix=True, auto_inst=True, from_user=True):
+        # pylint: disable=unused-argument
+        if self.broken:
+            raise SystemError("E:Unable to correct problems")
+        self.marked = ('install', self.candidate.version, from_user)
+
+    def mark_delete(self, auto_fix=True, purge=False):
+        # pylint: disable=unused-argument
+        self.marked = ('delete',)
+
+
+class FakeAptCache(object):
+
+    def __init__(self, pkgs):
+        self.pkgs = dict((p.name, p) for p in pkgs)
+
+    def __contains__(self, name):
+        return name in self.pkgs
+
+    def __getitem__(self, name):
+        return self.pkgs[name]
+
+    def __iter__(self):
+        return iter(sorted(self.pkgs.values(), key=lambda p: p.name))
+
+
+def fake_pkgs(count):
+    return [FakePackage("pkg%d" % i, "1.0-%d" % i, "%032x" % i)
+            for i in range(count)]
+
+
+class FakeRPCAPTCache(RPCAPTCache):
+
+    # pylint: disable=super-init-not-called
+
+    def __init__(self, pkgs):
+        self.cache = FakeAptCache(pkgs)
+
+    def get_marks(self):
+        return dict((p.name, p.marked) for p in self.cache if p.marked)
+
+
+class CountingProxy(RPCAPTCacheProxy):
+
+    """ counts the manager round-trips in the client process """
+
+    _exposed_ = getattr(RPCAPTCacheProxy, '_exposed_', ()) + ('get_marks',)
+    calls = 0
+
+    def get_marks(self):
+        return self._callmethod('get_marks')
+
+    def _callmethod(self, methodname, args=(), kwds=None):
+        CountingProxy.calls += 1
+        return RPCAPTCacheProxy._callmethod(self, methodname, args,
+                                            kwds or {})
+
+
+class FakeMan(BaseManager):
+    pass
+
+
+FakeMan.register("FakeRPCAPTCache", FakeRPCAPTCache,
+                 proxytype=CountingProxy)
+
+
+@unittest.skipIf(import_error, "rpcaptcache: %s" % import_error)
+class TestBatchedCalls(unittest.TestCase):
+
+    def setUp(self):
+        self.pkgs = fake_pkgs(20)
+        self.pkgs.append(FakePackage("broken", "1", "0", broken=True))
+        self.pkgs.append(FakePackage("notinst", "1", "0", installed=False))
+        self.man = FakeMan()
+        self.man.start()
+        # pylint: disable=no-member
+        self.cache = self.man.FakeRPCAPTCache(self.pkgs)
+        CountingProxy.calls = 0
+
+    def tearDown(self):
+        self.man.shutdown()
+
+    def test_mark_install_many(self):
+        names = [p.name for p in self.pkgs if p.name != "notinst"]
+        failed = self.cache.mark_install_many(
+            names + [("pkg3", "1.0-3"), "missing"])
+
+        self.assertEqual(CountingProxy.calls, 1)
+        self.assertEqual(failed[0], ("broken", "E:Unable to correct problems"))
+        self.assertEqual(failed[1], ("missing", None))
+        self.assertEqual(len(failed), 2)
+
+        marks = self.cache.get_marks()
+        self.assertEqual(marks["pkg0"], ("install", "1.0-0", True))
+        self.assertEqual(len(marks), 20)
+
+    def test_mark_pkgs(self):
+        failed = self.cache.mark_pkgs([("pkg1", None, False),
+                                       ("missing", None, True)],
+                                      ["pkg2", "gone"])
+        self.assertEqual(CountingProxy.calls, 1)
+        self.assertEqual(failed, [("missing", None), ("gone", None)])
+
+        marks = self.cache.get_marks()
+        self.assertEqual(marks, {"pkg1": ("install", "1.0-1", False),
+                                 "pkg2": ("delete",)})
+
+    def test_check_pkglist(self):
+        pkgs = [("pkg0", "1.0-0", "%032x" % 0),
+                ("pkg1", "2.0", None),
+                ("pkg2", "1.0-2", "bad"),
+                ("notinst", None, None),
+                ("missing", None, None)]
+
+        errors = self.cache.check_pkglist(pkgs)
+        self.assertEqual(CountingProxy.calls, 1)
+        self.assertEqual(errors, [('version', 'pkg1', '2.0', '1.0-1'),
+                                  ('not_installed', 'notinst', None, None),
+                                  ('missing', 'missing', None, None)])
+
+    def test_check_pkglist_full(self):
+        pkgs = [(p.name, p.installed.version, p.installed.md5)
+                for p in self.pkgs[:19]]
+        pkgs.append(("pkg19", "1.0-19", "bad"))
+
+        errors = self.cache.check_pkglist(pkgs, full=True)
+        self.assertEqual(CountingProxy.calls, 1)
+        self.assertEqual(errors, [('md5', 'pkg19', 'bad', '%032x' % 19),
+                                  ('additional', 'broken', None, None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
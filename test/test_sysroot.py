@@ -0,0 +1,135 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# Copyright (c) 2018 Linutronix GmbH
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Compares the SysrootSelector with 'find -path', which was called for
+# every sysroot path before.
+
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from elbepack.sysroot import SysrootSelector
+
+
+class TestSysrootSelector(unittest.TestCase):
+
+    files = ['usr/include/zlib.h',
+             'usr/include/sys/types.h',
+             'usr/lib/libc.so',
+             'usr/lib/libc.so.6',
+             'usr/lib/libm.so.6',
+             'usr/lib/libz.a',
+             'usr/lib/crt1.o',
+             'usr/lib/arm-linux-gnueabihf/libpthread.so',
+             'usr/lib/arm-linux-gnueabihf/libz.so.1',
+             'usr/lib/pkgconfig/zlib.pc',
+             'usr/share/doc/zlib/copyright',
+             'usr/share/man/man3/zlib.3',
+             'lib/ld-linux.so.3',
+             'opt/a+b/lib[1].so',
+             'etc/issue']
+
+    links = [('usr/lib/arm-linux-gnueabihf', 'usr/lib/target'),
+             ('libc.so.6', 'usr/lib/libc-2.24.so'),
+             ('usr/lib', 'lib64')]
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        for f in self.files:
+            fname = os.path.join(self.tmp, f)
+            if not os.path.isdir(os.path.dirname(fname)):
+                os.makedirs(os.path.dirname(fname))
+            open(fname, 'w').close()
+        os.makedirs(os.path.join(self.tmp, 'usr/lib/empty'))
+        for target, name in self.links:
+            os.symlink(target, os.path.join(self.tmp, name))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def find(self, patterns):
+        out = []
+        for p in patterns:
+            out += subprocess.check_output(
+                ['find', '.', '-path', p],
+                cwd=self.tmp).decode('utf-8').splitlines()
+        return out
+
+    def archived(self, paths):
+        """ the paths, which tar archives for the list """
+        ret = set()
+        for p in paths:
+            ret.add(p)
+            fname = os.path.join(self.tmp, p)
+            if os.path.isdir(fname) and not os.path.islink(fname):
+                for root, dirs, files in os.walk(fname):
+                    sub = os.path.relpath(root, self.tmp)
+                    ret.update('./' + os.path.join(sub, n)
+                               for n in dirs + files)
+        return ret
+
+    def check(self, *patterns):
+        selected = SysrootSelector(list(patterns)).select(self.tmp)
+        self.assertEqual(self.archived(selected),
+                         self.archived(self.find(patterns)))
+        self.assertEqual(len(selected), len(set(selected)))
+        return selected
+
+    def test_plain(self):
+        self.assertEqual(self.check('./usr/lib/libc.so', './etc/issue'),
+                         ['./etc/issue', './usr/lib/libc.so'])
+
+    def test_star_matches_slash(self):
+        selected = self.check('./usr/lib/*.so')
+        self.assertIn('./usr/lib/arm-linux-gnueabihf/libpthread.so',
+                      selected)
+        self.assertIn('./usr/lib/libc-2.24.so', selected)
+
+    def test_question_mark(self):
+        self.check('./usr/lib/libc.so.?', './usr?lib/crt1.o')
+
+    def test_classes(self):
+        selected = self.check('./usr/lib/lib[cm].so*',
+                              './usr/lib/lib[!cm]*',
+                              './usr/lib/lib[^cm]*',
+                              './usr/lib/[]l]ibz.a',
+                              './opt/a+b/lib[[]1].so')
+        self.assertIn('./usr/lib/libz.a', selected)
+        self.assertIn('./opt/a+b/lib[1].so', selected)
+
+    def test_unterminated_class(self):
+        self.check('./usr/lib/libc[.so', './opt/a+b/lib[1')
+
+    def test_symlinked_dirs(self):
+        # the links are selected, but not followed
+        selected = self.check('./usr/lib/target', './lib64/*',
+                              './lib*')
+        self.assertIn('./usr/lib/target', selected)
+        self.assertIn('./lib64', selected)
+        self.assertNotIn('./lib64/libc.so', selected)
+
+    def test_prune(self):
+        selected = self.check('./usr/include', './usr/include/*',
+                              './usr/lib/*', './usr/lib/empty')
+        # the contents of a selected directory are archived with it
+        self.assertIn('./usr/include', selected)
+        self.assertNotIn('./usr/include/zlib.h', selected)
+        self.assertIn('./usr/lib/pkgconfig', selected)
+        self.assertNotIn('./usr/lib/pkgconfig/zlib.pc', selected)
+        self.assertIn('./usr/lib/empty', selected)
+
+    def test_everything(self):
+        self.check('*')
+        self.check('.')
+
+    def test_nothing(self):
+        self.assertEqual(self.check('./nonexistent', './usr/lib/*.dll'),
+                         [])
+
+
+if __name__ == '__main__':
+    unittest.main()
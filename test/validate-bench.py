@@ -0,0 +1,73 @@
+#!/usr/bin/env python2
+#
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# Copyright (c) 2018 Linutronix GmbH
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Measures 'elbe validate' on the xml files in examples/. Each file is
+# validated once by starting 'elbe validate', which includes the startup
+# and the schema compilation, and then in a single process, where the
+# compiled schema is reused after the first file.
+
+from __future__ import print_function
+
+import os
+import sys
+import glob
+import time
+import subprocess
+
+from optparse import OptionParser
+
+elbe_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, elbe_dir)
+
+# pylint: disable=wrong-import-position
+from elbepack.directories import init_directories
+from elbepack.validate import validate_xml
+
+
+def main():
+    oparser = OptionParser(usage="usage: %prog [options] [xmlfiles]")
+    oparser.add_option("--rounds", dest="rounds", type="int", default=3,
+                       help="number of in-process validations per file")
+    (opt, args) = oparser.parse_args()
+
+    # sets XML_CATALOG_FILES, so that the schema is not fetched
+    init_directories(os.path.join(elbe_dir, "elbe"))
+
+    files = args or sorted(glob.glob(os.path.join(elbe_dir,
+                                                  "examples", "*.xml")))
+    elbe = os.path.join(elbe_dir, "elbe")
+
+    print("%-50s %10s %10s %10s" % ("file", "process", "first", "cached"))
+
+    total_proc = 0.0
+    total_cached = 0.0
+    for f in files:
+        start = time.time()
+        subprocess.call([elbe, "validate", f],
+                        stdout=open(os.devnull, "w"))
+        proc = time.time() - start
+
+        start = time.time()
+        validate_xml(f)
+        first = time.time() - start
+
+        start = time.time()
+        for _ in range(opt.rounds):
+            validate_xml(f)
+        cached = (time.time() - start) / max(opt.rounds, 1)
+
+        total_proc += proc
+        total_cached += cached
+        print("%-50s %9.3fs %9.3fs %9.3fs" % (os.path.basename(f),
+                                              proc, first, cached))
+
+    print("%-50s %9.3fs %10s %9.3fs" % ("total", total_proc, "",
+                                        total_cached))
+
+
+if __name__ == "__main__":
+    main()